@@ -0,0 +1,150 @@
+"""
+Block-parallel execution of CPU raster stages.
+
+Index computation, masking, compositing and colorising are plain NumPy
+expressions over whole rasters, which run on a single core and allocate
+whole-raster temporaries for every intermediate result.
+
+The BlockEngine splits rasters into blocks of rows and runs a stage
+function over the blocks on a thread pool. NumPy releases the GIL inside
+its loops, so blocks run truly in parallel. Stage functions write into
+views of preallocated outputs, and their temporaries are block-sized.
+"""
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+
+class BlockEngine:
+    """
+    Thread pool running stage functions over row blocks of rasters.
+
+    Thread-safe; one instance is shared by the whole process.
+    """
+
+    # Pixels per block by default (about 1 MB per float32 band)
+    DEFAULT_BLOCK_PIXELS = 256 * 1024
+
+    def __init__(self, num_workers: Optional[int] = None, block_pixels: int = DEFAULT_BLOCK_PIXELS):
+        """
+        Initialize the engine.
+
+        Args:
+            num_workers: Worker threads (defaults to RASTER_WORKERS env var,
+                then the CPU count)
+            block_pixels: Pixels per block (rows x columns) by default
+        """
+        self.num_workers = num_workers or int(os.getenv("RASTER_WORKERS") or os.cpu_count() or 1)
+        self.block_pixels = block_pixels
+
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()
+
+    def resize(self, num_workers: int) -> None:
+        """
+        Change the number of worker threads for later runs.
+
+        Args:
+            num_workers: Worker threads
+        """
+        with self._lock:
+            if num_workers != self.num_workers:
+                # Runs in flight keep the old pool, whose threads exit once it is dropped
+                self.num_workers = num_workers
+                self._pool = None
+
+    def run(
+        self,
+        func: Callable[..., None],
+        blocked: Sequence[Optional[np.ndarray]],
+        shared: Sequence = (),
+        block_rows: Optional[int] = None,
+    ) -> None:
+        """
+        Run a stage function over row blocks of rasters.
+
+        func is called once per block as func(*blocked_views, *shared): each
+        blocked array is passed as the view of the current block's rows
+        (None stays None), and shared arguments (scalars, lookup tables,
+        anything not laid out along the rows) are passed unchanged. func
+        writes its results into the output views it is given.
+
+        Runs inline when there is a single block, a single worker, or when
+        called from inside another stage function.
+
+        Args:
+            func: Stage function
+            blocked: Outputs and inputs split into row blocks, each of shape
+                (..., height, width); the first one sets the grid
+            shared: Arguments passed whole to every call, after the blocks
+            block_rows: Rows per block (by default sized to block_pixels,
+                with at least one block per worker)
+
+        Raises:
+            ValueError: If a blocked array does not have the grid's height
+        """
+        height, width = blocked[0].shape[-2:]
+        for array in blocked:
+            if array is not None and (array.ndim < 2 or array.shape[-2] != height):
+                raise ValueError(
+                    f"Blocked array of shape {array.shape} does not match grid height {height}"
+                )
+        rows = block_rows or self._block_rows(height, width)
+        blocks = [slice(start, min(start + rows, height)) for start in range(0, height, rows)]
+
+        def call(rows: slice) -> None:
+            func(*[None if a is None else a[..., rows, :] for a in blocked], *shared)
+
+        if len(blocks) == 1 or self.num_workers <= 1 or getattr(self._local, "in_stage", False):
+            for rows in blocks:
+                call(rows)
+            return
+
+        def work(rows: slice) -> None:
+            self._local.in_stage = True
+            try:
+                call(rows)
+            finally:
+                self._local.in_stage = False
+
+        pool = self._executor()
+        futures = [pool.submit(work, rows) for rows in blocks]
+        for future in futures:
+            future.result()
+
+    def _block_rows(self, height: int, width: int) -> int:
+        """Rows per block: about block_pixels, and enough blocks to keep every worker busy."""
+        rows = max(1, self.block_pixels // max(width, 1))
+        return max(1, min(rows, math.ceil(height / self.num_workers)))
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.num_workers, thread_name_prefix="raster-block"
+                )
+            return self._pool
+
+
+_block_engine: Optional[BlockEngine] = None
+_block_engine_lock = threading.Lock()
+
+
+def get_block_engine() -> BlockEngine:
+    """
+    Get the process-wide block engine.
+
+    Returns:
+        BlockEngine instance
+    """
+    global _block_engine
+
+    with _block_engine_lock:
+        if _block_engine is None:
+            _block_engine = BlockEngine()
+        return _block_engine
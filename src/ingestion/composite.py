@@ -2,16 +2,27 @@
 Time-series compositing for satellite imagery.
 
 Creates cloud-free composite images from multiple observations over a time window.
-Uses median compositing for robustness to outliers.
+Uses median compositing for robustness to outliers by default; best-pixel
+compositing picks one whole observation per pixel instead, in a single pass.
 """
 from typing import TYPE_CHECKING, Literal, TypedDict
 
 import numpy as np
 import xarray as xr
 
+from blocks import get_block_engine
+from raster import REFLECTANCE_SCALE, GeoBox, Raster, compact_nodata, scale_dn, to_reflectance
+
 if TYPE_CHECKING:
     pass
 
+# Default memory ceiling for compositing in-memory stacks (MB)
+DEFAULT_MEMORY_LIMIT_MB = 256
+
+# Observation quality scores for best-pixel compositing
+BestPixelMethod = Literal["max_ndvi", "least_cloud", "most_recent_clear"]
+BEST_PIXEL_METHODS = ("max_ndvi", "least_cloud", "most_recent_clear")
+
 
 class CompositeResult(TypedDict):
     """Result of composite generation."""
@@ -25,7 +36,8 @@ class CompositeResult(TypedDict):
 def create_median_composite(
     data_stack: xr.DataArray,
     valid_mask: xr.DataArray | None = None,
-    min_valid_observations: int = 1
+    min_valid_observations: int = 1,
+    memory_limit_mb: int = DEFAULT_MEMORY_LIMIT_MB,
 ) -> CompositeResult:
     """
     Create a median composite from a stack of images.
@@ -33,6 +45,15 @@ def create_median_composite(
     For each pixel, the median value across all valid observations is used.
     This is robust to outliers (clouds, shadows, anomalies).
 
+    Compact integer stacks (see raster.compact_nodata) stay integer: the
+    median is taken over observations that are not nodata, rounded to the
+    nearest DN, and pixels without one are set to nodata instead of NaN.
+
+    In-memory stacks are composited block by block (see _blockwise_median):
+    rows of the grid are processed in blocks sized so the working set stays
+    under memory_limit_mb, straight into a preallocated output. Lazy (dask)
+    stacks are reduced chunk by chunk by dask instead.
+
     Args:
         data_stack: xarray DataArray with time dimension
                     Shape should be (time, band, y, x) or (time, y, x)
@@ -40,6 +61,8 @@ def create_median_composite(
                     If None, assumes all pixels are valid
         min_valid_observations: Minimum number of valid observations required
                                 for a pixel to be included
+        memory_limit_mb: Memory ceiling for the working set of in-memory
+                         stacks, on top of the output
 
     Returns:
         CompositeResult with composite data and metadata
@@ -47,6 +70,13 @@ def create_median_composite(
     if data_stack.size == 0:
         raise ValueError("Empty data stack provided")
 
+    lazy = data_stack.chunks is not None or (valid_mask is not None and valid_mask.chunks is not None)
+    if not lazy and data_stack.dims[0] == "time" and data_stack.dims[-2:] == ("y", "x"):
+        composite, valid_pixels = _blockwise_median(
+            data_stack, valid_mask, min_valid_observations, memory_limit_mb
+        )
+        return _composite_result(data_stack, composite, valid_pixels)
+
     # Determine if we have band dimension
     has_bands = len(data_stack.dims) == 4 and "band" in data_stack.dims
     time_dim = "time"
@@ -70,21 +100,44 @@ def create_median_composite(
     # Apply minimum valid observations threshold
     valid_pixels = valid_count >= min_valid_observations
 
+    nodata = compact_nodata(data_stack)
+
     # Compute median along time dimension
     # NaN values are automatically ignored in nanmedian
-    if has_bands:
+    if nodata is not None:
+        median_composite = _integer_median(data_stack, valid_mask, nodata, time_dim)
+    elif has_bands:
         median_composite = data_stack.median(dim=time_dim, skipna=True)
     else:
         median_composite = data_stack.median(dim=time_dim, skipna=True)
 
-    # Apply valid pixel mask - set invalid pixels to NaN
+    # Reductions drop attrs; keep the CRS for tiles and zonal stats
+    median_composite.attrs.update(data_stack.attrs)
+
+    # Apply valid pixel mask - set invalid pixels to NaN (nodata when compact)
+    fill = median_composite.dtype.type(nodata) if nodata is not None else np.nan
     if has_bands:
-        composite = median_composite.where(valid_pixels)
+        composite = median_composite.where(valid_pixels, fill)
     else:
         # Add band dimension for masking
         valid_pixels_expanded = valid_pixels.broadcast_like(median_composite)
-        composite = median_composite.where(valid_pixels_expanded)
+        composite = median_composite.where(valid_pixels_expanded, fill)
+
+    # Lazy (dask) stacks: read the sources once for the composite and its count
+    if composite.chunks is not None:
+        import dask
+
+        composite, valid_pixels = dask.compute(composite, valid_pixels)
 
+    return _composite_result(data_stack, composite, valid_pixels)
+
+
+def _composite_result(
+    data_stack: xr.DataArray,
+    composite: xr.DataArray,
+    valid_pixels: xr.DataArray | np.ndarray,
+) -> CompositeResult:
+    """Wrap a composite and its valid pixel mask with the stack's metadata."""
     # Count statistics
     total_pixels = valid_pixels.size
     valid_pixel_count = int(valid_pixels.sum())
@@ -100,10 +153,320 @@ def create_median_composite(
         valid_pixel_count=valid_pixel_count,
         total_pixel_count=total_pixels,
         source_dates=source_dates,
-        source_count=data_stack.sizes[time_dim],
+        source_count=data_stack.sizes["time"],
+    )
+
+
+def _blockwise_median(
+    data_stack: xr.DataArray,
+    valid_mask: xr.DataArray | None,
+    min_valid_observations: int,
+    memory_limit_mb: int,
+) -> tuple[xr.DataArray, np.ndarray]:
+    """
+    Median over time of an in-memory stack, in blocks of rows.
+
+    A median over the whole stack sorts a copy of it and allocates several
+    more stack- or output-sized temporaries (counts, masks, where()). Here
+    each block of rows is sorted on its own and its median written into a
+    preallocated output, so memory beyond the stack and the output is
+    bounded by memory_limit_mb whatever the farm size or window length.
+    Blocks run in parallel on the block engine, the ceiling being shared
+    between its workers.
+
+    Args:
+        data_stack: DataArray with time as its first and (y, x) as its last
+            dimensions
+        valid_mask: Optional boolean mask over a subset of the stack's
+            dimensions including time, True = usable observation
+        min_valid_observations: Minimum number of valid observations required
+            for a pixel to be included
+        memory_limit_mb: Memory ceiling for a block's working set
+
+    Returns:
+        Tuple of (composite, valid_pixels): the composite DataArray, and a
+        boolean array over the mask's non-time dimensions, True where a
+        pixel had enough valid observations
+    """
+    nodata = compact_nodata(data_stack)
+    values = data_stack.values
+    times, height = values.shape[0], values.shape[-2]
+
+    # Mask laid out like the stack, with length-1 axes for dimensions it lacks
+    usable = None
+    if valid_mask is not None:
+        dims = [d for d in data_stack.dims if d in valid_mask.dims]
+        usable = valid_mask.transpose(*dims).values.reshape(
+            [valid_mask.sizes[d] if d in valid_mask.dims else 1 for d in data_stack.dims]
+        )
+
+    # Integer stacks without nodata get a float median, as xarray gives them
+    dtype = values.dtype if nodata is not None or values.dtype.kind == "f" else np.dtype(np.float64)
+    out = np.empty(values.shape[1:], dtype=dtype)
+    valid = np.empty(usable.shape[1:] if usable is not None else values.shape[1:], dtype=bool)
+    fill = dtype.type(nodata) if nodata is not None else np.nan
+
+    def median(out: np.ndarray, valid: np.ndarray, values: np.ndarray, usable: np.ndarray | None) -> None:
+        if nodata is not None:
+            out[...] = _median_kernel(np.moveaxis(values, 0, -1), nodata,
+                                      None if usable is None else np.moveaxis(usable, 0, -1))
+        else:
+            # Float stacks skip NaN; the mask only decides which pixels are kept
+            out[...] = _median_kernel(np.moveaxis(values, 0, -1).astype(dtype, copy=False), None)
+
+        if usable is not None:
+            valid[...] = usable.sum(axis=0) >= min_valid_observations
+        else:
+            valid[...] = times >= min_valid_observations
+        np.copyto(out, fill, where=~valid)
+
+    # Per block row: a sorted copy of the stack, its validity and the time-last view's counts
+    engine = get_block_engine()
+    row_bytes = values[:, ..., :1, :].size * (2 * values.itemsize + 2) + out[..., :1, :].size * 8
+    budget = memory_limit_mb * 1024 * 1024 // engine.num_workers
+    rows = int(max(1, min(height, budget // max(row_bytes, 1))))
+
+    engine.run(median, (out, valid, values, usable), block_rows=rows)
+
+    template = data_stack.isel(time=0, drop=True)
+    composite = xr.DataArray(out, coords=template.coords, dims=template.dims, attrs=dict(data_stack.attrs))
+    return composite, valid
+
+
+def _median_kernel(values: np.ndarray, nodata: int | None, usable: np.ndarray | None = None) -> np.ndarray:
+    """
+    Median over the last axis, skipping NaN (floats) or nodata (integers).
+
+    Invalid observations are sorted to the end of each pixel's series, so
+    the median is the mean of the two middle valid values; integers are
+    rounded half up and stay in their dtype. Pixels without a valid
+    observation get NaN or nodata.
+
+    Args:
+        values: Array with time as its last axis
+        nodata: Nodata value of integer data, None for floats
+        usable: Optional boolean mask broadcastable to values, True =
+            usable observation (integer data only)
+
+    Returns:
+        Array without the last axis, in the dtype of values
+    """
+    dtype = values.dtype
+
+    if nodata is None:
+        valid = ~np.isnan(values)
+        ordered = np.sort(values, axis=-1)
+    else:
+        fill = np.iinfo(dtype).max
+        valid = values != nodata
+        if usable is not None:
+            valid &= usable
+        ordered = np.sort(np.where(valid, values, fill), axis=-1)
+
+    count = valid.sum(axis=-1)
+    lo = np.take_along_axis(ordered, (np.maximum(count - 1, 0) // 2)[..., np.newaxis], axis=-1)[..., 0]
+    hi = np.take_along_axis(ordered, (count // 2)[..., np.newaxis], axis=-1)[..., 0]
+
+    if nodata is None:
+        out = (lo + hi) / dtype.type(2)
+        out[count == 0] = np.nan
+    else:
+        out = ((lo.astype(np.uint32) + hi + 1) // 2).astype(dtype)
+        out[count == 0] = nodata
+    return out
+
+
+def _integer_median(
+    data_stack: xr.DataArray,
+    valid_mask: xr.DataArray | None,
+    nodata: int,
+    time_dim: str,
+) -> xr.DataArray:
+    """
+    Median over time of an integer stack, skipping nodata, without floats.
+
+    Invalid observations are sorted to the end of each pixel's series, so
+    the median is the mean of the two middle valid values (rounded half up).
+    Works on dask-backed stacks chunk by chunk when time is a single chunk.
+
+    Args:
+        data_stack: Integer DataArray with a time dimension
+        valid_mask: Optional boolean mask, True = usable observation
+        nodata: Nodata value of the stack
+        time_dim: Name of the time dimension
+
+    Returns:
+        DataArray without the time dimension, in the stack's dtype
+    """
+    dtype = data_stack.dtype
+
+    def median(values: np.ndarray, usable: np.ndarray | None = None) -> np.ndarray:
+        return _median_kernel(values, nodata, usable)
+
+    args = [data_stack]
+    core_dims = [[time_dim]]
+    if valid_mask is not None:
+        args.append(valid_mask.broadcast_like(data_stack))
+        core_dims.append([time_dim])
+
+    return xr.apply_ufunc(
+        median,
+        *args,
+        input_core_dims=core_dims,
+        dask="parallelized",
+        output_dtypes=[dtype],
     )
 
 
+def create_best_pixel_composite(
+    data_stack: xr.DataArray,
+    valid_mask: xr.DataArray | None = None,
+    method: BestPixelMethod = "max_ndvi",
+    min_valid_observations: int = 1,
+    cloud_probability: xr.DataArray | None = None,
+) -> CompositeResult:
+    """
+    Create a composite taking each pixel from its best observation.
+
+    Each pixel gets all bands of the one valid observation with the highest
+    quality score, so bands stay consistent within a pixel. Scenes are
+    streamed one at a time (a lazy stack is computed scene by scene) with a
+    best score, a chosen flag and a count per pixel as the only state, so
+    there is no full time stack in memory and no sort. Each scene is
+    scored and merged block by block on the block engine.
+
+    Methods:
+    - "max_ndvi": highest NDVI, i.e. the greenest, least cloud-contaminated
+      observation (needs "nir" and "red" bands)
+    - "least_cloud": lowest cloud probability, per pixel when
+      cloud_probability is given, otherwise the scene with the largest
+      valid fraction over the grid
+    - "most_recent_clear": latest valid observation by time coordinate,
+      which must hold acquisition datetimes
+
+    An observation is valid at a pixel when every band holds a value (not
+    NaN/nodata) and valid_mask, if given, allows it. Compact integer stacks
+    stay integer.
+
+    Args:
+        data_stack: xarray DataArray with time dimension
+                    Shape should be (time, band, y, x) or (time, y, x)
+        valid_mask: Boolean mask where True = valid pixel for that observation
+                    If None, validity comes from the data alone
+        method: Quality score to pick observations by
+        min_valid_observations: Minimum number of valid observations required
+                                for a pixel to be included
+        cloud_probability: Optional cloud probability (0-1) with dimensions
+                           (time, y, x), for "least_cloud"
+
+    Returns:
+        CompositeResult with composite data and metadata
+    """
+    if method not in BEST_PIXEL_METHODS:
+        raise ValueError(f"Unknown best-pixel method: {method}")
+    if data_stack.size == 0:
+        raise ValueError("Empty data stack provided")
+
+    has_bands = "band" in data_stack.dims
+    stack = data_stack.transpose("time", "band", "y", "x") if has_bands else data_stack.transpose("time", "y", "x")
+    nodata = compact_nodata(stack)
+    times, height, width = stack.sizes["time"], stack.sizes["y"], stack.sizes["x"]
+
+    if method == "max_ndvi":
+        band_names = list(stack.coords.get("band", []))
+        if "nir" not in band_names or "red" not in band_names:
+            raise ValueError(
+                "max_ndvi compositing needs 'nir' and 'red' bands. "
+                f"Available bands: {band_names}"
+            )
+        nir_idx, red_idx = band_names.index("nir"), band_names.index("red")
+    elif method == "most_recent_clear":
+        acquired = stack.coords["time"].values if "time" in stack.coords else None
+        if acquired is None or not np.issubdtype(acquired.dtype, np.datetime64):
+            raise ValueError(
+                "most_recent_clear compositing needs acquisition datetimes as the time coordinate"
+            )
+        # Later acquisitions score higher, whatever order the stack is in;
+        # NaT is the smallest int64, so scenes without a known time rank oldest
+        order = np.argsort(acquired.astype("datetime64[ns]").view(np.int64), kind="stable")
+        rank = np.empty(times, dtype=np.float32)
+        rank[order] = np.arange(times)
+
+    dtype = stack.dtype
+    fill = dtype.type(nodata) if nodata is not None else np.nan
+    template = stack.isel(time=0, drop=True)
+    out = np.full(template.shape, fill, dtype=dtype)
+
+    best = np.full((height, width), -np.inf, dtype=np.float32)
+    chosen = np.zeros((height, width), dtype=bool)
+    count = np.zeros((height, width), dtype=np.int32)
+
+    def validity(ok: np.ndarray, count: np.ndarray, values: np.ndarray, usable: np.ndarray | None) -> None:
+        bands = values if has_bands else values[np.newaxis]
+        if nodata is not None:
+            np.all(bands != nodata, axis=0, out=ok)
+        else:
+            np.logical_not(np.isnan(bands).any(axis=0), out=ok)
+        if usable is not None:
+            while usable.ndim > 2:
+                usable = usable.all(axis=0)
+            ok &= usable
+        count += ok
+
+    def merge(
+        out: np.ndarray,
+        best: np.ndarray,
+        chosen: np.ndarray,
+        ok: np.ndarray,
+        values: np.ndarray,
+        probability: np.ndarray | None,
+        score: np.float32 | None,
+    ) -> None:
+        if method == "max_ndvi":
+            nir = values[nir_idx].astype(np.float32)
+            red = values[red_idx].astype(np.float32)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                score = (nir - red) / (nir + red)
+            score[~np.isfinite(score)] = -np.inf
+        elif probability is not None:
+            score = np.where(np.isnan(probability), -np.inf, -probability.astype(np.float32))
+
+        # A valid observation always beats none, even with an undefined score
+        take = ok & (~chosen | (score > best))
+        np.copyto(best, score, where=take)
+        chosen |= take
+        np.copyto(out, values, where=take)
+
+    engine = get_block_engine()
+    ok = np.empty((height, width), dtype=bool)
+
+    for t in range(times):
+        values = np.asarray(stack.isel(time=t).values)
+        usable = None
+        if valid_mask is not None:
+            usable = np.asarray(valid_mask.isel(time=t).transpose(..., "y", "x").values, dtype=bool)
+        engine.run(validity, (ok, count, values, usable))
+
+        # Scene-wide scores; per-pixel ones are computed block by block
+        probability = None
+        score = None
+        if method == "least_cloud":
+            if cloud_probability is not None:
+                probability = np.asarray(cloud_probability.isel(time=t).transpose(..., "y", "x").values)
+            else:
+                score = np.float32(ok.mean())
+        elif method == "most_recent_clear":
+            score = rank[t]
+
+        engine.run(merge, (out, best, chosen, ok, values, probability), (score,))
+
+    valid_pixels = count >= min_valid_observations
+    np.copyto(out, fill, where=~valid_pixels)
+
+    composite = xr.DataArray(out, coords=template.coords, dims=template.dims, attrs=dict(data_stack.attrs))
+    return _composite_result(data_stack, composite, valid_pixels)
+
+
 def resample_to_resolution(
     data: xr.DataArray,
     target_resolution: int,
@@ -112,6 +475,10 @@ def resample_to_resolution(
     """
     Resample data to a target resolution.
 
+    The source grid comes from the data itself (see GeoBox.from_xarray).
+    Projected grids keep their CRS and extent; geographic grids are moved onto
+    the UTM zone of their centre so the target resolution is in metres.
+
     Args:
         data: Input DataArray with spatial dimensions (y, x)
         target_resolution: Target resolution in meters
@@ -120,101 +487,21 @@ def resample_to_resolution(
     Returns:
         Resampled DataArray at target resolution
     """
-    from rasterio.warp import calculate_default_transform, reproject, Resampling
-    import rasterio
-
     if "y" not in data.dims or "x" not in data.dims:
         raise ValueError("Data must have 'y' and 'x' dimensions")
 
-    # Get current resolution (assume square pixels, estimate from coordinates)
-    y_coords = data.coords["y"].values
-    x_coords = data.coords["x"].values
-
-    # Estimate current resolution from coordinate differences
-    y_res = abs(y_coords[1] - y_coords[0]) if len(y_coords) > 1 else 0.0001
-    x_res = abs(x_coords[1] - x_coords[0]) if len(x_coords) > 1 else 0.0001
+    src = Raster.from_xarray(data)
 
-    # Convert degrees to approximate meters
-    current_res = max(y_res, x_res) * 111000  # ~111km per degree
+    if src.geobox.is_geographic:
+        dst = GeoBox.from_bbox(src.geobox.bounds, target_resolution)
+    else:
+        dst = src.geobox.at_resolution(target_resolution)
 
-    if abs(current_res - target_resolution) < 0.1:
+    if dst == src.geobox:
         # Already at target resolution
         return data
 
-    # Calculate output dimensions
-    width = int(data.sizes["x"] * current_res / target_resolution)
-    height = int(data.sizes["y"] * current_res / target_resolution)
-
-    # Ensure reasonable output size
-    width = max(min(width, 5000), 10)
-    height = max(min(height, 5000), 10)
-
-    # Get bounding box
-    left = float(x_coords.min())
-    right = float(x_coords.max())
-    top = float(y_coords.max())
-    bottom = float(y_coords.min())
-
-    # Reproject for each band
-    result_bands = []
-    band_names = data.coords.get("band", list(range(data.sizes.get("band", 1))))
-
-    for band_idx in range(data.sizes.get("band", 1)):
-        if "band" in data.dims:
-            band_data = data.isel(band=band_idx)
-        else:
-            band_data = data
-
-        # Create destination array
-        dst_shape = (height, width)
-        dst_data = np.zeros(dst_shape, dtype=np.float32)
-
-        # Calculate transform
-        dst_transform, dst_width, dst_height = calculate_default_transform(
-            "EPSG:4326", "EPSG:4326",
-            data.sizes["x"], data.sizes["y"],
-            left=left, bottom=bottom, right=right, top=top,
-            width=width, height=height
-        )
-
-        # Reproject
-        reproject(
-            band_data.values,
-            dst_data,
-            src_transform=rasterio.transform.from_bounds(
-                left, bottom, right, top,
-                data.sizes["x"], data.sizes["y"]
-            ),
-            src_crs="EPSG:4326",
-            dst_transform=dst_transform,
-            dst_crs="EPSG:4326",
-            resampling=Resampling[method]
-        )
-
-        result_bands.append(dst_data)
-
-    # Stack bands back together
-    if len(result_bands) == 1:
-        result = xr.DataArray(
-            result_bands[0],
-            dims=["y", "x"],
-            coords={
-                "y": np.linspace(top, bottom, height),
-                "x": np.linspace(left, right, width),
-            }
-        )
-    else:
-        result = xr.DataArray(
-            np.stack(result_bands),
-            dims=["band", "y", "x"],
-            coords={
-                "band": band_names,
-                "y": np.linspace(top, bottom, height),
-                "x": np.linspace(left, right, width),
-            }
-        )
-
-    return result
+    return src.reproject(dst, method, nodata=compact_nodata(data)).to_xarray(attrs=data.attrs)
 
 
 def merge_providers(
@@ -229,6 +516,14 @@ def merge_providers(
     For premium farms, we combine Sentinel-2 (10m) and PlanetScope (3m).
     The goal is to produce the highest quality composite at the target resolution.
 
+    All inputs are warped onto the grid of the highest resolution provider
+    (at the target resolution); inputs already on that grid are used as-is.
+    Bands are matched by name.
+
+    Compact integer inputs are merged as integers when every input is
+    compact with the same nodata and scale; otherwise they are converted to
+    reflectance first.
+
     Args:
         provider_data: List of DataArrays from each provider
         provider_masks: List of valid masks for each provider
@@ -244,49 +539,73 @@ def merge_providers(
     if len(provider_data) == 0:
         raise ValueError("No provider data provided")
 
-    resolutions = [p.resolution_meters if hasattr(p, 'resolution_meters')
-                   else 10 for p in provider_data]
+    nodatas = [compact_nodata(data) for data in provider_data]
+    scales = {data.attrs.get("scale_factor") for data in provider_data}
+    if any(n is None for n in nodatas) or len(set(nodatas)) > 1 or len(scales) > 1:
+        provider_data = [to_reflectance(data) for data in provider_data]
+        nodata = None
+    else:
+        nodata = nodatas[0]
+
+    rasters = []
+    for data in provider_data:
+        raster = Raster.from_xarray(data)
+        if raster.geobox.is_geographic:
+            # Bring degree grids onto a metric grid so resolutions compare
+            raster = Raster.from_xarray(resample_to_resolution(data, target_resolution))
+        rasters.append(raster)
+
+    resolutions = [r.geobox.resolution for r in rasters]
+    highest_res_idx = int(np.argmin(resolutions))  # Lower number = higher resolution
+    target_grid = rasters[highest_res_idx].geobox.at_resolution(target_resolution)
 
     if merge_method == "highest_resolution":
         # Use highest resolution data where available, fall back to others
-        highest_res_idx = np.argmin(resolutions)  # Lower number = higher resolution
-        highest_res_data = provider_data[highest_res_idx]
-        highest_res_mask = provider_masks[highest_res_idx]
-
-        # Resample all others to match
-        merged = highest_res_data.copy()
-        merged_values = merged.values if "band" in merged.dims else merged.values[np.newaxis, ...]
+        merged = rasters[highest_res_idx].reproject(target_grid, nodata=nodata)
+        merged_values = merged.data.copy()
+        if merged.bands is None:
+            merged_values = merged_values[np.newaxis, ...]
 
-        for idx, (data, mask) in enumerate(zip(provider_data, provider_masks)):
+        for idx, raster in enumerate(rasters):
             if idx == highest_res_idx:
                 continue
 
-            # Resample to target
-            resampled = resample_to_resolution(data, target_resolution)
-            resampled_mask = resample_to_resolution(mask, target_resolution)
+            resampled = raster.reproject(target_grid, nodata=nodata)
 
-            # Where higher resolution has NaN, fill from lower resolution
+            # Where higher resolution has NaN (nodata), fill from lower resolution
             for band_idx in range(merged_values.shape[0]):
+                if merged.bands is not None:
+                    name = merged.bands[band_idx]
+                    if resampled.bands is None or name not in resampled.bands:
+                        continue
+                    band_resampled = resampled.band(name)
+                else:
+                    band_resampled = resampled.data
+
                 band_merged = merged_values[band_idx]
-                band_resampled = resampled.values[band_idx] if "band" in resampled.dims else resampled.values
+                missing = np.isnan(band_merged) if nodata is None else band_merged == nodata
+                merged_values[band_idx] = np.where(missing, band_resampled, band_merged)
 
-                mask_merged = np.isnan(band_merged)
-                band_merged = np.where(mask_merged, band_resampled, band_merged)
-                merged_values[band_idx] = band_merged
+        if merged.bands is None:
+            merged_values = merged_values[0]
 
-        return merged
+        return Raster(merged_values, target_grid, merged.bands).to_xarray(
+            attrs=provider_data[highest_res_idx].attrs
+        )
 
     elif merge_method == "median":
-        # Resample all to target resolution, take median
+        # Resample all onto the target grid, take median
         resampled_data = []
-        for data, mask in zip(provider_data, provider_masks):
-            resampled = resample_to_resolution(data, target_resolution)
-            resampled_mask = resample_to_resolution(mask, target_resolution)
-            resampled_data.append(resampled.where(resampled_mask))
+        for raster, data, mask in zip(rasters, provider_data, provider_masks):
+            resampled = to_reflectance(raster.reproject(target_grid, nodata=nodata).to_xarray(attrs=data.attrs))
+            # Masks are derived from the data, so they share its grid
+            mask = mask.assign_attrs(GeoBox.from_xarray(data).to_attrs())
+            resampled_mask = Raster.from_xarray(mask).reproject(target_grid, "nearest").to_xarray()
+            resampled_data.append(resampled.where(resampled_mask == 1))
 
-        # Stack and take median
-        stacked = xr.concat(resampled_data, dim="provider")
-        return stacked.median(dim="provider", skipna=True)
+        # Stack and take median (same grid, so only bands can differ)
+        stacked = xr.concat(resampled_data, dim="provider", join="inner")
+        return stacked.median(dim="provider", skipna=True).assign_attrs(target_grid.to_attrs())
 
     else:
         raise ValueError(f"Unknown merge method: {merge_method}")
@@ -296,8 +615,11 @@ def compute_ndvi(data: xr.DataArray) -> xr.DataArray:
     """
     Compute NDVI from NIR and Red bands.
 
+    Computed block by block on the shared block engine (see blocks.py).
+
     Args:
         data: DataArray with band dimension including "nir" and "red"
+            (float reflectance or compact DN)
 
     Returns:
         NDVI DataArray
@@ -324,14 +646,20 @@ def compute_ndvi(data: xr.DataArray) -> xr.DataArray:
                 f"Available bands: {band_names}"
             )
 
-    nir = data.isel(band=nir_idx)
-    red = data.isel(band=red_idx)
+    nir, red = _band_values(data, [nir_idx, red_idx])
+    reflectance = _reflectance_block(data)
 
-    with np.errstate(divide="ignore", invalid="ignore"):
-        ndvi = (nir - red) / (nir + red)
-        ndvi = np.where(np.isfinite(ndvi), ndvi, np.nan)
+    def ndvi(out: np.ndarray, nir: np.ndarray, red: np.ndarray) -> None:
+        # Compact bands are scaled to reflectance here, one block at a time
+        nir, red = reflectance(nir), reflectance(red)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            np.divide(nir - red, nir + red, out=out)
+        out[~np.isfinite(out)] = np.nan
 
-    return ndvi
+    dtype = np.float32 if compact_nodata(data) is not None else np.result_type(nir, red, np.float32)
+    out = np.empty(nir.shape, dtype=dtype)
+    get_block_engine().run(ndvi, (out, nir, red))
+    return out
 
 
 def compute_evi(
@@ -348,6 +676,7 @@ def compute_evi(
 
     Args:
         data: DataArray with band dimension including "nir", "red", "blue"
+            (float reflectance or compact DN)
         g: Gain factor (default 2.5)
         c1: Coefficient 1 for aerosol resistance (default 6.0)
         c2: Coefficient 2 for aerosol resistance (default 7.5)
@@ -371,15 +700,20 @@ def compute_evi(
             f"Available bands: {band_names}"
         )
 
-    nir = data.isel(band=nir_idx).astype(float)
-    red = data.isel(band=red_idx).astype(float)
-    blue = data.isel(band=blue_idx).astype(float)
+    nir, red, blue = _band_values(data, [nir_idx, red_idx, blue_idx])
+    reflectance = _reflectance_block(data)
 
-    with np.errstate(divide="ignore", invalid="ignore"):
-        evi = g * (nir - red) / (nir + c1 * red - c2 * blue + l)
-        evi = np.where(np.isfinite(evi), evi, np.nan)
+    def evi(out: np.ndarray, nir: np.ndarray, red: np.ndarray, blue: np.ndarray) -> None:
+        nir = reflectance(nir).astype(float)
+        red = reflectance(red).astype(float)
+        blue = reflectance(blue).astype(float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            np.divide(g * (nir - red), nir + c1 * red - c2 * blue + l, out=out)
+        out[~np.isfinite(out)] = np.nan
 
-    return evi
+    out = np.empty(nir.shape, dtype=float)
+    get_block_engine().run(evi, (out, nir, red, blue))
+    return out
 
 
 def compute_ndwi(data: xr.DataArray) -> xr.DataArray:
@@ -392,6 +726,7 @@ def compute_ndwi(data: xr.DataArray) -> xr.DataArray:
 
     Args:
         data: DataArray with band dimension including "nir" and "swir"
+            (float reflectance or compact DN)
 
     Returns:
         NDWI DataArray
@@ -411,11 +746,36 @@ def compute_ndwi(data: xr.DataArray) -> xr.DataArray:
             f"Available bands: {band_names}"
         )
 
-    nir = data.isel(band=nir_idx).astype(float)
-    swir = data.isel(band=swir_idx).astype(float)
+    nir, swir = _band_values(data, [nir_idx, swir_idx])
+    reflectance = _reflectance_block(data)
+
+    def ndwi(out: np.ndarray, nir: np.ndarray, swir: np.ndarray) -> None:
+        nir = reflectance(nir).astype(float)
+        swir = reflectance(swir).astype(float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            np.divide(nir - swir, nir + swir, out=out)
+        out[~np.isfinite(out)] = np.nan
 
-    with np.errstate(divide="ignore", invalid="ignore"):
-        ndwi = (nir - swir) / (nir + swir)
-        ndwi = np.where(np.isfinite(ndwi), ndwi, np.nan)
+    out = np.empty(nir.shape, dtype=float)
+    get_block_engine().run(ndwi, (out, nir, swir))
+    return out
+
+
+def _band_values(data: xr.DataArray, indices: list[int]) -> list[np.ndarray]:
+    """Values of bands by index, computed if lazy; views of in-memory data."""
+    return [np.asarray(data.isel(band=idx).values) for idx in indices]
+
+
+def _reflectance_block(data: xr.DataArray):
+    """
+    Function turning a block of band values of data into float reflectance.
+
+    Same conversion as raster.to_reflectance: compact DN are scaled and
+    their nodata set to NaN, float values are returned as they are.
+    """
+    nodata = compact_nodata(data)
+    if nodata is None:
+        return lambda values: values
 
-    return ndwi
+    scale = data.attrs.get("scale_factor", REFLECTANCE_SCALE)
+    return lambda values: scale_dn(values, nodata, scale)
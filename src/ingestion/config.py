@@ -40,6 +40,15 @@ class PipelineConfig:
     max_cloud_cover: int = 50
     min_cloud_free_pct: float = 0.3
 
+    # Compositing: "median", or a best-pixel method ("max_ndvi",
+    # "least_cloud", "most_recent_clear"); memory ceiling for median
+    # compositing of in-memory stacks (MB)
+    composite_method: str = "median"
+    composite_memory_mb: int = 256
+
+    # Threads for block-parallel raster stages (0 = one per CPU)
+    raster_workers: int = 0
+
     # Provider settings
     default_provider: str = "sentinel2"
     enable_planet_scope: bool = False
@@ -60,6 +69,9 @@ def load_env_config() -> PipelineConfig:
     - COMPOSITE_WINDOW_DAYS: Days for time-series composite (default: 21)
     - MAX_CLOUD_COVER: Max cloud cover percentage (default: 50)
     - MIN_CLOUD_FREE_PCT: Min cloud-free % for valid observation (default: 0.3)
+    - COMPOSITE_METHOD: median, max_ndvi, least_cloud or most_recent_clear (default: median)
+    - COMPOSITE_MEMORY_MB: Memory ceiling for median compositing (default: 256)
+    - RASTER_WORKERS: Threads for raster stages (default: 0 = one per CPU)
     - DEFAULT_PROVIDER: Default satellite provider (default: sentinel2)
     - ENABLE_PLANET_SCOPE: Enable PlanetScope integration (default: false)
     - OUTPUT_DIR: Output directory (default: output)
@@ -96,6 +108,9 @@ def load_env_config() -> PipelineConfig:
         composite_window_days=get_int("COMPOSITE_WINDOW_DAYS", 21),
         max_cloud_cover=get_int("MAX_CLOUD_COVER", 50),
         min_cloud_free_pct=get_float("MIN_CLOUD_FREE_PCT", 0.3),
+        composite_method=os.environ.get("COMPOSITE_METHOD", "median"),
+        composite_memory_mb=get_int("COMPOSITE_MEMORY_MB", 256),
+        raster_workers=get_int("RASTER_WORKERS", 0),
         default_provider=os.environ.get("DEFAULT_PROVIDER", "sentinel2"),
         enable_planet_scope=get_bool("ENABLE_PLANET_SCOPE", False),
         output_dir=os.environ.get("OUTPUT_DIR", "output"),
@@ -13,6 +13,8 @@ from typing import Optional
 
 import requests
 
+from providers.auth import TokenRequestError, get_token_broker
+
 logger = logging.getLogger(__name__)
 
 
@@ -42,44 +44,49 @@ class CopernicusChecker:
         self.client_id = client_id or os.getenv("COPERNICUS_CLIENT_ID")
         self.client_secret = client_secret or os.getenv("COPERNICUS_CLIENT_SECRET")
 
-        self._access_token: Optional[str] = None
-        self._token_expires_at: Optional[datetime] = None
-
     def _get_access_token(self) -> str:
-        """Get or refresh the OAuth2 access token."""
-        # Check if we have a valid cached token
-        if self._access_token and self._token_expires_at:
-            if datetime.now() < self._token_expires_at - timedelta(minutes=5):
-                return self._access_token
-
+        """Get an OAuth2 access token from the shared token broker."""
         if not self.client_id or not self.client_secret:
             raise ValueError(
                 "Copernicus credentials not configured. "
                 "Set COPERNICUS_CLIENT_ID and COPERNICUS_CLIENT_SECRET environment variables."
             )
 
-        response = requests.post(
-            self.TOKEN_URL,
-            data={
-                "grant_type": "client_credentials",
-                "client_id": self.client_id,
-                "client_secret": self.client_secret,
-            },
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-            timeout=30,
-        )
-
-        if response.status_code != 200:
+        try:
+            return get_token_broker().get_token(self.TOKEN_URL, self.client_id, self.client_secret)
+        except TokenRequestError as e:
             raise RuntimeError(
-                f"Failed to get Copernicus access token: {response.status_code} - {response.text}"
-            )
+                f"Failed to get Copernicus access token: {e.status_code} - {e.text}"
+            ) from e
 
-        token_data = response.json()
-        self._access_token = token_data["access_token"]
-        expires_in = token_data.get("expires_in", 300)
-        self._token_expires_at = datetime.now() + timedelta(seconds=expires_in)
+    def _catalog_get(self, url: str, params: dict) -> requests.Response:
+        """
+        GET a catalog URL with a bearer token.
 
-        return self._access_token
+        A 401 means the cached token was revoked or expired early; it is
+        dropped from the token broker and the request is sent once more
+        with a new one.
+
+        Args:
+            url: Catalog URL
+            params: Query parameters
+
+        Returns:
+            requests.Response
+        """
+        for attempt in range(2):
+            token = self._get_access_token()
+            response = requests.get(
+                url,
+                params=params,
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=30,
+            )
+            if response.status_code != 401 or attempt:
+                break
+            logger.warning("Catalog rejected the access token, retrying with a new one")
+            get_token_broker().invalidate(self.TOKEN_URL, self.client_id, self.client_secret, token)
+        return response
 
     def get_latest_imagery_date(
         self,
@@ -98,8 +105,6 @@ class CopernicusChecker:
         Returns:
             Date string (YYYY-MM-DD) of most recent imagery, or None if not found
         """
-        token = self._get_access_token()
-
         # Date range
         end_date = datetime.utcnow()
         start_date = end_date - timedelta(days=days_back)
@@ -130,12 +135,7 @@ class CopernicusChecker:
 
         logger.debug(f"Querying Copernicus catalog for latest imagery...")
 
-        response = requests.get(
-            url,
-            params=params,
-            headers={"Authorization": f"Bearer {token}"},
-            timeout=30,
-        )
+        response = self._catalog_get(url, params)
 
         if response.status_code != 200:
             logger.error(f"Catalog query failed: {response.status_code}")
@@ -183,8 +183,6 @@ class CopernicusChecker:
         Returns:
             Number of available products
         """
-        token = self._get_access_token()
-
         west, south, east, north = bbox
         footprint = f"POLYGON(({west} {south},{east} {south},{east} {north},{west} {north},{west} {south}))"
 
@@ -202,12 +200,7 @@ class CopernicusChecker:
         url = f"{self.CATALOG_URL}/Products/$count"
         params = {"$filter": filter_str}
 
-        response = requests.get(
-            url,
-            params=params,
-            headers={"Authorization": f"Bearer {token}"},
-            timeout=30,
-        )
+        response = self._catalog_get(url, params)
 
         if response.status_code != 200:
             logger.error(f"Count query failed: {response.status_code}")
@@ -36,7 +36,10 @@ from config import (
     get_paddocks_geojson,
 )
 from providers import ProviderFactory, ActivationTimeoutError, QuotaExceededError
+from blocks import get_block_engine
 from composite import (
+    BEST_PIXEL_METHODS,
+    create_best_pixel_composite,
     create_median_composite,
     resample_to_resolution,
     merge_providers,
@@ -44,6 +47,7 @@ from composite import (
     compute_evi,
     compute_ndwi,
 )
+from raster import GeoBox, Raster, to_reflectance, valid_pixels
 from zonal_stats import compute_zonal_stats
 from writer import write_observations_to_convex, notify_completion
 from observation_types import ObservationRecord
@@ -70,10 +74,10 @@ def create_rgb_composite(bands: 'xr.DataArray') -> 'np.ndarray':
     """
     import numpy as np
 
-    # Extract RGB bands
-    red = bands.sel(band='red').values
-    green = bands.sel(band='green').values
-    blue = bands.sel(band='blue').values
+    # Extract RGB bands (compact DN scaled to reflectance)
+    red = to_reflectance(bands.sel(band='red')).values
+    green = to_reflectance(bands.sel(band='green')).values
+    blue = to_reflectance(bands.sel(band='blue')).values
 
     # Stack into RGB array
     rgb = np.stack([red, green, blue], axis=0)
@@ -81,9 +85,13 @@ def create_rgb_composite(bands: 'xr.DataArray') -> 'np.ndarray':
     # Scale reflectance (0-1) to 0-255 with contrast enhancement
     # Apply percentile stretch for better visualization
     p2, p98 = np.nanpercentile(rgb, [2, 98])
-    rgb_scaled = np.clip((rgb - p2) / (p98 - p2) * 255, 0, 255)
 
-    return rgb_scaled.astype(np.uint8)
+    def stretch(out: 'np.ndarray', rgb: 'np.ndarray') -> None:
+        np.copyto(out, np.clip((rgb - p2) / (p98 - p2) * 255, 0, 255), casting="unsafe")
+
+    rgb_scaled = np.empty(rgb.shape, dtype=np.uint8)
+    get_block_engine().run(stretch, (rgb_scaled, rgb))
+    return rgb_scaled
 
 
 def save_geotiff(
@@ -240,49 +248,50 @@ def colorize_ndvi_to_png(
 
     height, width = ndvi.shape
 
-    # Create RGBA output array
-    rgba = np.zeros((height, width, 4), dtype=np.uint8)
-
-    # Create mask for valid (non-NaN) pixels
-    valid_mask = ~np.isnan(ndvi)
+    def colorize(rgba: 'np.ndarray', ndvi: 'np.ndarray') -> None:
+        # Create mask for valid (non-NaN) pixels
+        valid_mask = ~np.isnan(ndvi)
 
-    # Apply color ramp using linear interpolation
-    for i in range(len(NDVI_COLOR_RAMP) - 1):
-        val_low, color_low = NDVI_COLOR_RAMP[i]
-        val_high, color_high = NDVI_COLOR_RAMP[i + 1]
+        # Apply color ramp using linear interpolation
+        for i in range(len(NDVI_COLOR_RAMP) - 1):
+            val_low, color_low = NDVI_COLOR_RAMP[i]
+            val_high, color_high = NDVI_COLOR_RAMP[i + 1]
 
-        # Find pixels in this range
-        in_range = valid_mask & (ndvi >= val_low) & (ndvi < val_high)
+            # Find pixels in this range
+            in_range = valid_mask & (ndvi >= val_low) & (ndvi < val_high)
 
-        if np.any(in_range):
-            # Calculate interpolation factor (0-1)
-            t = (ndvi[in_range] - val_low) / (val_high - val_low)
-            t = np.clip(t, 0, 1)
+            if np.any(in_range):
+                # Calculate interpolation factor (0-1)
+                t = (ndvi[in_range] - val_low) / (val_high - val_low)
+                t = np.clip(t, 0, 1)
 
-            # Interpolate RGB values
-            for c in range(3):
-                rgba[in_range, c] = np.round(
-                    color_low[c] + t * (color_high[c] - color_low[c])
-                ).astype(np.uint8)
+                # Interpolate RGB values
+                for c in range(3):
+                    rgba[c][in_range] = np.round(
+                        color_low[c] + t * (color_high[c] - color_low[c])
+                    ).astype(np.uint8)
 
-            # Set alpha to fully opaque for valid pixels
-            rgba[in_range, 3] = 255
+                # Set alpha to fully opaque for valid pixels
+                rgba[3][in_range] = 255
 
-    # Handle values at or above the max threshold
-    at_max = valid_mask & (ndvi >= NDVI_COLOR_RAMP[-1][0])
-    if np.any(at_max):
-        for c in range(3):
-            rgba[at_max, c] = NDVI_COLOR_RAMP[-1][1][c]
-        rgba[at_max, 3] = 255
+        # Handle values at or above the max threshold
+        at_max = valid_mask & (ndvi >= NDVI_COLOR_RAMP[-1][0])
+        if np.any(at_max):
+            for c in range(3):
+                rgba[c][at_max] = NDVI_COLOR_RAMP[-1][1][c]
+            rgba[3][at_max] = 255
 
-    # Handle values below the min threshold
-    at_min = valid_mask & (ndvi < NDVI_COLOR_RAMP[0][0])
-    if np.any(at_min):
-        for c in range(3):
-            rgba[at_min, c] = NDVI_COLOR_RAMP[0][1][c]
-        rgba[at_min, 3] = 255
+        # Handle values below the min threshold
+        at_min = valid_mask & (ndvi < NDVI_COLOR_RAMP[0][0])
+        if np.any(at_min):
+            for c in range(3):
+                rgba[c][at_min] = NDVI_COLOR_RAMP[0][1][c]
+            rgba[3][at_min] = 255
 
-    # Invalid (NaN) pixels remain transparent (alpha = 0)
+    # Create RGBA output array (band first, so blocks of rows are views),
+    # colorized block by block; invalid (NaN) pixels remain transparent (alpha = 0)
+    rgba = np.zeros((4, height, width), dtype=np.uint8)
+    get_block_engine().run(colorize, (rgba, ndvi))
 
     return save_rgba_png(rgba, output_path)
 
@@ -424,7 +433,8 @@ def get_historical_windows(
 def run_pipeline_for_farm(
     farm_config: FarmConfig,
     pipeline_config: Optional[PipelineConfig] = None,
-    convex_writer: Optional[Callable[[list[ObservationRecord]], int]] = None
+    convex_writer: Optional[Callable[[list[ObservationRecord]], int]] = None,
+    sentinel2_provider: Optional[Any] = None,
 ) -> PipelineResult:
     """
     Run the complete processing pipeline for a single farm.
@@ -433,6 +443,8 @@ def run_pipeline_for_farm(
         farm_config: Farm configuration
         pipeline_config: Pipeline configuration (uses defaults if None)
         convex_writer: Optional function to write observations to Convex
+        sentinel2_provider: Optional Sentinel-2 provider shared across farms
+            (the scheduler passes one carrying a scene batch plan)
 
     Returns:
         PipelineResult with observation records
@@ -440,6 +452,13 @@ def run_pipeline_for_farm(
     if pipeline_config is None:
         pipeline_config = load_env_config()
 
+    composite_method = pipeline_config.composite_method
+    if composite_method != "median" and composite_method not in BEST_PIXEL_METHODS:
+        raise ValueError(f"Unknown composite method: {composite_method}")
+
+    if pipeline_config.raster_workers > 0:
+        get_block_engine().resize(pipeline_config.raster_workers)
+
     logger.info(f"Processing farm: {farm_config.name} ({farm_config.external_id})")
     logger.info(f"  Tier: {farm_config.subscription_tier}")
     logger.info(f"  Premium features: {farm_config.is_premium}")
@@ -448,6 +467,7 @@ def run_pipeline_for_farm(
     providers = ProviderFactory.get_providers_for_tier(
         tier=farm_config.subscription_tier,
         planet_api_key=farm_config.planet_api_key,
+        sentinel2_provider=sentinel2_provider,
     )
 
     if not providers:
@@ -501,23 +521,65 @@ def run_pipeline_for_farm(
 
             logger.info(f"  Found {len(items)} items")
 
+            # Drop items that are too cloudy over the paddocks before any band is loaded
+            items = provider.prefilter(
+                items,
+                bbox,
+                min_clear_fraction=pipeline_config.min_cloud_free_pct,
+                geometries=[p["geometry"] for p in farm_config.paddocks if p.get("geometry")],
+            )
+            if not items:
+                logger.warning(f"No items from {provider.__class__.__name__} clear enough over the farm")
+                continue
+
             # Get band names needed for indices
             band_names = list(provider.band_names.keys())
             if "swir" in band_names and not provider.band_names.get("swir"):
                 band_names.remove("swir")
 
-            # Load bands
-            logger.info(f"  Loading bands: {band_names}")
-            data = provider.load(items, band_names, bbox)
+            # Lazy loads are read while they are masked and composited
+            with provider.compute_context():
+                # Load bands
+                logger.info(f"  Loading bands: {band_names}")
+                data = provider.load(items, band_names, bbox)
+
+                # Apply cloud masking
+                logger.info("  Applying cloud mask...")
+                masked_data, cloud_free_pct, cloud_mask = provider.cloud_mask(data, items, bbox)
+                logger.info(f"  Cloud-free pixels: {cloud_free_pct:.1%}")
+
+                # Multi-date stacks are reduced to a per-pixel median of the clear
+                # observations, or to the best clear observation of each pixel
+                if "time" in masked_data.dims:
+                    logger.info(
+                        f"  Compositing {masked_data.sizes['time']} acquisitions ({composite_method})..."
+                    )
+                    if composite_method == "median":
+                        composite_result = create_median_composite(
+                            masked_data,
+                            valid_pixels(masked_data),
+                            memory_limit_mb=pipeline_config.composite_memory_mb,
+                        )
+                    else:
+                        composite_result = create_best_pixel_composite(
+                            masked_data,
+                            valid_pixels(masked_data),
+                            method=composite_method,
+                        )
+                    masked_data = composite_result["composite"]
 
-            # Apply cloud masking
-            logger.info("  Applying cloud mask...")
-            masked_data, cloud_free_pct, cloud_mask = provider.cloud_mask(data, items, bbox)
-            logger.info(f"  Cloud-free pixels: {cloud_free_pct:.1%}")
+                    if "time" in cloud_mask.dims:
+                        # A pixel stays masked only if no acquisition saw it clear
+                        cloud_mask = cloud_mask.all(dim="time").assign_attrs(cloud_mask.attrs)
+                    cloud_free_pct = float((~cloud_mask).mean())
+                    logger.info(
+                        f"  Composite from {composite_result['source_count']} acquisitions, "
+                        f"cloud-free pixels: {cloud_free_pct:.1%}"
+                    )
 
             all_provider_data.append(masked_data)
             # Create mask where True = valid pixel
-            valid_mask = ~masked_data.isnull()
+            valid_mask = valid_pixels(masked_data)
             all_provider_masks.append(valid_mask)
             all_provider_cloud_pcts.append(cloud_free_pct)
             all_provider_cloud_masks.append(cloud_mask)
@@ -565,10 +627,13 @@ def run_pipeline_for_farm(
         # For multiple providers, use OR of cloud masks (pixel is cloudy if any provider says so)
         # This is conservative - we only trust pixels clear in all providers
         import numpy as np
-        import xarray as xr
-        combined_cloud_mask = all_provider_cloud_masks[0]
-        for mask in all_provider_cloud_masks[1:]:
-            combined_cloud_mask = combined_cloud_mask | mask
+        merged_grid = GeoBox.from_xarray(composite_data)
+        combined = np.zeros(merged_grid.shape, dtype=bool)
+        for mask in all_provider_cloud_masks:
+            # Each mask is on its provider's grid; outside a provider's footprint it has no say
+            warped = Raster.from_xarray(mask).reproject(merged_grid, "nearest").data
+            combined |= np.nan_to_num(warped, nan=0.0) > 0.5
+        combined_cloud_mask = Raster(combined, merged_grid).to_xarray()
 
     # Step 5: Compute vegetation indices
     logger.info("Computing vegetation indices...")
@@ -595,17 +660,16 @@ def run_pipeline_for_farm(
     if pipeline_config.output_dir:
         logger.info("Generating GeoTIFF tiles...")
         try:
-            # Extract bounds from composite data
-            x_coords = composite_data.coords.get('x')
-            y_coords = composite_data.coords.get('y')
-            if x_coords is not None and y_coords is not None:
-                tile_bounds = (
-                    float(x_coords.min()),
-                    float(y_coords.min()),
-                    float(x_coords.max()),
-                    float(y_coords.max()),
-                )
-                tile_crs = composite_data.attrs.get('crs', 'EPSG:32616')
+            # Tile extent comes straight from the composite grid
+            try:
+                tile_grid = GeoBox.from_xarray(composite_data)
+            except (KeyError, ValueError) as e:
+                logger.warning(f"  Composite has no usable grid: {e}")
+                tile_grid = None
+
+            if tile_grid is not None:
+                tile_bounds = tile_grid.bounds
+                tile_crs = tile_grid.crs
 
                 tiles_generated = generate_tiles(
                     bands=composite_data,
@@ -623,7 +687,6 @@ def run_pipeline_for_farm(
                     try:
                         from storage.r2 import R2Storage, get_retention_days
                         from writer import SatelliteTileRecord, write_satellite_tile_to_convex
-                        from rasterio.warp import transform_bounds
 
                         r2 = R2Storage()
                         retention_days = get_retention_days(
@@ -632,11 +695,7 @@ def run_pipeline_for_farm(
                         )
 
                         # Convert bounds from projected CRS to WGS84 for storage
-                        wgs84_bounds = transform_bounds(
-                            tile_crs,  # Source CRS (e.g., EPSG:32616)
-                            'EPSG:4326',  # Target CRS (WGS84)
-                            *tile_bounds
-                        )
+                        wgs84_bounds = tile_grid.wgs84_bounds()
                         bounds_dict = {
                             'west': wgs84_bounds[0],
                             'south': wgs84_bounds[1],
@@ -864,6 +923,9 @@ def run_historical_backfill(
                 composite_window_days=pipeline_config.composite_window_days,
                 max_cloud_cover=pipeline_config.max_cloud_cover,
                 min_cloud_free_pct=pipeline_config.min_cloud_free_pct,
+                composite_method=pipeline_config.composite_method,
+                composite_memory_mb=pipeline_config.composite_memory_mb,
+                raster_workers=pipeline_config.raster_workers,
                 write_to_convex=pipeline_config.write_to_convex,
                 output_dir=pipeline_config.output_dir,
             )
@@ -6,7 +6,8 @@ allowing the pipeline to work with Sentinel-2, PlanetScope, and future
 providers through a unified API.
 """
 from abc import ABC, abstractmethod
-from typing import Protocol, TypedDict
+from contextlib import nullcontext
+from typing import ContextManager, Protocol, TypedDict
 
 
 # Provider-specific exceptions
@@ -41,6 +42,7 @@ class BandNames(TypedDict, total=False):
     green: str # Green (for RGB composite)
     swir: str  # Short-wave infrared (optional)
     blue: str  # Blue (optional for some computations)
+    scl: str   # Scene classification (optional, used for cloud masking)
 
 
 class SatelliteProvider(Protocol):
@@ -136,7 +138,7 @@ class SatelliteProvider(Protocol):
         data: 'xr.DataArray',
         items: list,
         bbox: list[float] | None = None
-    ) -> tuple['xr.DataArray', float]:
+    ) -> tuple['xr.DataArray', float, 'xr.DataArray']:
         """
         Apply cloud masking to the data.
 
@@ -146,8 +148,9 @@ class SatelliteProvider(Protocol):
             bbox: Optional bounding box [west, south, east, north]
 
         Returns:
-            Tuple of (masked_data, cloud_free_percentage)
-            cloud_free_percentage is 0.0-1.0 representing usable pixels
+            Tuple of (masked_data, cloud_free_percentage, cloud_mask)
+            cloud_free_percentage is 0.0-1.0 representing usable pixels,
+            cloud_mask is a boolean DataArray where True = cloudy/invalid pixel
         """
         ...
 
@@ -192,6 +195,43 @@ class BaseSatelliteProvider(ABC):
         """Whether provider is free. Override if provider is paid."""
         return True
 
+    def prefilter(
+        self,
+        items: list,
+        bbox: list[float],
+        min_clear_fraction: float,
+        geometries: list[dict] | None = None,
+    ) -> list:
+        """
+        Drop items too cloudy over the farm before their bands are loaded.
+
+        The default keeps every item. Override where the provider can judge
+        cloudiness over the farm cheaply (e.g. from a low-resolution mask).
+
+        Args:
+            items: Items from query()
+            bbox: Bounding box [west, south, east, north]
+            min_clear_fraction: Minimum clear fraction (0.0-1.0) to keep an item
+            geometries: Optional WGS84 GeoJSON geometries to measure within
+
+        Returns:
+            Items worth loading
+        """
+        return items
+
+    def compute_context(self) -> ContextManager:
+        """
+        Context in which the provider's loaded data is computed.
+
+        The pipeline enters it around loading, masking and compositing, so
+        any scheduler settings a provider needs stay scoped to its own data.
+        The default changes nothing.
+
+        Returns:
+            Context manager
+        """
+        return nullcontext()
+
     def get_metadata(self, item: dict) -> dict:
         """
         Default metadata extraction from STAC item.
@@ -282,6 +322,7 @@ class ProviderFactory:
         planet_client_id: str | None = None,
         planet_client_secret: str | None = None,
         use_copernicus: bool = True,
+        sentinel2_provider: SatelliteProvider | None = None,
     ) -> list[SatelliteProvider]:
         """
         Get appropriate providers for a farm's subscription tier.
@@ -292,6 +333,8 @@ class ProviderFactory:
             planet_client_id: Optional Planet OAuth2 client ID
             planet_client_secret: Optional Planet OAuth2 client secret
             use_copernicus: Whether to use Copernicus (default) or Planetary Computer
+            sentinel2_provider: Existing Sentinel-2 provider to reuse instead of
+                creating one (e.g. one carrying a scene batch plan shared across farms)
 
         Returns:
             List of providers to use for this farm
@@ -303,7 +346,9 @@ class ProviderFactory:
         providers: list[SatelliteProvider] = []
 
         # Determine which Sentinel-2 provider to use
-        if use_copernicus:
+        if sentinel2_provider is not None:
+            providers.append(sentinel2_provider)
+        elif use_copernicus:
             # Check if Copernicus credentials are available
             has_copernicus_creds = (
                 os.getenv("COPERNICUS_CLIENT_ID") and
@@ -0,0 +1,312 @@
+"""
+Concurrent activation and download of Planet assets.
+
+Planet assets must be activated before they can be downloaded, which takes
+seconds to minutes per asset. Activating and waiting for each item and
+asset type in turn makes a premium run as slow as the sum of all those
+waits.
+
+The orchestrator requests activation for every item and asset type up
+front, then polls everything still pending in one background loop, one
+assets request per item per round, with a backoff between rounds. Each
+asset is handed to a download pool the moment it turns active, so
+downloads of early assets overlap activation of the rest. Callers block
+only on the asset they need next, via result().
+
+With the PlanetScope store enabled (see planet_store.py), assets whose
+download location from an earlier run has not expired skip polling and
+go straight to the download pool, and every asset seen active is recorded
+there for later runs.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional
+
+from . import ActivationTimeoutError, QuotaExceededError
+from .planet_store import get_planet_store
+
+if TYPE_CHECKING:
+    from .planet_scope import PlanetScopeProvider
+
+logger = logging.getLogger(__name__)
+
+
+class ActivationOrchestrator:
+    """
+    Activate, poll and download a set of Planet assets concurrently.
+
+    Usable as a context manager; close() stops polling, waits for running
+    downloads and removes temporary files that were not taken over.
+    """
+
+    # Seconds between the first poll rounds, growing by BACKOFF up to MAX_POLL_INTERVAL
+    DEFAULT_POLL_INTERVAL = 2.0
+    MAX_POLL_INTERVAL = 30.0
+    BACKOFF = 1.5
+
+    # Default number of concurrent asset downloads
+    DEFAULT_DOWNLOAD_WORKERS = 4
+
+    def __init__(
+        self,
+        provider: 'PlanetScopeProvider',
+        timeouts: dict[str, int],
+        download_workers: Optional[int] = None,
+        poll_interval: Optional[float] = None,
+    ):
+        """
+        Initialize the orchestrator.
+
+        Args:
+            provider: Provider used for the Planet API requests and downloads
+            timeouts: Activation timeout in seconds per asset type
+            download_workers: Concurrent downloads (defaults to
+                PL_DOWNLOAD_WORKERS env var, then 4)
+            poll_interval: First interval between poll rounds in seconds
+                (defaults to PL_POLL_INTERVAL env var, then 2)
+        """
+        self.provider = provider
+        self.timeouts = dict(timeouts)
+        self.download_workers = download_workers or int(
+            os.getenv("PL_DOWNLOAD_WORKERS") or self.DEFAULT_DOWNLOAD_WORKERS
+        )
+        self.poll_interval = poll_interval or float(
+            os.getenv("PL_POLL_INTERVAL") or self.DEFAULT_POLL_INTERVAL
+        )
+
+        self._futures: dict[tuple[str, str], Future] = {}
+        self._item_types: dict[tuple[str, str], str] = {}
+        self._requested: set[tuple[str, str]] = set()
+        self._temporary: set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._poller: Optional[threading.Thread] = None
+
+    def start(self, items: list, asset_types: list[str]) -> 'ActivationOrchestrator':
+        """
+        Start activating and downloading assets in the background.
+
+        Args:
+            items: Item metadata from PlanetScopeProvider.query()
+            asset_types: Asset types to fetch for every item
+
+        Returns:
+            self
+        """
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.download_workers, thread_name_prefix="planet-download"
+        )
+
+        pending = {}
+        for item in items:
+            item_id = item.get("id")
+            item_type = item.get("item_type", "PSScene")
+            for asset_type in asset_types:
+                key = (item_id, asset_type)
+                self._futures[key] = Future()
+                self._item_types[key] = item_type
+                pending[key] = item_type
+
+        self._start_known(pending)
+
+        self._poller = threading.Thread(
+            target=self._poll, args=(pending,), name="planet-activation", daemon=True
+        )
+        self._poller.start()
+        return self
+
+    def result(self, item_id: str, asset_type: str) -> str:
+        """
+        Wait for one asset and return its local file.
+
+        Temporary files returned here are owned by the caller, who removes
+        them with release() once done.
+
+        Args:
+            item_id: Planet item ID
+            asset_type: Asset type
+
+        Returns:
+            Path to the local GeoTIFF
+
+        Raises:
+            ActivationTimeoutError: If the asset did not activate in time
+            QuotaExceededError: If Planet refused the requests
+            Exception: Any activation or download error for this asset
+        """
+        return self._futures[(item_id, asset_type)].result()
+
+    def __contains__(self, key: tuple[str, str]) -> bool:
+        """Whether an (item ID, asset type) pair is handled by this orchestrator."""
+        return key in self._futures
+
+    def release(self, path: str) -> None:
+        """Remove a file returned by result() if it is a temporary download."""
+        with self._lock:
+            temporary = path in self._temporary
+            self._temporary.discard(path)
+        if temporary and os.path.exists(path):
+            os.unlink(path)
+
+    def close(self) -> None:
+        """Stop polling, drop queued downloads and remove leftover temporary files."""
+        self._stop.set()
+        if self._poller is not None:
+            self._poller.join()
+
+        for future in self._futures.values():
+            if not future.done():
+                future.cancel()
+
+        if self._pool is not None:
+            # Queued downloads never start; only those already running are waited for
+            self._pool.shutdown(wait=True, cancel_futures=True)
+
+        with self._lock:
+            leftovers, self._temporary = self._temporary, set()
+        for path in leftovers:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def __enter__(self) -> 'ActivationOrchestrator':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _start_known(self, pending: dict[tuple[str, str], str]) -> None:
+        """Download assets the store knows to be active right away, without polling them."""
+        store = get_planet_store()
+        if store is None:
+            return
+
+        for key in list(pending):
+            asset = store.get_location(*key)
+            if asset is not None:
+                del pending[key]
+                logger.info(f"Asset {key[1]} for {key[0]} known active, downloading")
+                self._pool.submit(self._download, key, asset, True)
+
+    def _poll(self, pending: dict[tuple[str, str], str]) -> None:
+        """Activation loop: one assets request per item per round until nothing is pending."""
+        started = time.monotonic()
+        interval = self.poll_interval
+
+        while pending and not self._stop.is_set():
+            by_item: dict[str, list[str]] = {}
+            for (item_id, asset_type), item_type in pending.items():
+                by_item.setdefault(item_id, []).append(asset_type)
+
+            for item_id, asset_types in by_item.items():
+                item_type = pending[(item_id, asset_types[0])]
+                try:
+                    assets = self.provider._get_assets(item_id, item_type)
+                except QuotaExceededError as e:
+                    for asset_type in asset_types:
+                        self._fail(pending, (item_id, asset_type), e)
+                    continue
+                except Exception as e:
+                    # Transient API error, try again next round
+                    logger.warning(f"Could not poll assets of {item_id}: {e}")
+                    continue
+
+                for asset_type in asset_types:
+                    self._update(pending, (item_id, asset_type), assets.get(asset_type))
+
+            elapsed = time.monotonic() - started
+            for key in list(pending):
+                timeout = self.timeouts.get(key[1], 300)
+                if elapsed >= timeout:
+                    self._fail(pending, key, ActivationTimeoutError(key[0], key[1], timeout))
+
+            if pending:
+                logger.debug(f"{len(pending)} Planet assets still activating, next poll in {interval:.0f}s")
+                self._stop.wait(interval)
+                interval = min(interval * self.BACKOFF, self.MAX_POLL_INTERVAL)
+
+    def _update(
+        self,
+        pending: dict[tuple[str, str], str],
+        key: tuple[str, str],
+        asset: Optional[dict],
+    ) -> None:
+        """Act on the latest status of one pending asset."""
+        item_id, asset_type = key
+
+        if asset is None:
+            self._fail(pending, key, ValueError(f"Asset type {asset_type} not available for item {item_id}"))
+            return
+
+        status = asset.get("status")
+        if status == "active":
+            del pending[key]
+            logger.info(f"Asset {asset_type} for {item_id} is active, downloading")
+            store = get_planet_store()
+            if store is not None:
+                store.put_location(item_id, asset_type, asset)
+            self._pool.submit(self._download, key, asset)
+        elif status == "inactive" and key not in self._requested:
+            # Activation is requested once; the asset may stay "inactive" for a poll or two
+            self._requested.add(key)
+            try:
+                self.provider._request_activation(item_id, asset_type, asset)
+            except Exception as e:
+                self._fail(pending, key, e)
+        elif status == "failed":
+            self._fail(pending, key, ValueError(f"Asset activation failed for {item_id}/{asset_type}"))
+
+    def _download(self, key: tuple[str, str], asset: dict, stored: bool = False) -> None:
+        """
+        Download an active asset and resolve its future.
+
+        A location taken from the store may have been revoked early; the
+        asset is then forgotten and acquired again through the Data API.
+        """
+        future = self._futures[key]
+        if self._stop.is_set():
+            future.cancel()
+            return
+        if not future.set_running_or_notify_cancel():
+            # Cancelled by close() in the meantime
+            return
+
+        download_url = asset.get("location")
+        if not download_url:
+            future.set_exception(ValueError(f"No download URL for item {key[0]}"))
+            return
+
+        try:
+            path, temporary = self._fetch(key, download_url, asset.get("md5_digest"))
+        except Exception as e:
+            if not stored:
+                future.set_exception(e)
+                return
+
+            logger.info(f"Stored location of {key[0]}/{key[1]} failed ({e}), activating again")
+            get_planet_store().forget_location(*key)
+            try:
+                asset = self.provider._active_asset(
+                    key[0], self._item_types[key], key[1], self.timeouts.get(key[1], 300)
+                )
+                path, temporary = self._fetch(key, asset["location"], asset.get("md5_digest"))
+            except Exception as e:
+                future.set_exception(e)
+                return
+
+        if temporary:
+            with self._lock:
+                self._temporary.add(path)
+        future.set_result(path)
+
+    def _fetch(self, key: tuple[str, str], download_url: str, md5: Optional[str]) -> tuple[str, bool]:
+        """Download one asset, through the scene cache when enabled."""
+        return self.provider._fetch_asset(download_url, key[0], key[1], md5=md5)
+
+    def _fail(self, pending: dict[tuple[str, str], str], key: tuple[str, str], error: Exception) -> None:
+        """Resolve a pending asset with an error."""
+        pending.pop(key, None)
+        self._futures[key].set_exception(error)
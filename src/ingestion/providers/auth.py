@@ -0,0 +1,216 @@
+"""
+Process-wide OAuth2 token broker.
+
+Copernicus Data Space and Planet both use the client credentials flow. Rather
+than every provider instance, imagery checker and thread keeping its own token
+(and POSTing to the identity server whenever it has none), all callers in the
+process share one broker. Tokens are keyed by token URL and credentials,
+fetched at most once at a time per key, and refreshed in the background before
+they expire so callers on the hot path never wait for the identity server.
+"""
+import hashlib
+import logging
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenRequestError(RuntimeError):
+    """Raised when the identity server rejects a token request."""
+    def __init__(self, token_url: str, status_code: int, text: str = ""):
+        self.token_url = token_url
+        self.status_code = status_code
+        self.text = text
+        super().__init__(f"Token request to {token_url} failed: {status_code} - {text}")
+
+
+class _TokenEntry:
+    """Cached token and refresh state for one set of credentials."""
+
+    __slots__ = (
+        "token_url", "client_id", "client_secret", "lock",
+        "access_token", "expires_at", "margin", "last_used", "timer",
+    )
+
+    def __init__(self, token_url: str, client_id: str, client_secret: str):
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.lock = threading.Lock()
+        self.access_token: Optional[str] = None
+        self.expires_at = 0.0
+        self.margin = 0.0
+        self.last_used = 0.0
+        self.timer: Optional[threading.Timer] = None
+
+
+class TokenBroker:
+    """
+    Thread-safe OAuth2 client credentials token cache with background refresh.
+
+    A token is handed out until MIN_VALIDITY seconds (or a tenth of its
+    lifetime, for short-lived tokens) before it expires. Once
+    REFRESH_FRACTION of its lifetime has passed a daemon timer fetches a new
+    one, as long as the credentials were used during the previous lifetime;
+    idle credentials are left to lapse.
+    """
+
+    # Tokens closer than this to expiry are never handed out (seconds)
+    MIN_VALIDITY = 30
+
+    # Fraction of the token lifetime after which it is refreshed in the background
+    REFRESH_FRACTION = 0.75
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[tuple[str, str, str], _TokenEntry] = {}
+        self._requests = 0
+
+    def get_token(self, token_url: str, client_id: str, client_secret: str) -> str:
+        """
+        Get a valid access token for a set of client credentials.
+
+        Args:
+            token_url: OAuth2 token endpoint
+            client_id: OAuth2 client ID
+            client_secret: OAuth2 client secret
+
+        Returns:
+            Access token string
+
+        Raises:
+            TokenRequestError: If the identity server rejects the request
+        """
+        entry = self._entry(token_url, client_id, client_secret)
+
+        with entry.lock:
+            entry.last_used = time.time()
+            if entry.access_token and time.time() < entry.expires_at - entry.margin:
+                return entry.access_token
+            self._refresh(entry)
+            return entry.access_token
+
+    def invalidate(
+        self,
+        token_url: str,
+        client_id: str,
+        client_secret: str,
+        token: Optional[str] = None,
+    ) -> None:
+        """
+        Drop a cached token, e.g. after an API rejected it with 401.
+
+        Args:
+            token_url: OAuth2 token endpoint
+            client_id: OAuth2 client ID
+            client_secret: OAuth2 client secret
+            token: The rejected token; if given, the cache is only dropped
+                while it still holds that token, so callers rejected at the
+                same time trigger a single refresh
+        """
+        entry = self._entry(token_url, client_id, client_secret)
+        with entry.lock:
+            if token is not None and entry.access_token != token:
+                return
+            entry.access_token = None
+            entry.expires_at = 0.0
+            if entry.timer is not None:
+                entry.timer.cancel()
+                entry.timer = None
+
+    @property
+    def request_count(self) -> int:
+        """Number of token requests sent to identity servers by this broker."""
+        with self._lock:
+            return self._requests
+
+    def _entry(self, token_url: str, client_id: str, client_secret: str) -> _TokenEntry:
+        """Get or create the entry for a set of credentials."""
+        # Never keep the raw secret in the key
+        secret_digest = hashlib.sha256(client_secret.encode()).hexdigest()
+        key = (token_url, client_id, secret_digest)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _TokenEntry(token_url, client_id, client_secret)
+                self._entries[key] = entry
+            return entry
+
+    def _refresh(self, entry: _TokenEntry) -> None:
+        """Fetch a new token for an entry. Caller must hold entry.lock."""
+        import requests
+
+        logger.info(f"Requesting new access token from {entry.token_url}...")
+
+        response = requests.post(
+            entry.token_url,
+            data={
+                "grant_type": "client_credentials",
+                "client_id": entry.client_id,
+                "client_secret": entry.client_secret,
+            },
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            timeout=30,
+        )
+
+        with self._lock:
+            self._requests += 1
+
+        if response.status_code != 200:
+            raise TokenRequestError(entry.token_url, response.status_code, response.text)
+
+        token_data = response.json()
+        expires_in = int(token_data.get("expires_in", 300))
+
+        entry.access_token = token_data["access_token"]
+        entry.expires_at = time.time() + expires_in
+        entry.margin = min(self.MIN_VALIDITY, expires_in / 10)
+
+        logger.info(f"Got access token, expires in {expires_in}s")
+
+        self._schedule_refresh(entry, expires_in)
+
+    def _schedule_refresh(self, entry: _TokenEntry, expires_in: int) -> None:
+        """Arm the background refresh timer for an entry. Caller must hold entry.lock."""
+        if entry.timer is not None:
+            entry.timer.cancel()
+
+        delay = max(expires_in * self.REFRESH_FRACTION, 1.0)
+        entry.timer = threading.Timer(delay, self._background_refresh, args=(entry, expires_in))
+        entry.timer.daemon = True
+        entry.timer.start()
+
+    def _background_refresh(self, entry: _TokenEntry, lifetime: int) -> None:
+        """Refresh a token ahead of expiry if its credentials are still in use."""
+        with entry.lock:
+            entry.timer = None
+            if time.time() - entry.last_used > lifetime:
+                logger.debug(f"Token for {entry.token_url} idle, letting it lapse")
+                return
+            try:
+                self._refresh(entry)
+            except Exception as e:
+                # The next get_token() call retries synchronously
+                logger.warning(f"Background token refresh failed: {e}")
+
+
+_token_broker: Optional[TokenBroker] = None
+_token_broker_lock = threading.Lock()
+
+
+def get_token_broker() -> TokenBroker:
+    """
+    Get the process-wide token broker shared by all providers and checkers.
+
+    Returns:
+        TokenBroker instance
+    """
+    global _token_broker
+
+    with _token_broker_lock:
+        if _token_broker is None:
+            _token_broker = TokenBroker()
+        return _token_broker
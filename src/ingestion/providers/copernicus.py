@@ -6,14 +6,28 @@ Provides access to Sentinel-2 L2A data from Copernicus Data Space
 """
 import logging
 import os
-from datetime import datetime, timedelta
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Iterator
 
 import requests
 
+from raster import (
+    DN_NODATA,
+    GeoBox,
+    Raster,
+    acquisition_time,
+    compact_attrs,
+    compact_mode_enabled,
+    mask_pixels,
+)
+from warp import get_warp_engine, read_window
+
 from . import BaseSatelliteProvider, BandNames
+from .auth import TokenRequestError, get_token_broker
+from .download import get_downloader
+from .scene_cache import get_scene_cache
 
 if TYPE_CHECKING:
+    import numpy as np
     import xarray as xr
 
 logger = logging.getLogger(__name__)
@@ -39,11 +53,42 @@ class CopernicusProvider(BaseSatelliteProvider):
     CATALOG_URL = "https://catalogue.dataspace.copernicus.eu/odata/v1"
     DOWNLOAD_URL = "https://zipper.dataspace.copernicus.eu/odata/v1"  # Zipper service for downloads
     S3_ENDPOINT = "https://eodata.dataspace.copernicus.eu"
+    S3_BUCKET = "eodata"
+
+    # Sub-directory of IMG_DATA holding each band; anything not listed is 10m
+    BAND_RESOLUTION_DIRS = {
+        "B11": "R20m",
+        "SCL": "R20m",
+    }
+
+    # SCL classes treated as not clear: no data, cloud shadow, cloud medium/high, thin cirrus
+    CLOUD_CLASSES = (0, 3, 8, 9, 10)
+
+    # Pixel size of the grid the SCL prefilter reads the 60m SCL onto
+    PREFILTER_RESOLUTION = 60
+
+    # Output grid edges are snapped to this many metres (the 60m lattice that
+    # all Sentinel-2 band resolutions share)
+    GRID_ALIGNMENT = 60
+
+    # Default number of products loaded concurrently
+    DEFAULT_MAX_WORKERS = 4
+
+    # Products per catalog page, and the fields a "lean" catalog query selects
+    CATALOG_PAGE_SIZE = 100
+    CATALOG_FIELDS = ("Id", "Name", "ContentDate", "S3Path", "ContentLength", "Checksum")
 
     def __init__(
         self,
         client_id: str | None = None,
         client_secret: str | None = None,
+        read_mode: str | None = None,
+        s3_access_key: str | None = None,
+        s3_secret_key: str | None = None,
+        s3_endpoint: str | None = None,
+        max_workers: int | None = None,
+        catalog_mode: str | None = None,
+        compact: bool | None = None,
     ):
         """
         Initialize the Copernicus provider.
@@ -51,12 +96,47 @@ class CopernicusProvider(BaseSatelliteProvider):
         Args:
             client_id: OAuth2 client ID (defaults to COPERNICUS_CLIENT_ID env var)
             client_secret: OAuth2 client secret (defaults to COPERNICUS_CLIENT_SECRET env var)
+            read_mode: "zip" to download the full product through the Zipper service,
+                "remote" to read only the farm window of each band straight from the
+                eodata S3 bucket (defaults to COPERNICUS_READ_MODE env var, then "zip")
+            s3_access_key: eodata S3 access key (defaults to COPERNICUS_S3_ACCESS_KEY env var)
+            s3_secret_key: eodata S3 secret key (defaults to COPERNICUS_S3_SECRET_KEY env var)
+            s3_endpoint: eodata S3 endpoint URL (defaults to COPERNICUS_S3_ENDPOINT env var,
+                then the public Copernicus endpoint). Point this at a local S3 stand-in
+                serving a SAFE tree for testing.
+            max_workers: Maximum number of products loaded concurrently (defaults to
+                COPERNICUS_MAX_WORKERS env var, then 4). Each zip-mode worker holds
+                one product download on disk, so keep this small in that mode.
+            catalog_mode: "lean" to select only the product fields and cloudCover
+                attribute the provider uses, "full" to expand every attribute
+                (defaults to COPERNICUS_CATALOG_MODE env var, then "lean")
+            compact: Keep bands as uint16 DN with nodata 0 (SCL as uint8 per
+                product) instead of float32 reflectance (defaults to
+                COMPACT_DTYPE env var, then False)
         """
         self.client_id = client_id or os.getenv("COPERNICUS_CLIENT_ID")
         self.client_secret = client_secret or os.getenv("COPERNICUS_CLIENT_SECRET")
 
-        self._access_token: str | None = None
-        self._token_expires_at: datetime | None = None
+        self.read_mode = (read_mode or os.getenv("COPERNICUS_READ_MODE") or "zip").lower()
+        if self.read_mode not in ("zip", "remote"):
+            raise ValueError(f"Unknown Copernicus read mode: {self.read_mode}")
+
+        self.s3_access_key = s3_access_key or os.getenv("COPERNICUS_S3_ACCESS_KEY")
+        self.s3_secret_key = s3_secret_key or os.getenv("COPERNICUS_S3_SECRET_KEY")
+        self.s3_endpoint = s3_endpoint or os.getenv("COPERNICUS_S3_ENDPOINT") or self.S3_ENDPOINT
+
+        self.max_workers = max_workers or int(
+            os.getenv("COPERNICUS_MAX_WORKERS") or self.DEFAULT_MAX_WORKERS
+        )
+
+        self.catalog_mode = (catalog_mode or os.getenv("COPERNICUS_CATALOG_MODE") or "lean").lower()
+        if self.catalog_mode not in ("lean", "full"):
+            raise ValueError(f"Unknown Copernicus catalog mode: {self.catalog_mode}")
+
+        self.compact = compact_mode_enabled() if compact is None else compact
+
+        # Optional scene_batch.SceneBatchPlan shared by farms on the same MGRS tile
+        self.scene_plan = None
 
     @property
     def resolution_meters(self) -> int:
@@ -91,10 +171,11 @@ class CopernicusProvider(BaseSatelliteProvider):
 
     def _get_access_token(self) -> str:
         """
-        Get or refresh the OAuth2 access token.
+        Get a valid OAuth2 access token.
 
-        Uses client credentials flow to obtain an access token.
-        Tokens are cached and refreshed 5 minutes before expiry.
+        Tokens come from the process-wide token broker, so all Copernicus
+        providers and checkers using the same credentials share one token,
+        refreshed in the background before it expires.
 
         Returns:
             Valid access token
@@ -103,12 +184,6 @@ class CopernicusProvider(BaseSatelliteProvider):
             ValueError: If credentials are not configured
             RuntimeError: If token request fails
         """
-        # Check if we have a valid cached token
-        if self._access_token and self._token_expires_at:
-            # Refresh 5 minutes before expiry
-            if datetime.now() < self._token_expires_at - timedelta(minutes=5):
-                return self._access_token
-
         # Validate credentials
         if not self.client_id or not self.client_secret:
             raise ValueError(
@@ -116,33 +191,12 @@ class CopernicusProvider(BaseSatelliteProvider):
                 "Set COPERNICUS_CLIENT_ID and COPERNICUS_CLIENT_SECRET environment variables."
             )
 
-        logger.info("Requesting new Copernicus access token...")
-
-        response = requests.post(
-            self.TOKEN_URL,
-            data={
-                "grant_type": "client_credentials",
-                "client_id": self.client_id,
-                "client_secret": self.client_secret,
-            },
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-            timeout=30,
-        )
-
-        if response.status_code != 200:
+        try:
+            return get_token_broker().get_token(self.TOKEN_URL, self.client_id, self.client_secret)
+        except TokenRequestError as e:
             raise RuntimeError(
-                f"Failed to get Copernicus access token: {response.status_code} - {response.text}"
-            )
-
-        token_data = response.json()
-        self._access_token = token_data["access_token"]
-
-        # Calculate expiry time (typically 300 seconds)
-        expires_in = token_data.get("expires_in", 300)
-        self._token_expires_at = datetime.now() + timedelta(seconds=expires_in)
-
-        logger.info(f"Got access token, expires in {expires_in}s")
-        return self._access_token
+                f"Failed to get Copernicus access token: {e.status_code} - {e.text}"
+            ) from e
 
     def query(
         self,
@@ -154,6 +208,10 @@ class CopernicusProvider(BaseSatelliteProvider):
         """
         Query Copernicus Data Space OData API for Sentinel-2 imagery.
 
+        Follows catalog pagination, so every matching product is returned.
+        Use iter_query() to stop early. When a scene plan is attached, the
+        results it gathered for the same farm and window are reused.
+
         Args:
             bbox: Bounding box [west, south, east, north]
             start_date: Start date YYYY-MM-DD
@@ -163,9 +221,48 @@ class CopernicusProvider(BaseSatelliteProvider):
         Returns:
             List of product metadata dictionaries with download URLs
         """
-        # Get access token
-        token = self._get_access_token()
+        if self.scene_plan is not None:
+            items = self.scene_plan.cached_query(bbox, start_date, end_date, max_cloud_cover)
+            if items is not None:
+                logger.info(f"Reusing {len(items)} planned products for {start_date} to {end_date}")
+                return items
+
+        logger.info(f"Querying Copernicus catalog for {start_date} to {end_date}...")
+
+        items = list(self.iter_query(bbox, start_date, end_date, max_cloud_cover))
+
+        logger.info(f"Found {len(items)} products")
+        return items
+
+    def iter_query(
+        self,
+        bbox: list[float],
+        start_date: str,
+        end_date: str,
+        max_cloud_cover: int = 50,
+        page_size: int | None = None,
+    ) -> Iterator[dict]:
+        """
+        Lazily yield Sentinel-2 products matching a query, newest first.
+
+        Pages are fetched on demand by following @odata.nextLink, so a caller
+        that stops iterating (e.g. after the latest clear product) never
+        requests the remaining pages.
+
+        In "lean" catalog mode only the fields used to build items are
+        selected and only the cloudCover attribute is expanded. If the catalog
+        rejects the projection the query is retried once in "full" mode.
+
+        Args:
+            bbox: Bounding box [west, south, east, north]
+            start_date: Start date YYYY-MM-DD
+            end_date: End date YYYY-MM-DD
+            max_cloud_cover: Maximum cloud cover percentage (0-100)
+            page_size: Products per catalog page (defaults to CATALOG_PAGE_SIZE)
 
+        Yields:
+            Product metadata dictionaries with download URLs
+        """
         # Build OData query for Sentinel-2 L2A
         # Bbox format for OData: POLYGON((west south, east south, east north, west north, west south))
         west, south, east, north = bbox
@@ -181,62 +278,106 @@ class CopernicusProvider(BaseSatelliteProvider):
             f"Attributes/OData.CSC.DoubleAttribute/any(att:att/Name eq 'cloudCover' and att/OData.CSC.DoubleAttribute/Value lt {max_cloud_cover})",
         ]
 
-        filter_str = " and ".join(filter_parts)
-
-        url = f"{self.CATALOG_URL}/Products"
         params = {
-            "$filter": filter_str,
+            "$filter": " and ".join(filter_parts),
             "$orderby": "ContentDate/Start desc",
-            "$top": 100,
-            "$expand": "Attributes",
+            "$top": page_size or self.CATALOG_PAGE_SIZE,
         }
 
-        logger.info(f"Querying Copernicus catalog for {start_date} to {end_date}...")
-
-        response = requests.get(
-            url,
-            params=params,
-            headers={"Authorization": f"Bearer {token}"},
-            timeout=60,
-        )
+        lean = self.catalog_mode == "lean"
+        if lean:
+            params["$select"] = ",".join(self.CATALOG_FIELDS)
+            params["$expand"] = "Attributes($filter=Name eq 'cloudCover')"
+        else:
+            params["$expand"] = "Attributes"
 
-        if response.status_code != 200:
-            logger.error(f"Catalog query failed: {response.status_code} - {response.text}")
-            raise RuntimeError(f"Copernicus catalog query failed: {response.status_code}")
-
-        data = response.json()
-        products = data.get("value", [])
+        url = f"{self.CATALOG_URL}/Products"
+        page = 0
+        renewed = False
+
+        while url:
+            token = self._get_access_token()
+            response = requests.get(
+                url,
+                params=params,
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=60,
+            )
 
-        logger.info(f"Found {len(products)} products")
+            if response.status_code == 401 and not renewed:
+                # Revoked or expired early: fetch a new token and resend once
+                logger.warning("Catalog rejected the access token, retrying with a new one")
+                get_token_broker().invalidate(self.TOKEN_URL, self.client_id, self.client_secret, token)
+                renewed = True
+                continue
+
+            if response.status_code == 400 and lean and page == 0:
+                logger.warning(
+                    "Catalog rejected the lean projection, retrying with full attributes"
+                )
+                lean = False
+                params.pop("$select")
+                params["$expand"] = "Attributes"
+                continue
+
+            if response.status_code != 200:
+                logger.error(f"Catalog query failed: {response.status_code} - {response.text}")
+                raise RuntimeError(f"Copernicus catalog query failed: {response.status_code}")
+
+            data = response.json()
+            page += 1
+            logger.debug(f"Catalog page {page}: {len(data.get('value', []))} products")
+
+            for product in data.get("value", []):
+                yield self._product_to_item(product)
+
+            # nextLink already carries the query options
+            url = data.get("@odata.nextLink")
+            params = None
+
+    def _product_to_item(self, product: dict) -> dict:
+        """
+        Transform an OData product into the standardized item format.
 
-        # Transform to standardized format
-        items = []
-        for product in products:
-            # Extract cloud cover from attributes
-            cloud_cover = None
-            for attr in product.get("Attributes", []):
-                if attr.get("Name") == "cloudCover":
-                    cloud_cover = attr.get("Value")
-                    break
+        Args:
+            product: Product entry from the catalog response
 
-            item = {
-                "id": product["Id"],
-                "name": product["Name"],
-                "properties": {
-                    "datetime": product.get("ContentDate", {}).get("Start"),
-                    "eo:cloud_cover": cloud_cover,
-                },
-                "assets": {
-                    "download": {
-                        # Use Zipper service for downloads (different from catalog URL)
-                        "href": f"{self.DOWNLOAD_URL}/Products({product['Id']})/$value"
-                    }
-                },
-                "_copernicus_product": product,  # Keep full product for later use
+        Returns:
+            Product metadata dictionary with download URLs
+        """
+        # Extract cloud cover from attributes
+        cloud_cover = None
+        for attr in product.get("Attributes", []):
+            if attr.get("Name") == "cloudCover":
+                cloud_cover = attr.get("Value")
+                break
+
+        assets = {
+            "download": {
+                # Use Zipper service for downloads (different from catalog URL)
+                "href": f"{self.DOWNLOAD_URL}/Products({product['Id']})/$value"
             }
-            items.append(item)
+        }
+        # Size and MD5 of the product ZIP, used to verify downloads
+        if product.get("ContentLength"):
+            assets["download"]["size"] = int(product["ContentLength"])
+        for checksum in product.get("Checksum") or []:
+            if str(checksum.get("Algorithm", "")).upper() == "MD5" and checksum.get("Value"):
+                assets["download"]["md5"] = checksum["Value"]
+        if product.get("S3Path"):
+            # e.g. /eodata/Sentinel-2/MSI/L2A/2024/05/01/S2B_MSIL2A_....SAFE
+            assets["safe"] = {"href": f"s3:/{product['S3Path']}"}
 
-        return items
+        return {
+            "id": product["Id"],
+            "name": product["Name"],
+            "properties": {
+                "datetime": product.get("ContentDate", {}).get("Start"),
+                "eo:cloud_cover": cloud_cover,
+            },
+            "assets": assets,
+            "_copernicus_product": product,  # Keep full product for later use
+        }
 
     def load(
         self,
@@ -247,7 +388,17 @@ class CopernicusProvider(BaseSatelliteProvider):
         """
         Load specified bands from Copernicus Sentinel-2 products.
 
-        Downloads data via S3-compatible protocol and processes bands.
+        Every product is loaded concurrently on a bounded thread pool and
+        read onto one common UTM grid covering the bbox, so the result can be
+        handed straight to create_median_composite().
+
+        In "zip" read mode the product is downloaded through the Zipper service
+        and only the requested band members are read from the archive. In "remote" read mode
+        only the band files are opened, directly from the eodata S3 bucket, and
+        GDAL fetches just the byte ranges covering the farm window.
+
+        With a scene plan attached, products shared with other farms on the
+        same MGRS tile are decoded once over the batch window and cropped.
 
         Args:
             items: Product metadata from query()
@@ -255,237 +406,524 @@ class CopernicusProvider(BaseSatelliteProvider):
             bbox: Bounding box [west, south, east, north]
 
         Returns:
-            xarray DataArray with loaded band data
+            xarray DataArray with dims (time, band, y, x), one time step per
+            product that loaded successfully; float32 reflectance, or uint16
+            DN in compact mode
         """
+        from concurrent.futures import ThreadPoolExecutor
+
         import numpy as np
-        import rasterio
-        import rasterio.windows
-        import xarray as xr
-        import zipfile
-        import tempfile
-        import os as os_module
 
         if not items:
             raise ValueError("No items provided to load")
 
-        token = self._get_access_token()
-
         # Convert semantic band names to Sentinel-2 band IDs
         band_ids = [self.band_names[b] for b in bands]
 
-        logger.info(f"Loading {len(items)} products, bands: {band_ids}")
+        # Always load SCL band for cloud masking (add to band_ids if not present)
+        if "SCL" not in band_ids:
+            band_ids = band_ids + ["SCL"]
 
-        # We'll load from the most recent clear product
-        # In a production system, we'd composite multiple products
-        item = items[0]
-        product_id = item["id"]
-        product_name = item["name"]
+        grid = GeoBox.from_bbox(bbox, self.resolution_meters, align=self.GRID_ALIGNMENT)
 
-        logger.info(f"Loading product: {product_name}")
+        workers = max(1, min(self.max_workers, len(items)))
+        logger.info(
+            f"Loading {len(items)} products with {workers} workers, bands: {band_ids} "
+            f"(read mode: {self.read_mode}, grid: {grid})"
+        )
+
+        if self.scene_plan is not None:
+            plan = self.scene_plan
+
+            def load_product(item, band_ids, grid):
+                return plan.load_product(item, band_ids, grid, bbox, self._load_product)
+        else:
+            load_product = self._load_product
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(load_product, item, band_ids, grid) for item in items]
+
+            products = []
+            for item, future in zip(items, futures):
+                try:
+                    products.append((item, future.result()))
+                except Exception as e:
+                    logger.warning(f"Failed to load product {item.get('name')}: {e}")
+
+        if not products:
+            raise RuntimeError("No products could be loaded")
+
+        # Semantic band order, keeping only bands found in at least one product
+        semantic_bands = [
+            (name, band_id) for name, band_id in self.band_names.items()
+            if band_id in band_ids and any(band_id in arrays for _, arrays in products)
+        ]
+        if not semantic_bands:
+            raise RuntimeError("No band data loaded")
+
+        if self.compact:
+            stacked = np.full((len(products), len(semantic_bands)) + grid.shape, DN_NODATA, dtype=np.uint16)
+        else:
+            stacked = np.full((len(products), len(semantic_bands)) + grid.shape, np.nan, dtype=np.float32)
+        times = []
+        for t, (item, arrays) in enumerate(products):
+            for b, (_, band_id) in enumerate(semantic_bands):
+                if band_id in arrays:
+                    stacked[t, b] = arrays[band_id]
+            times.append(acquisition_time(item.get("properties", {}).get("datetime")))
+
+        logger.info(f"Loaded {len(products)}/{len(items)} products into stack {stacked.shape}")
+
+        raster = Raster(stacked, grid, bands=[name for name, _ in semantic_bands], times=times)
+        return raster.to_xarray(attrs=compact_attrs() if self.compact else None)
+
+    def _load_product(
+        self,
+        item: dict,
+        band_ids: list[str],
+        grid: GeoBox,
+    ) -> dict[str, 'np.ndarray']:
+        """
+        Load one product onto the common grid using the configured read mode.
+
+        Args:
+            item: Product metadata from query()
+            band_ids: Sentinel-2 band IDs to read (including SCL)
+            grid: Common output grid
+
+        Returns:
+            Dictionary mapping band ID to a 2D array on the grid
+        """
+        logger.info(f"Loading product: {item['name']}")
+
+        if self.read_mode == "remote":
+            return self._load_remote(item, band_ids, grid)
+        return self._load_zip(item, band_ids, grid)
+
+    def _load_zip(
+        self,
+        item: dict,
+        band_ids: list[str],
+        grid: GeoBox,
+        resolution_dirs: dict[str, str] | None = None,
+    ) -> dict[str, 'np.ndarray']:
+        """
+        Download the full product ZIP via the Zipper service and read bands from it.
+
+        If the shared scene cache is enabled the ZIP is kept there, so other farms,
+        overlapping windows and retries reuse it instead of downloading it again.
+
+        Args:
+            item: Product metadata from query()
+            band_ids: Sentinel-2 band IDs to read (including SCL)
+            grid: Common output grid
+            resolution_dirs: Preferred resolution directory per band
+
+        Returns:
+            Dictionary mapping band ID to a 2D array on the grid
+        """
+        import zipfile
+        import tempfile
+        import os as os_module
+
+        cache = get_scene_cache()
+
+        # The product is a ZIP file containing the SAFE format.
+        # Only the members for the requested bands are read; the rest of the
+        # archive (other resolutions, QI data, previews) never touches disk.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            if cache is not None:
+                zip_path = cache.fetch(
+                    item["id"],
+                    "product.zip",
+                    lambda dest: self._download_product(item, dest),
+                    suffix=".zip",
+                )
+            else:
+                zip_path = os_module.path.join(tmpdir, "product.zip")
+                self._download_product(item, zip_path)
+
+            with zipfile.ZipFile(zip_path, "r") as zf:
+                band_members = self._find_band_files(zf.namelist(), band_ids, resolution_dirs)
+
+                band_paths = {}
+                for band_id, member in band_members.items():
+                    if zf.getinfo(member).compress_type == zipfile.ZIP_STORED:
+                        # Stored members can be read in place with random access
+                        band_paths[band_id] = f"/vsizip/{zip_path}/{member}"
+                    else:
+                        # Seeking inside deflated members is slow, extract just this entry
+                        band_paths[band_id] = zf.extract(member, tmpdir)
+
+            logger.info(f"Reading {len(band_paths)} band files from product archive")
+
+            return self._read_bands(band_paths, grid)
+
+    def _download_product(self, item: dict, dest_path: str) -> None:
+        """
+        Download a product ZIP via the Zipper service.
+
+        Dropped connections resume from the bytes already received, and the
+        file is checked against the catalog size and MD5 when they are known.
+
+        Args:
+            item: Product metadata from query()
+            dest_path: File path to write the ZIP to
+        """
+        download = item["assets"]["download"]
 
         # Download the product via HTTPS (Zipper service)
-        download_url = item["assets"]["download"]["href"]
+        download_url = download["href"]
 
         logger.info(f"Downloading from: {download_url}")
 
-        response = requests.get(
+        get_downloader().download(
             download_url,
-            headers={
-                "Authorization": f"Bearer {token}",
-            },
-            stream=True,
-            timeout=600,  # Downloads can take a while
-            allow_redirects=True,
+            dest_path,
+            # A fresh token per attempt, a long download can outlive the first one
+            headers=lambda: {"Authorization": f"Bearer {self._get_access_token()}"},
+            expected_size=download.get("size"),
+            md5=download.get("md5"),
         )
 
-        if response.status_code != 200:
-            logger.error(f"Download failed: {response.status_code} - {response.text[:500] if response.text else 'No response body'}")
-            raise RuntimeError(f"Failed to download product: {response.status_code}")
+    def _load_remote(
+        self,
+        item: dict,
+        band_ids: list[str],
+        grid: GeoBox,
+        resolution_dirs: dict[str, str] | None = None,
+    ) -> dict[str, 'np.ndarray']:
+        """
+        Read the farm window of each band directly from the eodata S3 bucket.
 
-        # The response is a ZIP file containing the SAFE format
-        # Extract to temp directory and read bands
-        with tempfile.TemporaryDirectory() as tmpdir:
-            zip_path = os_module.path.join(tmpdir, "product.zip")
+        Only the JP2 tiles intersecting the window are transferred, so a farm
+        of a few hundred hectares costs a few MB instead of the ~1 GB product.
 
-            with open(zip_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+        Args:
+            item: Product metadata from query()
+            band_ids: Sentinel-2 band IDs to read (including SCL)
+            grid: Common output grid
+            resolution_dirs: Preferred resolution directory per band
 
-            logger.info("Extracting product...")
+        Returns:
+            Dictionary mapping band ID to a 2D array on the grid
+        """
+        safe_href = item.get("assets", {}).get("safe", {}).get("href")
+        if not safe_href:
+            raise RuntimeError(f"Product {item.get('name')} has no S3 path, cannot read remotely")
 
-            with zipfile.ZipFile(zip_path, "r") as zf:
-                zf.extractall(tmpdir)
-
-            # Find the SAFE directory
-            safe_dirs = [d for d in os_module.listdir(tmpdir) if d.endswith(".SAFE")]
-            if not safe_dirs:
-                raise RuntimeError("No SAFE directory found in product")
-
-            safe_dir = os_module.path.join(tmpdir, safe_dirs[0])
-            granule_dir = os_module.path.join(safe_dir, "GRANULE")
-
-            # Find the granule
-            granules = os_module.listdir(granule_dir)
-            if not granules:
-                raise RuntimeError("No granule found in product")
-
-            granule_path = os_module.path.join(granule_dir, granules[0], "IMG_DATA", "R10m")
-
-            # Load each band
-            band_arrays = {}
-            target_shape = None  # Track the shape of 10m bands for resampling
-            target_transform = None
-            target_crs = None
-            x_coords = None
-            y_coords = None
-
-            # Always load SCL band for cloud masking (add to band_ids if not present)
-            if "SCL" not in band_ids:
-                band_ids = band_ids + ["SCL"]
-
-            for band_id in band_ids:
-                # Handle different resolutions
-                if band_id in ("B11", "SCL"):  # SWIR and SCL are 20m
-                    res_dir = os_module.path.join(granule_dir, granules[0], "IMG_DATA", "R20m")
-                else:
-                    res_dir = granule_path
+        if not self.s3_access_key or not self.s3_secret_key:
+            raise ValueError(
+                "Copernicus S3 credentials not configured. "
+                "Set COPERNICUS_S3_ACCESS_KEY and COPERNICUS_S3_SECRET_KEY environment variables."
+            )
 
-                # Find the band file
-                band_files = [f for f in os_module.listdir(res_dir) if f"_{band_id}_" in f and f.endswith(".jp2")]
-                if not band_files:
-                    logger.warning(f"Band {band_id} not found, skipping")
-                    continue
+        # s3://eodata/Sentinel-2/... -> bucket "eodata", prefix "Sentinel-2/..."
+        bucket, _, prefix = safe_href[len("s3://"):].partition("/")
+        keys = self._list_s3_keys(bucket, f"{prefix.rstrip('/')}/GRANULE/")
 
-                band_path = os_module.path.join(res_dir, band_files[0])
+        band_keys = self._find_band_files(keys, band_ids, resolution_dirs)
+        band_paths = {band_id: f"/vsis3/{bucket}/{key}" for band_id, key in band_keys.items()}
 
-                logger.info(f"Reading {band_id} from {band_files[0]}")
+        with self._s3_env():
+            return self._read_bands(band_paths, grid)
 
-                with rasterio.open(band_path) as src:
-                    # Read data for the bbox
-                    # Convert bbox from WGS84 (lat/lon) to the raster's CRS
-                    from rasterio.windows import from_bounds
-                    from rasterio.warp import transform_bounds
+    def _list_s3_keys(self, bucket: str, prefix: str) -> list[str]:
+        """
+        List object keys under a prefix in the eodata bucket.
 
-                    # Transform bbox from WGS84 to the raster's CRS
-                    src_crs = src.crs
-                    if src_crs and str(src_crs) != "EPSG:4326":
-                        transformed_bbox = transform_bounds(
-                            "EPSG:4326",  # source CRS (WGS84)
-                            src_crs,      # target CRS (UTM)
-                            *bbox
-                        )
-                    else:
-                        transformed_bbox = bbox
+        Args:
+            bucket: S3 bucket name
+            prefix: Key prefix to list
 
-                    # Get window from transformed bounds
-                    try:
-                        window = from_bounds(*transformed_bbox, src.transform)
+        Returns:
+            List of object keys
+        """
+        import boto3
+
+        s3 = boto3.client(
+            "s3",
+            endpoint_url=self.s3_endpoint,
+            aws_access_key_id=self.s3_access_key,
+            aws_secret_access_key=self.s3_secret_key,
+            region_name="default",
+        )
 
-                        # Ensure window is within raster bounds
-                        window = window.intersection(
-                            rasterio.windows.Window(0, 0, src.width, src.height)
-                        )
+        keys = []
+        paginator = s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+
+        logger.info(f"Found {len(keys)} objects under s3://{bucket}/{prefix}")
+        return keys
+
+    def _s3_env(self):
+        """
+        GDAL environment for reading from the eodata S3 endpoint.
+
+        Returns:
+            rasterio.Env configured with the eodata credentials and endpoint
+        """
+        from urllib.parse import urlparse
+
+        import rasterio
+        from rasterio.session import AWSSession
+
+        endpoint = urlparse(self.s3_endpoint)
+
+        session = AWSSession(
+            aws_access_key_id=self.s3_access_key,
+            aws_secret_access_key=self.s3_secret_key,
+            region_name="default",
+            endpoint_url=endpoint.netloc or endpoint.path,
+        )
+
+        return rasterio.Env(
+            session=session,
+            AWS_HTTPS="NO" if endpoint.scheme == "http" else "YES",
+            AWS_VIRTUAL_HOSTING="FALSE",
+            # Don't list the granule directory on open, we already know the file names
+            GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR",
+            CPL_VSIL_CURL_ALLOWED_EXTENSIONS=".jp2",
+        )
+
+    def _find_band_files(
+        self,
+        paths: list[str],
+        band_ids: list[str],
+        resolution_dirs: dict[str, str] | None = None,
+    ) -> dict[str, str]:
+        """
+        Pick the JP2 file for each band from a listing of a SAFE product.
+
+        Works on anything that looks like paths inside a SAFE tree: local files,
+        ZIP member names or S3 keys.
+
+        Args:
+            paths: File paths inside the product
+            band_ids: Sentinel-2 band IDs to find
+            resolution_dirs: Preferred resolution directory per band (e.g.
+                {"SCL": "R60m"}); the default directory is used if the band
+                is missing there
+
+        Returns:
+            Dictionary mapping band ID to its path (missing bands are skipped)
+        """
+        band_paths = {}
+
+        for band_id in band_ids:
+            default_dir = self.BAND_RESOLUTION_DIRS.get(band_id, "R10m")
+            res_dirs = [(resolution_dirs or {}).get(band_id, default_dir), default_dir]
+
+            matches = []
+            for res_dir in dict.fromkeys(res_dirs):
+                matches = sorted(
+                    p for p in paths
+                    if "/GRANULE/" in p.replace("\\", "/")
+                    and f"/IMG_DATA/{res_dir}/" in p.replace("\\", "/")
+                    and f"_{band_id}_" in p.rsplit("/", 1)[-1]
+                    and p.endswith(".jp2")
+                )
+                if matches:
+                    break
+            if not matches:
+                logger.warning(f"Band {band_id} not found, skipping")
+                continue
+            band_paths[band_id] = matches[0]
+
+        return band_paths
+
+    def _read_bands(self, band_paths: dict[str, str], grid: GeoBox) -> dict[str, 'np.ndarray']:
+        """
+        Read each band file onto the common output grid.
+
+        Bands in the grid CRS are read through a window (boundless where the
+        grid runs past the tile edge, filled with 0 / SCL "no data"). Bands from
+        a product in a neighbouring UTM zone are warped onto the grid.
+
+        20m bands are resampled to the 10m grid by GDAL while decoding, by
+        reading straight into the grid shape (nearest for SCL, bilinear for
+        spectral bands), so no full-size intermediate copy is made.
 
-                        if window.width < 1 or window.height < 1:
-                            logger.warning(f"Window for {band_id} is empty, reading full raster")
-                            data = src.read(1)
-                        else:
-                            data = src.read(1, window=window)
-                    except Exception as e:
-                        logger.warning(f"Window error for {band_id}: {e}, reading full raster")
-                        data = src.read(1)
-
-                    # Convert DN to reflectance (divide by 10000) - except for SCL which is classification
-                    if band_id == "SCL":
-                        data = data.astype(np.float32)  # Keep as-is (0-11 classification values)
+        Args:
+            band_paths: Dictionary mapping band ID to a path rasterio can open
+                (local path or GDAL virtual file system path)
+            grid: Common output grid
+
+        Returns:
+            Dictionary mapping band ID to a 2D array on the grid: float32
+            reflectance for spectral bands and float32 class values for SCL,
+            or in compact mode uint16 DN and uint8 SCL
+        """
+        import numpy as np
+        import rasterio
+        from rasterio.enums import Resampling
+        from rasterio.windows import Window, from_bounds
+
+        height, width = grid.shape
+        west, south, east, north = grid.bounds
+
+        band_arrays = {}
+
+        for band_id, band_path in band_paths.items():
+            logger.info(f"Reading {band_id} from {band_path.rsplit('/', 1)[-1]}")
+
+            # Nearest neighbour for SCL to preserve classification values
+            resampling = Resampling.nearest if band_id == "SCL" else Resampling.bilinear
+
+            with rasterio.open(band_path) as src:
+                if src.crs == grid.crs:
+                    window = from_bounds(west, south, east, north, src.transform)
+                    window = window.round_offsets().round_lengths()
+                    full = Window(0, 0, src.width, src.height)
+
+                    if (
+                        window.col_off >= 0 and window.row_off >= 0
+                        and window.col_off + window.width <= full.width
+                        and window.row_off + window.height <= full.height
+                    ):
+                        data = src.read(
+                            1,
+                            window=window,
+                            out_shape=(height, width),
+                            resampling=resampling,
+                        )
                     else:
-                        data = data.astype(np.float32) / 10000
-
-                    # Track target shape and transform from 10m bands
-                    if band_id != "B11" and target_shape is None:
-                        target_shape = data.shape
-                        target_crs = src.crs
-
-                        # Compute x/y coordinate arrays from window
-                        if window and window.width >= 1 and window.height >= 1:
-                            # Get the transform for the window
-                            from rasterio.transform import from_bounds as transform_from_bounds
-                            win_transform = src.window_transform(window)
-
-                            # Create coordinate arrays
-                            # rasterio convention: pixel centers
-                            rows, cols = data.shape
-                            x_coords = np.array([
-                                win_transform.c + (col + 0.5) * win_transform.a
-                                for col in range(cols)
-                            ])
-                            y_coords = np.array([
-                                win_transform.f + (row + 0.5) * win_transform.e
-                                for row in range(rows)
-                            ])
-                        else:
-                            # Full raster - use src transform
-                            rows, cols = data.shape
-                            x_coords = np.array([
-                                src.transform.c + (col + 0.5) * src.transform.a
-                                for col in range(cols)
-                            ])
-                            y_coords = np.array([
-                                src.transform.f + (row + 0.5) * src.transform.e
-                                for row in range(rows)
-                            ])
-
-                        logger.info(f"Target shape: {target_shape}, CRS: {target_crs}")
-                        logger.info(f"X range: {x_coords.min():.1f} to {x_coords.max():.1f}")
-                        logger.info(f"Y range: {y_coords.min():.1f} to {y_coords.max():.1f}")
-
-                    band_arrays[band_id] = data
-
-            # Resample 20m bands (B11, SCL) to match 10m bands if needed
-            from scipy.ndimage import zoom
-            for band_20m in ["B11", "SCL"]:
-                if band_20m in band_arrays and target_shape is not None:
-                    band_data = band_arrays[band_20m]
-                    if band_data.shape != target_shape:
-                        zoom_factors = (
-                            target_shape[0] / band_data.shape[0],
-                            target_shape[1] / band_data.shape[1]
+                        # Farm runs past the tile edge; pad with nodata
+                        data = src.read(
+                            1,
+                            window=window,
+                            out_shape=(height, width),
+                            resampling=resampling,
+                            boundless=True,
+                            fill_value=0,
                         )
-                        # Use order=0 (nearest neighbor) for SCL to preserve classification values
-                        interp_order = 0 if band_20m == "SCL" else 1
-                        logger.info(f"Resampling {band_20m} from {band_data.shape} to {target_shape}")
-                        band_arrays[band_20m] = zoom(band_data, zoom_factors, order=interp_order)
-
-            # Stack into xarray DataArray
-            # Rename to semantic names
-            semantic_bands = []
-            arrays = []
-            for semantic_name, band_id in self.band_names.items():
-                if band_id in band_arrays:
-                    arrays.append(band_arrays[band_id])
-                    semantic_bands.append(semantic_name)
-
-            if not arrays:
-                raise RuntimeError("No band data loaded")
-
-            # Stack arrays
-            stacked = np.stack(arrays, axis=0)
-
-            # Create DataArray with proper spatial coordinates
-            coords_dict = {"band": semantic_bands}
-            if y_coords is not None:
-                coords_dict["y"] = y_coords
-            if x_coords is not None:
-                coords_dict["x"] = x_coords
-
-            result = xr.DataArray(
-                stacked,
-                dims=["band", "y", "x"],
-                coords=coords_dict,
-                attrs={"crs": str(target_crs) if target_crs else "EPSG:32616"},  # Default to UTM 16N
-            )
+                else:
+                    # Product from a neighbouring UTM zone, warp its window onto the grid
+                    logger.info(f"Warping {band_id} from {src.crs} to {grid.crs}")
+                    window = read_window(src, grid, indexes=[1], resampling=resampling.name)
+                    data = get_warp_engine().reproject(
+                        window.data[0], window.geobox, grid, resampling.name,
+                        src_nodata=0, dst_nodata=0,
+                    )
+
+            if self.compact:
+                # Keep the stored integers, 0 is nodata for DN and SCL alike
+                data = data.astype(np.uint8 if band_id == "SCL" else np.uint16, copy=False)
+            else:
+                # Convert DN to reflectance (divide by 10000) - except for SCL which is classification
+                data = data.astype(np.float32)  # SCL keeps its 0-11 classification values
+                if band_id != "SCL":
+                    data /= 10000
 
-            return result
+            band_arrays[band_id] = data
+
+        if not band_arrays:
+            raise RuntimeError("No band data loaded")
+
+        return band_arrays
+
+    def prefilter(
+        self,
+        items: list,
+        bbox: list[float],
+        min_clear_fraction: float,
+        geometries: list[dict] | None = None,
+    ) -> list:
+        """
+        Drop products that are too cloudy over the farm, reading only their SCL.
+
+        The scene-wide cloudCover says nothing about the farm: a product can be
+        10% cloudy overall and fully clouded here. Each product's 60m SCL is
+        read for the farm window alone (a few kB in remote mode) and products
+        whose clear fraction falls below min_clear_fraction are dropped before
+        any 10m band is fetched or decoded.
+
+        In zip mode the product has to be downloaded to read its SCL, so the
+        prefilter only runs when the scene cache is enabled and load() can
+        reuse that download; otherwise the items are returned unchanged.
+
+        Args:
+            items: Product metadata from query()
+            bbox: Bounding box [west, south, east, north]
+            min_clear_fraction: Minimum clear fraction (0.0-1.0) to keep a product
+            geometries: Optional WGS84 GeoJSON geometries (e.g. paddocks); the
+                clear fraction is then measured inside them rather than over
+                the whole window
+
+        Returns:
+            Products that passed, in their original order (products whose SCL
+            could not be read are kept)
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        import numpy as np
+
+        if not items or min_clear_fraction <= 0:
+            return items
+
+        if self.read_mode == "zip" and get_scene_cache() is None:
+            logger.info("SCL prefilter skipped: zip read mode needs the scene cache to reuse downloads")
+            return items
+
+        grid = GeoBox.from_bbox(bbox, self.PREFILTER_RESOLUTION, align=self.GRID_ALIGNMENT)
+
+        inside = np.ones(grid.shape, dtype=bool)
+        if geometries:
+            from rasterio.features import geometry_mask
+            from rasterio.warp import transform_geom
+
+            shapes = []
+            for geometry in geometries:
+                # Paddock geometries arrive as GeoJSON Features
+                if hasattr(geometry, "__geo_interface__"):
+                    geometry = geometry.__geo_interface__
+                if isinstance(geometry, dict) and geometry.get("type") == "Feature":
+                    geometry = geometry.get("geometry")
+                if not geometry:
+                    continue
+                try:
+                    shapes.append(transform_geom("EPSG:4326", grid.crs, geometry))
+                except Exception as e:
+                    logger.warning(f"SCL prefilter skipping a geometry it cannot transform: {e}")
+            if shapes:
+                try:
+                    inside = geometry_mask(
+                        shapes, out_shape=grid.shape, transform=grid.transform,
+                        all_touched=True, invert=True,
+                    )
+                except Exception as e:
+                    logger.warning(f"SCL prefilter measuring the whole window, paddocks unusable: {e}")
+            if not inside.any():
+                inside[:] = True
+
+        def clear_fraction(item: dict) -> float | None:
+            load = self._load_remote if self.read_mode == "remote" else self._load_zip
+            try:
+                scl = load(item, ["SCL"], grid, {"SCL": "R60m"}).get("SCL")
+            except Exception as e:
+                logger.warning(f"SCL prefilter could not read {item.get('name')}: {e}")
+                return None
+            if scl is None:
+                return None
+            return float((~np.isin(scl[inside], self.CLOUD_CLASSES)).mean())
+
+        workers = max(1, min(self.max_workers, len(items)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            fractions = list(pool.map(clear_fraction, items))
+
+        kept = []
+        for item, fraction in zip(items, fractions):
+            if fraction is None or fraction >= min_clear_fraction:
+                kept.append(item)
+            else:
+                logger.info(
+                    f"SCL prefilter dropped {item.get('name')}: {fraction:.1%} clear over the farm "
+                    f"(scene cloudCover {item.get('properties', {}).get('eo:cloud_cover')})"
+                )
+
+        logger.info(f"SCL prefilter kept {len(kept)}/{len(items)} products (min clear {min_clear_fraction:.0%})")
+        return kept
 
     def cloud_mask(
         self,
@@ -510,22 +948,28 @@ class CopernicusProvider(BaseSatelliteProvider):
         - 10: Thin cirrus (MASK)
         - 11: Snow/ice
 
+        Pixels with no data (0) are masked too: they appear where the farm
+        window runs past the edge of a product's footprint.
+
         Args:
-            data: xarray DataArray with band data including 'scl' band
+            data: xarray DataArray with band data including 'scl' band,
+                dims (band, y, x) or (time, band, y, x)
             items: Product metadata from query()
             bbox: Optional bounding box
 
         Returns:
             Tuple of (masked_data, cloud_free_percentage, cloud_mask)
-            - masked_data: DataArray with cloudy pixels set to NaN
+            - masked_data: DataArray with cloudy pixels set to NaN (nodata
+              when compact)
             - cloud_free_percentage: Fraction of clear pixels (0.0-1.0)
-            - cloud_mask: Boolean DataArray where True = cloudy/invalid pixel
+            - cloud_mask: Boolean DataArray where True = cloudy/invalid pixel,
+              with a time dimension if the data has one
         """
         import numpy as np
         import xarray as xr
 
         # Check if SCL band is available
-        band_names = list(data.coords.get("band", []))
+        band_names = [str(b) for b in data.coords["band"].values] if "band" in data.coords else []
         if "scl" not in band_names:
             logger.warning("SCL band not found in data, falling back to metadata cloud cover")
             # Fallback to metadata-based cloud cover
@@ -547,7 +991,7 @@ class CopernicusProvider(BaseSatelliteProvider):
                 np.zeros(first_band.shape, dtype=bool),
                 dims=first_band.dims,
                 coords={k: v for k, v in first_band.coords.items() if k != 'band'},
-                attrs={'crs': data.attrs.get('crs', 'EPSG:4326')},  # Preserve CRS for zonal stats
+                attrs=dict(data.attrs),  # Preserve the grid (CRS, transform) for zonal stats
             )
             return data, cloud_free_pct, cloud_mask_arr
 
@@ -555,13 +999,12 @@ class CopernicusProvider(BaseSatelliteProvider):
         scl = data.sel(band='scl')
 
         # Create cloud mask: True = cloudy/invalid pixel
-        # Classes to mask: 3 (shadow), 8 (cloud med), 9 (cloud high), 10 (cirrus)
-        cloud_classes = [3, 8, 9, 10]
+        # Classes to mask: 0 (no data), 3 (shadow), 8 (cloud med), 9 (cloud high), 10 (cirrus)
         cloud_mask_arr = xr.DataArray(
-            np.isin(scl.values, cloud_classes),
+            np.isin(scl.values, self.CLOUD_CLASSES),
             dims=scl.dims,
             coords={k: v for k, v in scl.coords.items() if k != 'band'},
-            attrs={'crs': data.attrs.get('crs', 'EPSG:4326')},  # Preserve CRS for zonal stats
+            attrs=dict(data.attrs),  # Preserve the grid (CRS, transform) for zonal stats
         )
 
         # Calculate actual cloud-free percentage
@@ -574,7 +1017,7 @@ class CopernicusProvider(BaseSatelliteProvider):
         # Apply mask to all bands except SCL (set cloudy pixels to NaN)
         # Create a mask that broadcasts across all bands
         spectral_bands = [b for b in band_names if b != 'scl']
-        masked_data = data.sel(band=spectral_bands).where(~cloud_mask_arr)
+        masked_data = mask_pixels(data.sel(band=spectral_bands), cloud_mask_arr)
 
         return masked_data, cloud_free_pct, cloud_mask_arr
 
@@ -0,0 +1,388 @@
+"""
+Resumable, integrity-checked downloads for large scene assets.
+
+Copernicus product ZIPs and PlanetScope GeoTIFFs run to hundreds of MB. A
+single streamed GET with one long timeout restarts from zero after any
+connection reset, which on a flaky link can cost a whole job timeout.
+
+The Downloader streams into a partial file and, when the connection drops,
+resumes with an HTTP Range request from the bytes already on disk. Reads use
+an adaptive buffer that grows while the link keeps up and shrinks when single
+reads stall. The finished file is checked against the expected size and,
+when the source publishes one, its checksum before it is moved into place.
+Every download reports its throughput, and the process-wide instance keeps
+running totals for sizing timeouts and worker counts.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional, TypedDict, Union
+
+logger = logging.getLogger(__name__)
+
+HeadersArg = Union[dict, Callable[[], dict], None]
+
+
+class DownloadError(RuntimeError):
+    """Raised when a download fails for good (HTTP error, retries exhausted, bad checksum)."""
+    def __init__(self, url: str, message: str, status_code: Optional[int] = None):
+        self.url = url
+        self.status_code = status_code
+        super().__init__(message)
+
+
+class DownloadStats(TypedDict):
+    """Outcome of one download."""
+    url: str
+    bytes: int
+    resumed_bytes: int
+    attempts: int
+    seconds: float
+    mb_per_second: float
+    verified: bool
+
+
+class DownloaderTotals(TypedDict):
+    """Running totals across every download in the process."""
+    downloads: int
+    bytes: int
+    resumes: int
+    retries: int
+    failures: int
+    checksum_failures: int
+    seconds: float
+
+
+class Downloader:
+    """
+    Streaming HTTP downloader with Range resume and integrity checks.
+
+    Connection resets, read timeouts, 5xx and 429 responses are retried with
+    exponential backoff, resuming from the partial file. Other HTTP errors
+    are raised at once as DownloadError with the status code.
+    """
+
+    # Adaptive read buffer bounds and starting size (bytes)
+    MIN_CHUNK = 64 * 1024
+    MAX_CHUNK = 16 * 1024 * 1024
+    INITIAL_CHUNK = 1024 * 1024
+
+    # A read faster than this grows the buffer, slower than SLOW_READ shrinks it (seconds)
+    FAST_READ = 0.1
+    SLOW_READ = 1.0
+
+    PARTIAL_SUFFIX = ".part"
+
+    def __init__(
+        self,
+        max_retries: Optional[int] = None,
+        connect_timeout: float = 30,
+        read_timeout: Optional[float] = None,
+        backoff: float = 2.0,
+        max_backoff: float = 60.0,
+    ):
+        """
+        Initialize the downloader.
+
+        Args:
+            max_retries: Retries after the first attempt (defaults to
+                DOWNLOAD_MAX_RETRIES env var, then 5)
+            connect_timeout: Seconds to wait for a connection
+            read_timeout: Seconds a single socket read may stall before the
+                attempt is abandoned and resumed (defaults to
+                DOWNLOAD_READ_TIMEOUT env var, then 60)
+            backoff: First retry delay in seconds, doubled on every retry
+            max_backoff: Cap on the retry delay in seconds
+        """
+        self.max_retries = max_retries if max_retries is not None else int(
+            os.getenv("DOWNLOAD_MAX_RETRIES", "5")
+        )
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout or float(os.getenv("DOWNLOAD_READ_TIMEOUT", "60"))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._totals = DownloaderTotals(
+            downloads=0, bytes=0, resumes=0, retries=0,
+            failures=0, checksum_failures=0, seconds=0.0,
+        )
+
+    def download(
+        self,
+        url: str,
+        dest_path: str,
+        headers: HeadersArg = None,
+        expected_size: Optional[int] = None,
+        md5: Optional[str] = None,
+    ) -> DownloadStats:
+        """
+        Download a URL to a file, resuming after dropped connections.
+
+        The data is written to dest_path + ".part" and renamed to dest_path
+        only once it is complete and verified.
+
+        Args:
+            url: URL to download
+            dest_path: File path to write to
+            headers: Request headers, or a function returning them for each
+                attempt (so expiring bearer tokens are refreshed on retry)
+            expected_size: Size in bytes published by the catalog, if known
+            md5: MD5 hex digest published by the catalog, if known
+
+        Returns:
+            DownloadStats for this download
+
+        Raises:
+            DownloadError: On a non-retryable HTTP error, after the last
+                retry, or when the size or checksum does not match
+        """
+        import requests
+        import urllib3
+
+        part_path = dest_path + self.PARTIAL_SUFFIX
+        start = time.time()
+        resumed_bytes = 0
+        transferred = 0
+        total_size = expected_size
+        attempt = 0
+
+        # A leftover partial file could belong to another transfer, never resume from it
+        if os.path.exists(part_path):
+            os.unlink(part_path)
+
+        while True:
+            attempt += 1
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+            try:
+                if total_size is not None and offset == total_size:
+                    # Everything is on disk already, nothing left to request
+                    break
+
+                request_headers = dict(headers() if callable(headers) else (headers or {}))
+                # Range offsets count bytes on the wire, so never let the body be re-encoded
+                request_headers["Accept-Encoding"] = "identity"
+                if offset:
+                    request_headers["Range"] = f"bytes={offset}-"
+
+                with requests.get(
+                    url,
+                    headers=request_headers,
+                    stream=True,
+                    timeout=(self.connect_timeout, self.read_timeout),
+                    allow_redirects=True,
+                ) as response:
+                    if response.status_code == 416 and offset:
+                        # Range past the end: either complete, or the partial file is stale
+                        total = self._content_range_total(response.headers.get("Content-Range"))
+                        if total is not None and offset == total:
+                            total_size = total
+                            break
+                        logger.warning(f"Discarding unusable partial download of {url[:80]}")
+                        os.unlink(part_path)
+                        continue
+
+                    if response.status_code == 429 or response.status_code >= 500:
+                        raise _RetryableStatus(response.status_code, response.headers.get("Retry-After"))
+
+                    if response.status_code not in (200, 206):
+                        body = response.text[:500] if response.text else "No response body"
+                        raise DownloadError(
+                            url,
+                            f"Download failed: {response.status_code} - {body}",
+                            status_code=response.status_code,
+                        )
+
+                    if response.status_code == 206 and offset:
+                        mode = "ab"
+                        resumed_bytes += offset
+                        with self._lock:
+                            self._totals["resumes"] += 1
+                        logger.info(f"Resuming download at {offset / 1e6:.1f} MB")
+                        total = self._content_range_total(response.headers.get("Content-Range"))
+                    else:
+                        # Server ignored the Range header (or this is the first attempt)
+                        mode = "wb"
+                        offset = 0
+                        length = response.headers.get("Content-Length")
+                        total = int(length) if length and length.isdigit() else None
+
+                    if total is not None:
+                        if total_size is not None and total != total_size:
+                            # What the server actually sends is what the file must hold
+                            logger.warning(f"Server reports {total} bytes, catalog says {total_size}")
+                        total_size = total
+
+                    transferred += self._stream(response, part_path, mode)
+
+                size = os.path.getsize(part_path)
+                if total_size is not None and size < total_size:
+                    raise _Incomplete(size, total_size)
+                break
+
+            except DownloadError:
+                with self._lock:
+                    self._totals["failures"] += 1
+                raise
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                    urllib3.exceptions.HTTPError, _RetryableStatus, _Incomplete) as e:
+                # Raw body reads raise urllib3 errors (ProtocolError, ReadTimeoutError) directly
+                if attempt > self.max_retries:
+                    with self._lock:
+                        self._totals["failures"] += 1
+                    raise DownloadError(
+                        url,
+                        f"Download failed after {attempt} attempts: {e}",
+                        status_code=getattr(e, "status_code", None),
+                    ) from e
+
+                delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+                retry_after = getattr(e, "retry_after", None)
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                with self._lock:
+                    self._totals["retries"] += 1
+                logger.warning(
+                    f"Download interrupted ({e}), retry {attempt}/{self.max_retries} in {delay:.0f}s"
+                )
+                time.sleep(delay)
+
+        size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if total_size is not None and size != total_size:
+            os.unlink(part_path)
+            raise DownloadError(url, f"Size mismatch: got {size} bytes, expected {total_size}")
+
+        verified = False
+        if md5:
+            digest = self._md5(part_path)
+            if digest.lower() != md5.lower():
+                os.unlink(part_path)
+                with self._lock:
+                    self._totals["checksum_failures"] += 1
+                logger.warning(f"Checksum mismatch for {url[:80]}, downloading again from scratch")
+                return self._retry_after_checksum(url, dest_path, headers, expected_size, md5)
+            verified = True
+
+        os.replace(part_path, dest_path)
+
+        seconds = max(time.time() - start, 1e-6)
+        stats = DownloadStats(
+            url=url,
+            bytes=size,
+            resumed_bytes=resumed_bytes,
+            attempts=attempt,
+            seconds=seconds,
+            mb_per_second=transferred / 1e6 / seconds,
+            verified=verified,
+        )
+        with self._lock:
+            self._totals["downloads"] += 1
+            self._totals["bytes"] += transferred
+            self._totals["seconds"] += seconds
+
+        logger.info(
+            f"Downloaded {size / 1e6:.1f} MB in {seconds:.1f}s ({stats['mb_per_second']:.1f} MB/s, "
+            f"{attempt} attempt{'s' if attempt > 1 else ''}"
+            f"{', verified' if verified else ''})"
+        )
+        return stats
+
+    def totals(self) -> DownloaderTotals:
+        """Running totals across every download made through this instance."""
+        with self._lock:
+            return DownloaderTotals(**self._totals)
+
+    def _retry_after_checksum(
+        self,
+        url: str,
+        dest_path: str,
+        headers: HeadersArg,
+        expected_size: Optional[int],
+        md5: str,
+    ) -> DownloadStats:
+        """Download once more from scratch after a checksum mismatch; a second mismatch is fatal."""
+        stats = self.download(url, dest_path, headers, expected_size, md5=None)
+        digest = self._md5(dest_path)
+        if digest.lower() != md5.lower():
+            os.unlink(dest_path)
+            with self._lock:
+                self._totals["checksum_failures"] += 1
+            raise DownloadError(url, f"Checksum mismatch: got {digest}, expected {md5}")
+        stats["verified"] = True
+        return stats
+
+    def _stream(self, response, part_path: str, mode: str) -> int:
+        """Copy the response body to the partial file with an adaptive read size; returns bytes written."""
+        chunk = self.INITIAL_CHUNK
+        raw = response.raw
+        written = 0
+
+        with open(part_path, mode) as f:
+            while True:
+                began = time.monotonic()
+                data = raw.read(chunk, decode_content=True)
+                if not data:
+                    break
+                f.write(data)
+                written += len(data)
+
+                elapsed = time.monotonic() - began
+                if elapsed < self.FAST_READ and len(data) == chunk:
+                    chunk = min(chunk * 2, self.MAX_CHUNK)
+                elif elapsed > self.SLOW_READ:
+                    chunk = max(chunk // 2, self.MIN_CHUNK)
+
+        return written
+
+    @staticmethod
+    def _content_range_total(content_range: Optional[str]) -> Optional[int]:
+        """Total size from a Content-Range header such as "bytes 100-199/1000"."""
+        if not content_range or "/" not in content_range:
+            return None
+        total = content_range.rsplit("/", 1)[1].strip()
+        return int(total) if total.isdigit() else None
+
+    @staticmethod
+    def _md5(path: str) -> str:
+        """MD5 hex digest of a file."""
+        digest = hashlib.md5()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(8 * 1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+
+class _RetryableStatus(Exception):
+    """Transient HTTP status (429 or 5xx) worth retrying."""
+    def __init__(self, status_code: int, retry_after: Optional[str] = None):
+        self.status_code = status_code
+        self.retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+        super().__init__(f"HTTP {status_code}")
+
+
+class _Incomplete(Exception):
+    """Connection closed before the full body arrived."""
+    def __init__(self, size: int, total: int):
+        super().__init__(f"connection closed at {size}/{total} bytes")
+
+
+_downloader: Optional[Downloader] = None
+_downloader_lock = threading.Lock()
+
+
+def get_downloader() -> Downloader:
+    """
+    Get the process-wide downloader shared by all providers.
+
+    Returns:
+        Downloader instance
+    """
+    global _downloader
+
+    with _downloader_lock:
+        if _downloader is None:
+            _downloader = Downloader()
+        return _downloader
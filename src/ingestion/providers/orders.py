@@ -0,0 +1,145 @@
+"""
+Clip-on-delivery acquisition of Planet assets through the Orders API.
+
+The Data API only hands out whole scenes: a PSScene analytic asset is a few
+hundred MB, of which a small farm uses a fraction of a percent, and all of
+it has to be downloaded and warped locally.
+
+A clip order instead asks Planet to cut the analytic and UDM2 assets of
+every item to the farm AOI on their side and deliver them as one bundle.
+One order covers all items of a run; it is polled until Planet has
+processed it, then the farm-sized results are downloaded concurrently.
+ClipOrder is a drop-in replacement for ActivationOrchestrator, so load()
+and cloud_mask() consume the results the same way.
+"""
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, Optional, Sequence
+
+from . import ActivationTimeoutError, QuotaExceededError
+from .activation import ActivationOrchestrator
+
+if TYPE_CHECKING:
+    from .planet_scope import PlanetScopeProvider
+
+logger = logging.getLogger(__name__)
+
+
+class ClipOrder(ActivationOrchestrator):
+    """
+    Order a set of Planet assets clipped to an AOI and download the results.
+
+    Clipped rasters depend on the AOI, so they go to temporary files rather
+    than the shared scene cache.
+    """
+
+    # Orders take minutes rather than seconds, so poll less eagerly
+    DEFAULT_POLL_INTERVAL = 10.0
+    MAX_POLL_INTERVAL = 60.0
+
+    # Order states after which Planet does no more work
+    FINAL_STATES = ("success", "partial", "failed", "cancelled")
+
+    def __init__(
+        self,
+        provider: 'PlanetScopeProvider',
+        aoi: Sequence[float],
+        timeout: int,
+        download_workers: Optional[int] = None,
+        poll_interval: Optional[float] = None,
+    ):
+        """
+        Initialize the order.
+
+        Args:
+            provider: Provider used for the Planet API requests and downloads
+            aoi: Clip bounds [west, south, east, north] in WGS84
+            timeout: Seconds to wait for Planet to process the order
+            download_workers: Concurrent downloads (defaults to
+                PL_DOWNLOAD_WORKERS env var, then 4)
+            poll_interval: First interval between status polls in seconds
+                (defaults to PL_POLL_INTERVAL env var, then 10)
+        """
+        super().__init__(provider, {}, download_workers, poll_interval)
+        self.aoi = list(aoi)
+        self.timeout = timeout
+
+    def _start_known(self, pending: dict[tuple[str, str], str]) -> None:
+        """Clipped results are always ordered; stored locations are for whole scenes."""
+
+    def _poll(self, pending: dict[tuple[str, str], str]) -> None:
+        """Place one order for everything pending and wait for its results."""
+        products: dict[str, list[str]] = {}
+        for (item_id, _), item_type in pending.items():
+            ids = products.setdefault(item_type, [])
+            if item_id not in ids:
+                ids.append(item_id)
+
+        try:
+            order = self.provider._place_order(products, self.aoi)
+        except Exception as e:
+            self._fail_all(pending, e)
+            return
+
+        order_id = order.get("id")
+        logger.info(f"Placed clip order {order_id} for {sum(map(len, products.values()))} items")
+
+        started = time.monotonic()
+        interval = self.poll_interval
+
+        while not self._stop.is_set():
+            state = order.get("state")
+
+            if state in ("success", "partial"):
+                self._collect(pending, order)
+                return
+            if state in self.FINAL_STATES:
+                self._fail_all(pending, ValueError(f"Planet order {order_id} {state}"))
+                return
+
+            if time.monotonic() - started >= self.timeout:
+                for key in list(pending):
+                    self._fail(pending, key, ActivationTimeoutError(key[0], key[1], self.timeout))
+                return
+
+            logger.debug(f"Clip order {order_id} is {state}, next poll in {interval:.0f}s")
+            if self._stop.wait(interval):
+                return
+            interval = min(interval * self.BACKOFF, self.MAX_POLL_INTERVAL)
+
+            try:
+                order = self.provider._get_order(order_id)
+            except QuotaExceededError as e:
+                self._fail_all(pending, e)
+                return
+            except Exception as e:
+                # Transient API error, try again next round
+                logger.warning(f"Could not poll order {order_id}: {e}")
+
+    def _collect(self, pending: dict[tuple[str, str], str], order: dict) -> None:
+        """Hand every delivered result to the download pool."""
+        results = {
+            os.path.basename(result.get("name", "")): result
+            for result in order.get("_links", {}).get("results", [])
+        }
+
+        for key in list(pending):
+            result = results.get(self.provider._order_result_name(*key))
+            if result is None:
+                self._fail(pending, key, ValueError(
+                    f"Order {order.get('id')} delivered no {key[1]} for item {key[0]}"
+                ))
+                continue
+
+            del pending[key]
+            self._pool.submit(self._download, key, result)
+
+    def _fetch(self, key: tuple[str, str], download_url: str, md5: Optional[str]) -> tuple[str, bool]:
+        """Download one clipped result to a temporary file."""
+        return self.provider._download_asset(download_url, md5), True
+
+    def _fail_all(self, pending: dict[tuple[str, str], str], error: Exception) -> None:
+        """Resolve every pending asset with the same error."""
+        for key in list(pending):
+            self._fail(pending, key, error)
@@ -7,17 +7,54 @@ Requires API key and has per-scene costs.
 import logging
 import tempfile
 import time
-from typing import TYPE_CHECKING, Optional
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from raster import (
+    DN_NODATA,
+    GeoBox,
+    Raster,
+    acquisition_time,
+    compact_attrs,
+    compact_mode_enabled,
+    mask_pixels,
+)
+from warp import get_warp_engine, read_window
 
 from . import BaseSatelliteProvider, BandNames, ActivationTimeoutError, QuotaExceededError
+from .activation import ActivationOrchestrator
+from .auth import TokenRequestError, get_token_broker
+from .download import get_downloader
+from .orders import ClipOrder
+from .planet_store import get_planet_store
+from .rate_limit import get_rate_limiter
+from .scene_cache import get_scene_cache
 
 if TYPE_CHECKING:
+    import numpy as np
     import xarray as xr
     import geopandas as gpd
 
 logger = logging.getLogger(__name__)
 
 
+class _AssetSession:
+    """
+    Assets of one load() run, shared with the cloud_mask() that follows it.
+
+    Holds the orchestrator acquiring the analytic and UDM2 assets (None when
+    every item came from the store), and the UDM2 clear masks load() already
+    warped onto its grid, by item ID.
+    """
+
+    __slots__ = ("activation", "grid", "clear_masks")
+
+    def __init__(self, activation: Optional[ActivationOrchestrator], grid: GeoBox):
+        self.activation = activation
+        self.grid = grid
+        self.clear_masks: dict[str, 'np.ndarray'] = {}
+
+
 class PlanetScopeProvider(BaseSatelliteProvider):
     """
     Provider for PlanetScope 4-band imagery.
@@ -30,12 +67,42 @@ class PlanetScopeProvider(BaseSatelliteProvider):
     in 'inactive' state and need to be activated first (takes seconds to minutes).
     """
 
+    # Planet OAuth2 M2M uses Sentinel Hub's OAuth endpoint
+    # See: https://docs.planet.com/develop/authentication/
+    TOKEN_URL = "https://services.sentinel-hub.com/auth/realms/main/protocol/openid-connect/token"
+
+    # Assets fetched per item, and how long each may take to activate (seconds)
+    ANALYTIC_ASSET = "ortho_analytic_4b"
+    UDM2_ASSET = "ortho_udm2"
+    ACTIVATION_TIMEOUTS = {
+        ANALYTIC_ASSET: 300,
+        UDM2_ASSET: 120,
+    }
+
+    # Orders API, used in "clip" delivery mode
+    ORDERS_URL = "https://api.planet.com/compute/ops/orders/v2"
+
+    # Bundle delivering both assets above, the file name each is delivered
+    # under (prefixed with the item ID), and how long an order may take (seconds)
+    ORDER_BUNDLE = "analytic_udm2"
+    ORDER_RESULT_SUFFIXES = {
+        ANALYTIC_ASSET: "_3B_AnalyticMS_clip.tif",
+        UDM2_ASSET: "_3B_udm2_clip.tif",
+    }
+    ORDER_TIMEOUT = 1800
+
+    # Name of the warped UDM2 clear mask in the PlanetScope store
+    CLEAR_MASK = "clear_mask"
+
     def __init__(
         self,
         api_key: Optional[str] = None,
         client_id: Optional[str] = None,
         client_secret: Optional[str] = None,
-        base_url: str = "https://api.planet.com/data/v1"
+        base_url: str = "https://api.planet.com/data/v1",
+        compact: Optional[bool] = None,
+        delivery: Optional[str] = None,
+        orders_url: str = ORDERS_URL,
     ):
         """
         Initialize the PlanetScope provider.
@@ -51,13 +118,30 @@ class PlanetScopeProvider(BaseSatelliteProvider):
             client_id: OAuth2 client ID. Falls back to PL_CLIENT_ID env var.
             client_secret: OAuth2 client secret. Falls back to PL_CLIENT_SECRET env var.
             base_url: Base URL for Planet Data API
+            compact: Keep bands as uint16 DN with nodata 0 instead of float32
+                reflectance (defaults to COMPACT_DTYPE env var, then False)
+            delivery: "download" to activate and download whole scenes through
+                the Data API, "remote" to activate them but read only the farm
+                window of each COG over HTTP range requests, "clip" to order the
+                scenes clipped to the farm through the Orders API (defaults to
+                PL_DELIVERY_MODE env var, then "download")
+            orders_url: Base URL for Planet Orders API
         """
+        import os
+
         self._api_key = api_key
         self._client_id = client_id
         self._client_secret = client_secret
         self._base_url = base_url
-        self._oauth_token: Optional[str] = None
-        self._oauth_token_expires: float = 0
+        self._orders_url = orders_url.rstrip("/")
+        self.compact = compact_mode_enabled() if compact is None else compact
+
+        self.delivery = (delivery or os.getenv("PL_DELIVERY_MODE") or "download").lower()
+        if self.delivery not in ("download", "remote", "clip"):
+            raise ValueError(f"Unknown Planet delivery mode: {self.delivery}")
+
+        # Assets of the last load(), whose UDM2 masks cloud_mask() consumes
+        self._session: Optional[_AssetSession] = None
 
     @property
     def resolution_meters(self) -> int:
@@ -126,7 +210,8 @@ class PlanetScopeProvider(BaseSatelliteProvider):
         """
         Get OAuth2 access token using client credentials flow.
 
-        Caches the token and refreshes when expired.
+        Tokens come from the process-wide token broker, which shares them
+        across provider instances and refreshes them before expiry.
 
         Returns:
             Access token string
@@ -137,47 +222,20 @@ class PlanetScopeProvider(BaseSatelliteProvider):
         """
         import requests
 
-        # Check if we have a valid cached token
-        if self._oauth_token and time.time() < self._oauth_token_expires:
-            return self._oauth_token
-
         if not self._has_oauth_credentials():
             raise ValueError(
                 "Planet OAuth2 credentials required. Set PL_CLIENT_ID and "
                 "PL_CLIENT_SECRET environment variables."
             )
 
-        logger.info("Requesting Planet OAuth2 access token...")
-
-        # Planet OAuth2 M2M uses Sentinel Hub's OAuth endpoint
-        # See: https://docs.planet.com/develop/authentication/
-        token_url = "https://services.sentinel-hub.com/auth/realms/main/protocol/openid-connect/token"
-        response = requests.post(
-            token_url,
-            data={
-                "grant_type": "client_credentials",
-                "client_id": self.client_id,
-                "client_secret": self.client_secret,
-            },
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-            timeout=30
-        )
-
-        if response.status_code == 401:
-            raise QuotaExceededError("PlanetScope", "Invalid OAuth2 credentials")
-        elif response.status_code == 429:
-            raise QuotaExceededError("PlanetScope", "Rate limit exceeded during auth")
-
-        response.raise_for_status()
-        token_data = response.json()
-
-        self._oauth_token = token_data.get("access_token")
-        expires_in = token_data.get("expires_in", 3600)
-        # Refresh 60 seconds before expiry
-        self._oauth_token_expires = time.time() + expires_in - 60
-
-        logger.info(f"Got Planet access token, expires in {expires_in}s")
-        return self._oauth_token
+        try:
+            return get_token_broker().get_token(self.TOKEN_URL, self.client_id, self.client_secret)
+        except TokenRequestError as e:
+            if e.status_code == 401:
+                raise QuotaExceededError("PlanetScope", "Invalid OAuth2 credentials") from e
+            elif e.status_code == 429:
+                raise QuotaExceededError("PlanetScope", "Rate limit exceeded during auth") from e
+            raise requests.HTTPError(str(e)) from e
 
     def _get_auth_headers(self) -> dict:
         """
@@ -216,12 +274,42 @@ class PlanetScopeProvider(BaseSatelliteProvider):
                 "for Sentinel Hub services, not the Data API."
             )
 
+    def _api_request(self, kind: str, method: str, url: str, **kwargs):
+        """
+        Send an authenticated Planet API request through the shared rate limiter.
+
+        Requests wait for budget in their endpoint class, and 429 responses
+        are retried after Retry-After (see RateLimiter), so a 429 only comes
+        back once PL_RATE_LIMIT_MAX_WAIT has been spent on them. With OAuth2
+        credentials a 401 drops the cached token and the request is sent once
+        more with a new one.
+
+        Args:
+            kind: Endpoint class ("search", "activation", "orders" or "other")
+            method: HTTP method
+            url: Request URL
+            **kwargs: Passed on to requests.request()
+
+        Returns:
+            requests.Response
+        """
+        response = get_rate_limiter().request(kind, method, url, headers=self._get_auth_headers, **kwargs)
+        if response.status_code != 401 or self._has_api_key() or not self._has_oauth_credentials():
+            return response
+
+        # Revoked or expired early: fetch a new token and resend once
+        rejected = response.request.headers.get("Authorization", "").removeprefix("Bearer ")
+        logger.warning("Planet rejected the access token, retrying with a new one")
+        get_token_broker().invalidate(self.TOKEN_URL, self.client_id, self.client_secret, rejected or None)
+        return get_rate_limiter().request(kind, method, url, headers=self._get_auth_headers, **kwargs)
+
     def _activate_asset(self, item_id: str, item_type: str, asset_type: str) -> dict:
         """
         Activate an asset for download.
 
         Planet API requires assets to be "activated" before they can be downloaded.
-        This POSTs to the asset's activation endpoint.
+        This POSTs to the asset's activation endpoint. Assets the store knows
+        to be active are returned from it without any request.
 
         Args:
             item_id: Planet item ID
@@ -234,28 +322,17 @@ class PlanetScopeProvider(BaseSatelliteProvider):
         Raises:
             QuotaExceededError: If quota/rate limit exceeded
         """
-        import requests
-
-        # Get asset status
-        asset_url = f"{self._base_url}/item-types/{item_type}/items/{item_id}/assets"
-        response = requests.get(asset_url, headers=self._get_auth_headers(), timeout=30)
-
-        if response.status_code == 429:
-            raise QuotaExceededError("PlanetScope", "Rate limit exceeded")
-        response.raise_for_status()
+        store = get_planet_store()
+        if store is not None:
+            asset = store.get_location(item_id, asset_type)
+            if asset is not None:
+                logger.debug(f"Asset {asset_type} for {item_id} known active")
+                return asset
 
-        assets = response.json()
+        assets = self._get_assets(item_id, item_type)
         asset = assets.get(asset_type)
 
         if asset is None:
-            # Empty assets usually means no download permissions
-            if not assets:
-                raise QuotaExceededError(
-                    "PlanetScope",
-                    f"No download permissions for item {item_id}. "
-                    "Your Planet account may be search-only. "
-                    "Contact Planet to enable download access."
-                )
             raise ValueError(f"Asset type {asset_type} not available for item {item_id}")
 
         status = asset.get("status")
@@ -263,26 +340,13 @@ class PlanetScopeProvider(BaseSatelliteProvider):
         # If already active, return the asset info
         if status == "active":
             logger.debug(f"Asset {asset_type} for {item_id} already active")
+            if store is not None:
+                store.put_location(item_id, asset_type, asset)
             return asset
 
         # If inactive, activate it
         if status == "inactive":
-            activate_url = asset.get("_links", {}).get("activate")
-            if not activate_url:
-                raise ValueError(f"No activation link for asset {asset_type}")
-
-            logger.info(f"Activating asset {asset_type} for item {item_id}...")
-            activate_response = requests.get(
-                activate_url,
-                headers=self._get_auth_headers(),
-                timeout=30
-            )
-
-            if activate_response.status_code == 429:
-                raise QuotaExceededError("PlanetScope", "Rate limit exceeded during activation")
-            elif activate_response.status_code not in (202, 204):
-                activate_response.raise_for_status()
-
+            self._request_activation(item_id, asset_type, asset)
             return asset
 
         # If activating, return the asset info (caller will poll)
@@ -292,6 +356,65 @@ class PlanetScopeProvider(BaseSatelliteProvider):
 
         raise ValueError(f"Unexpected asset status: {status}")
 
+    def _get_assets(self, item_id: str, item_type: str) -> dict:
+        """
+        Fetch the status of every asset of an item in one request.
+
+        Args:
+            item_id: Planet item ID
+            item_type: Item type (e.g., "PSScene")
+
+        Returns:
+            Dictionary mapping asset type to asset metadata
+
+        Raises:
+            QuotaExceededError: If still rate limited after PL_RATE_LIMIT_MAX_WAIT,
+                or the account cannot download
+        """
+        asset_url = f"{self._base_url}/item-types/{item_type}/items/{item_id}/assets"
+        response = self._api_request("other", "GET", asset_url, timeout=30)
+
+        if response.status_code == 429:
+            raise QuotaExceededError("PlanetScope", "Rate limit exceeded")
+        response.raise_for_status()
+
+        assets = response.json()
+
+        # Empty assets usually means no download permissions
+        if not assets:
+            raise QuotaExceededError(
+                "PlanetScope",
+                f"No download permissions for item {item_id}. "
+                "Your Planet account may be search-only. "
+                "Contact Planet to enable download access."
+            )
+
+        return assets
+
+    def _request_activation(self, item_id: str, asset_type: str, asset: dict) -> None:
+        """
+        Ask Planet to activate an inactive asset.
+
+        Args:
+            item_id: Planet item ID
+            asset_type: Asset type (e.g., "ortho_analytic_4b")
+            asset: Asset metadata from _get_assets()
+
+        Raises:
+            QuotaExceededError: If rate limited
+        """
+        activate_url = asset.get("_links", {}).get("activate")
+        if not activate_url:
+            raise ValueError(f"No activation link for asset {asset_type}")
+
+        logger.info(f"Activating asset {asset_type} for item {item_id}...")
+        activate_response = self._api_request("activation", "GET", activate_url, timeout=30)
+
+        if activate_response.status_code == 429:
+            raise QuotaExceededError("PlanetScope", "Rate limit exceeded during activation")
+        elif activate_response.status_code not in (202, 204):
+            activate_response.raise_for_status()
+
     def _wait_for_activation(
         self,
         item_id: str,
@@ -319,13 +442,13 @@ class PlanetScopeProvider(BaseSatelliteProvider):
         Raises:
             ActivationTimeoutError: If activation doesn't complete in time
         """
-        import requests
-
         asset_url = f"{self._base_url}/item-types/{item_type}/items/{item_id}/assets"
         start_time = time.time()
 
         while (time.time() - start_time) < timeout:
-            response = requests.get(asset_url, headers=self._get_auth_headers(), timeout=30)
+            response = self._api_request("other", "GET", asset_url, timeout=30)
+            if response.status_code == 429:
+                raise QuotaExceededError("PlanetScope", "Rate limit exceeded")
             response.raise_for_status()
 
             assets = response.json()
@@ -338,6 +461,9 @@ class PlanetScopeProvider(BaseSatelliteProvider):
 
             if status == "active":
                 logger.info(f"Asset {asset_type} for {item_id} is now active")
+                store = get_planet_store()
+                if store is not None:
+                    store.put_location(item_id, asset_type, asset)
                 return asset
 
             if status == "failed":
@@ -349,44 +475,227 @@ class PlanetScopeProvider(BaseSatelliteProvider):
 
         raise ActivationTimeoutError(item_id, asset_type, timeout)
 
-    def _download_asset(self, download_url: str) -> str:
+    def _active_asset(self, item_id: str, item_type: str, asset_type: str, timeout: int) -> dict:
         """
-        Download an asset to a temporary file.
+        Activate an asset if needed and wait until it can be downloaded.
+
+        Args:
+            item_id: Planet item ID
+            item_type: Item type (e.g., "PSScene")
+            asset_type: Asset type (e.g., "ortho_analytic_4b")
+            timeout: Maximum time to wait for activation in seconds
+
+        Returns:
+            Asset metadata dict with download location
+
+        Raises:
+            ActivationTimeoutError: If activation doesn't complete in time
+            ValueError: If the asset is unavailable or has no download URL
+        """
+        asset = self._activate_asset(item_id, item_type, asset_type)
 
-        Uses streaming download to handle large files efficiently.
+        if asset.get("status") != "active":
+            asset = self._wait_for_activation(item_id, item_type, asset_type, timeout=timeout)
+
+        if not asset.get("location"):
+            raise ValueError("No download URL")
+        return asset
+
+    def _place_order(self, products: dict[str, list[str]], aoi: list[float]) -> dict:
+        """
+        Order the analytic and UDM2 assets of some items clipped to an AOI.
 
         Args:
-            download_url: Signed download URL from Planet API
+            products: Item IDs to order per item type (e.g., {"PSScene": [...]})
+            aoi: Clip bounds [west, south, east, north] in WGS84
 
         Returns:
-            Path to temporary file containing the downloaded data
+            Order metadata, including its ID and state
+
+        Raises:
+            QuotaExceededError: If rate limited or the account cannot order
         """
-        import requests
+        west, south, east, north = aoi
+        payload = {
+            "name": f"farm-clip-{next(iter(products.values()))[0]}",
+            "products": [
+                {
+                    "item_ids": item_ids,
+                    "item_type": item_type,
+                    "product_bundle": self.ORDER_BUNDLE,
+                }
+                for item_type, item_ids in products.items()
+            ],
+            "tools": [{
+                "clip": {
+                    "aoi": {
+                        "type": "Polygon",
+                        "coordinates": [[
+                            [west, south],
+                            [east, south],
+                            [east, north],
+                            [west, north],
+                            [west, south],
+                        ]]
+                    }
+                }
+            }],
+        }
 
-        logger.debug(f"Downloading asset from {download_url[:80]}...")
+        response = self._api_request("orders", "POST", self._orders_url, json=payload, timeout=60)
+
+        if response.status_code == 429:
+            raise QuotaExceededError("PlanetScope", "Rate limit exceeded while ordering")
+        elif response.status_code in (401, 403):
+            raise QuotaExceededError(
+                "PlanetScope",
+                "No order permissions. Your Planet account may not include the Orders API."
+            )
+        response.raise_for_status()
 
+        return response.json()
+
+    def _get_order(self, order_id: str) -> dict:
+        """
+        Fetch the state of an order, with its result links once delivered.
+
+        Args:
+            order_id: Order ID from _place_order()
+
+        Returns:
+            Order metadata
+
+        Raises:
+            QuotaExceededError: If rate limited
+        """
+        response = self._api_request("orders", "GET", f"{self._orders_url}/{order_id}", timeout=30)
+
+        if response.status_code == 429:
+            raise QuotaExceededError("PlanetScope", "Rate limit exceeded while polling order")
+        response.raise_for_status()
+
+        return response.json()
+
+    def _order_result_name(self, item_id: str, asset_type: str) -> str:
+        """File name an asset of an item is delivered under by a clip order."""
+        return f"{item_id}{self.ORDER_RESULT_SUFFIXES[asset_type]}"
+
+    def _download_asset(self, download_url: str, md5: Optional[str] = None) -> str:
+        """
+        Download an asset to a temporary file.
+
+        Args:
+            download_url: Signed download URL from Planet API
+            md5: MD5 digest Planet publishes for the asset, if any
+
+        Returns:
+            Path to temporary file containing the downloaded data
+        """
         # Create a temporary file that persists after function returns
         tmp_file = tempfile.NamedTemporaryFile(suffix=".tif", delete=False)
+        tmp_file.close()
 
         try:
-            with requests.get(download_url, stream=True, timeout=300) as response:
-                response.raise_for_status()
-
-                # Stream in chunks to handle large files
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        tmp_file.write(chunk)
-
-            tmp_file.close()
+            self._download_to(download_url, tmp_file.name, md5)
             logger.debug(f"Downloaded to {tmp_file.name}")
             return tmp_file.name
 
         except Exception:
-            tmp_file.close()
             import os
             os.unlink(tmp_file.name)
             raise
 
+    def _download_to(self, download_url: str, dest_path: str, md5: Optional[str] = None) -> None:
+        """
+        Download an asset to a file, resuming after dropped connections.
+
+        Args:
+            download_url: Signed download URL from Planet API
+            dest_path: File path to write to
+            md5: MD5 digest Planet publishes for the asset, if any
+        """
+        logger.debug(f"Downloading asset from {download_url[:80]}...")
+
+        # The signed location carries its own credentials
+        get_downloader().download(download_url, dest_path, md5=md5)
+
+    def _fetch_asset(
+        self,
+        download_url: str,
+        item_id: str,
+        asset_type: str,
+        md5: Optional[str] = None,
+    ) -> tuple[str, bool]:
+        """
+        Provide an activated asset as a path rasterio can open.
+
+        Uses the shared scene cache when enabled, so an asset pulled by an
+        earlier run or another farm is not downloaded again. In "remote"
+        delivery mode an asset that is not cached is not downloaded at all:
+        the signed URL is opened through GDAL's /vsicurl/ and only the byte
+        ranges of the tiles that are read get transferred. Otherwise the
+        asset goes to a temporary file the caller must remove.
+
+        Args:
+            download_url: Signed download URL from Planet API
+            item_id: Planet item ID (cache key)
+            asset_type: Asset type, e.g. "ortho_analytic_4b" (cache key)
+            md5: MD5 digest Planet publishes for the asset, checked after download
+
+        Returns:
+            Tuple of (path to the GeoTIFF, whether it is a temporary file)
+        """
+        cache = get_scene_cache()
+
+        if self.delivery == "remote":
+            cached = cache.get(item_id, asset_type, suffix=".tif") if cache is not None else None
+            if cached is not None:
+                return cached, False
+            return f"/vsicurl/{download_url}", False
+
+        if cache is not None:
+            path = cache.fetch(
+                item_id,
+                asset_type,
+                lambda dest: self._download_to(download_url, dest, md5),
+                suffix=".tif",
+            )
+            return path, False
+
+        return self._download_asset(download_url, md5), True
+
+    @contextmanager
+    def _asset_file(
+        self,
+        download_url: str,
+        item_id: str,
+        asset_type: str,
+        md5: Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        Provide a local file for an activated asset.
+
+        See _fetch_asset(); a temporary file is removed on exit.
+
+        Args:
+            download_url: Signed download URL from Planet API
+            item_id: Planet item ID (cache key)
+            asset_type: Asset type, e.g. "ortho_analytic_4b" (cache key)
+            md5: MD5 digest Planet publishes for the asset, checked after download
+
+        Yields:
+            Path to the local GeoTIFF
+        """
+        import os
+
+        path, temporary = self._fetch_asset(download_url, item_id, asset_type, md5)
+        try:
+            yield path
+        finally:
+            # Clean up temporary file
+            if temporary and os.path.exists(path):
+                os.unlink(path)
+
     def query(
         self,
         bbox: list[float],
@@ -405,9 +714,10 @@ class PlanetScopeProvider(BaseSatelliteProvider):
 
         Returns:
             List of item metadata dictionaries
-        """
-        import requests
 
+        Raises:
+            QuotaExceededError: If still rate limited after PL_RATE_LIMIT_MAX_WAIT
+        """
         # Planet API request for PlanetScope items
         # Build filter for geometry, date range, and cloud cover
         filter_config = {
@@ -453,12 +763,7 @@ class PlanetScopeProvider(BaseSatelliteProvider):
             "item_types": ["PSScene"]
         }
 
-        response = requests.post(
-            url,
-            headers=self._get_auth_headers(),
-            json=payload,
-            timeout=60
-        )
+        response = self._api_request("search", "POST", url, json=payload, timeout=60)
 
         if response.status_code == 429:
             raise QuotaExceededError("PlanetScope", "Rate limit exceeded during search")
@@ -490,11 +795,25 @@ class PlanetScopeProvider(BaseSatelliteProvider):
         """
         Load PlanetScope bands and clip to bounding box.
 
-        Implements the Planet asset activation workflow:
-        1. Activate the asset if not already active
-        2. Wait for activation to complete
-        3. Download the asset
-        4. Reproject and clip to bbox
+        Implements the Planet asset activation workflow concurrently for all
+        items: activation of the analytic and UDM2 assets of every item is
+        requested up front, pending assets are polled together, and each
+        asset is downloaded as soon as it is active (see
+        ActivationOrchestrator). Items are then reprojected onto the bbox
+        grid in order, each as soon as its analytic asset is on disk.
+
+        The UDM2 asset of each loaded item is warped onto the same grid right
+        after it, and the resulting clear mask is kept for cloud_mask(), so
+        the run fetches every asset once and masking needs no further
+        requests or reads.
+
+        In "clip" delivery mode both assets of every item are instead ordered
+        clipped to the farm grid in a single order (see ClipOrder), so only
+        farm-sized rasters are downloaded and warped.
+
+        With the store enabled (PL_STORE_DIR), items whose bands and clear
+        mask an earlier run already warped onto this grid are read back from
+        it and not acquired at all.
 
         Args:
             items: Item metadata from query()
@@ -502,91 +821,79 @@ class PlanetScopeProvider(BaseSatelliteProvider):
             bbox: Bounding box [west, south, east, north]
 
         Returns:
-            xarray DataArray with loaded band data
+            xarray DataArray with loaded band data: float32 reflectance, or
+            uint16 DN (nodata 0) in compact mode
         """
         import numpy as np
         import rasterio
-        from rasterio.warp import calculate_default_transform, reproject, Resampling
-        from rasterio.windows import from_bounds
-        import xarray as xr
-        import os
+
+        # Native 3m grid in the farm's UTM zone
+        grid = GeoBox.from_bbox(bbox, self.resolution_meters)
 
         all_band_arrays = []
+        times = []
+
+        # Items an earlier run already warped onto this grid
+        store = get_planet_store()
+        band_key = f"{self.ANALYTIC_ASSET}.{'dn' if self.compact else 'refl'}"
+        stored: dict[str, tuple['np.ndarray', 'np.ndarray']] = {}
+        if store is not None:
+            for item in items:
+                item_id = item.get("id")
+                bands_data = store.get_raster(item_id, band_key, grid)
+                clear = store.get_raster(item_id, self.CLEAR_MASK, grid) if bands_data is not None else None
+                if clear is not None:
+                    stored[item_id] = (bands_data, clear)
+
+        # Drop downloads left over from a previous load() that were never masked
+        self._close_session()
+        to_acquire = [item for item in items if item.get("id") not in stored]
+        activation = None
+        if to_acquire:
+            if self.delivery == "clip":
+                activation = ClipOrder(self, grid.wgs84_bounds(), self.ORDER_TIMEOUT)
+            else:
+                activation = ActivationOrchestrator(self, self.ACTIVATION_TIMEOUTS)
+            activation.start(to_acquire, [self.ANALYTIC_ASSET, self.UDM2_ASSET])
+        session = self._session = _AssetSession(activation, grid)
 
         for item in items:
             item_id = item.get("id")
-            item_type = item.get("item_type", "PSScene")
+
+            if item_id in stored:
+                dst_data, session.clear_masks[item_id] = stored[item_id]
+                all_band_arrays.append(dst_data)
+                times.append(acquisition_time(item.get("properties", {}).get("acquired")))
+                logger.info(f"Loaded {item_id} from store")
+                continue
 
             logger.info(f"Processing item {item_id}...")
 
             try:
-                # Step 1: Activate the analytic asset
-                asset = self._activate_asset(item_id, item_type, "ortho_analytic_4b")
-
-                # Step 2: Wait for activation if needed
-                if asset.get("status") != "active":
-                    asset = self._wait_for_activation(
-                        item_id, item_type, "ortho_analytic_4b",
-                        timeout=300  # 5 minute timeout
-                    )
-
-                # Step 3: Get download URL and download
-                download_url = asset.get("location")
-                if not download_url:
-                    logger.warning(f"No download URL for item {item_id}, skipping")
-                    continue
-
-                tmp_file = self._download_asset(download_url)
+                # Wait for this item's analytic asset to be delivered and downloaded
+                asset_path = activation.result(item_id, self.ANALYTIC_ASSET)
 
                 try:
-                    # Step 4: Process the downloaded file
-                    with rasterio.open(tmp_file) as src:
-                        src_crs = src.crs
-                        dst_crs = "EPSG:4326"  # WGS84
-
-                        # Calculate output dimensions at 3m resolution over the bbox
-                        # ~111km per degree at equator
-                        width = int((bbox[2] - bbox[0]) * 111000 / 3)
-                        height = int((bbox[3] - bbox[1]) * 111000 / 3)
-
-                        # Ensure reasonable bounds
-                        width = max(min(width, 2000), 100)
-                        height = max(min(height, 2000), 100)
-
-                        # Calculate the transform ONCE for all bands
-                        dst_transform, dst_width, dst_height = calculate_default_transform(
-                            src_crs, dst_crs, src.width, src.height,
-                            *src.bounds,
-                            dst_width=width, dst_height=height
-                        )
-
-                        # Override to use exact bbox
-                        from rasterio.transform import from_bounds as transform_from_bounds
-                        dst_transform = transform_from_bounds(
-                            bbox[0], bbox[1], bbox[2], bbox[3],
-                            width, height
-                        )
-
-                        # Read and reproject all 4 bands at once
+                    with self._gdal_env(), rasterio.open(asset_path) as src:
+                        # Read the farm window of all 4 bands and reproject it onto the grid
                         # PlanetScope 4-band order: Blue (1), Green (2), Red (3), NIR (4)
-                        dst_data = np.zeros((4, height, width), dtype=np.float32)
-
-                        for band_idx in range(4):
-                            src_band = src.read(band_idx + 1)
-
-                            reproject(
-                                source=src_band,
-                                destination=dst_data[band_idx],
-                                src_transform=src.transform,
-                                src_crs=src_crs,
-                                dst_transform=dst_transform,
-                                dst_crs=dst_crs,
-                                resampling=Resampling.bilinear
-                            )
+                        window = read_window(src, grid, resampling="bilinear")
+
+                        if self.compact:
+                            # Keep the 0-10000 DN, 0 marks pixels outside the scene
+                            dst_data = np.full((4,) + grid.shape, DN_NODATA, dtype=np.uint16)
+                            nodata = {"src_nodata": DN_NODATA, "dst_nodata": DN_NODATA}
+                        else:
+                            dst_data = np.zeros((4,) + grid.shape, dtype=np.float32)
+                            nodata = {}
+
+                        get_warp_engine().reproject(
+                            window.data, window.geobox, grid, "bilinear", out=dst_data, **nodata
+                        )
 
                         # Normalize to 0-1 reflectance
                         # PlanetScope typically uses 0-10000 scale
-                        max_val = np.nanmax(dst_data)
+                        max_val = np.nanmax(dst_data) if not self.compact else 0
                         if max_val > 1:
                             # Assume 0-10000 or similar scale
                             if max_val > 100:
@@ -594,53 +901,50 @@ class PlanetScopeProvider(BaseSatelliteProvider):
                             else:
                                 dst_data = dst_data / max_val
 
-                        # Create xarray DataArray
-                        # Map bands: 0=Blue, 1=Green, 2=Red, 3=NIR
-                        da = xr.DataArray(
-                            dst_data,
-                            dims=["band", "y", "x"],
-                            coords={
-                                "band": ["blue", "green", "red", "nir"],
-                                "y": np.linspace(bbox[3], bbox[1], height),
-                                "x": np.linspace(bbox[0], bbox[2], width),
-                            }
-                        )
+                        all_band_arrays.append(dst_data)
+                        times.append(acquisition_time(item.get("properties", {}).get("acquired")))
+                        logger.info(f"  Loaded {item_id}: {grid.width}x{grid.height} pixels")
+                finally:
+                    activation.release(asset_path)
 
-                        all_band_arrays.append(da)
-                        logger.info(f"  Loaded {item_id}: {width}x{height} pixels")
+                if store is not None:
+                    store.put_raster(item_id, band_key, grid, dst_data)
 
-                finally:
-                    # Clean up temporary file
-                    if os.path.exists(tmp_file):
-                        os.unlink(tmp_file)
+                # Warp the UDM2 of the item now, while its download is fresh
+                session.clear_masks[item_id] = self._item_clear_mask(item, grid)
 
             except ActivationTimeoutError:
                 logger.warning(f"Activation timeout for item {item_id}, skipping")
                 continue
             except QuotaExceededError as e:
                 logger.error(f"Quota exceeded: {e}")
+                self._close_session()
                 raise
             except Exception as e:
                 logger.error(f"Error processing item {item_id}: {e}")
                 continue
 
         if not all_band_arrays:
+            self._close_session()
             raise ValueError("No valid PlanetScope items could be loaded")
 
         # Stack all items along a new time dimension
-        stacked = xr.concat(all_band_arrays, dim="time")
-
-        # Add time coordinates
-        result = stacked.assign_coords(time=range(len(all_band_arrays)))
+        # Map bands: 0=Blue, 1=Green, 2=Red, 3=NIR
+        raster = Raster(
+            np.stack(all_band_arrays),
+            grid,
+            bands=["blue", "green", "red", "nir"],
+            times=times,
+        )
 
-        return result
+        return raster.to_xarray(attrs=compact_attrs() if self.compact else None)
 
     def cloud_mask(
         self,
         data: 'xr.DataArray',
         items: list,
         bbox: list[float] | None = None
-    ) -> tuple['xr.DataArray', float]:
+    ) -> tuple['xr.DataArray', float, 'xr.DataArray']:
         """
         Apply cloud mask using PlanetScope UDM2 (Usable Data Mask).
 
@@ -656,116 +960,38 @@ class PlanetScopeProvider(BaseSatelliteProvider):
 
         We use Band 1 (clear) OR combine Band 1 AND NOT Band 6 (cloud).
 
+        Clear masks load() already warped onto the data grid are reused as
+        they are. For other items the UDM2 asset is acquired (one item at a
+        time when load() did not request it) and the window covering the
+        data grid is reprojected onto it.
+
         Args:
             data: xarray DataArray with band data
             items: Item metadata from query()
             bbox: Optional bounding box (not used but kept for interface compatibility)
 
         Returns:
-            Tuple of (masked_data, cloud_free_percentage)
+            Tuple of (masked_data, cloud_free_percentage, cloud_mask)
+            - masked_data: DataArray with cloudy pixels set to NaN (nodata
+              when compact)
+            - cloud_free_percentage: Fraction of clear pixels (0.0-1.0)
+            - cloud_mask: Boolean DataArray where True = cloudy/invalid pixel
         """
         import numpy as np
-        import rasterio
-        from rasterio.warp import reproject, Resampling
-        from rasterio.transform import from_bounds as transform_from_bounds
-        import os
 
-        # Target dimensions from data
-        height = data.sizes.get("y", 100)
-        width = data.sizes.get("x", 100)
-
-        # Get bbox from data coordinates if not provided
-        if bbox is None:
-            x_coords = data.coords.get('x')
-            y_coords = data.coords.get('y')
-            if x_coords is not None and y_coords is not None:
-                bbox = [
-                    float(x_coords.min()),
-                    float(y_coords.min()),
-                    float(x_coords.max()),
-                    float(y_coords.max()),
-                ]
+        grid = GeoBox.from_xarray(data)
+        height, width = grid.shape
 
         # Build a clear mask from all items
         combined_clear_mask = None
 
-        for item in items:
-            item_id = item.get("id")
-            item_type = item.get("item_type", "PSScene")
-
-            try:
-                # Try to activate and get UDM2 asset
-                try:
-                    asset = self._activate_asset(item_id, item_type, "ortho_udm2")
-
-                    if asset.get("status") != "active":
-                        asset = self._wait_for_activation(
-                            item_id, item_type, "ortho_udm2",
-                            timeout=120  # Shorter timeout for UDM2
-                        )
+        session = self._session
+        clear_masks = session.clear_masks if session is not None and session.grid == grid else {}
 
-                    download_url = asset.get("location")
-                    if not download_url:
-                        raise ValueError("No download URL")
-
-                    tmp_file = self._download_asset(download_url)
-
-                    try:
-                        with rasterio.open(tmp_file) as src:
-                            # Read Band 1 (clear mask) and Band 6 (cloud mask)
-                            clear_band = src.read(1)
-                            cloud_band = src.read(6)
-
-                            # Create destination array at target resolution
-                            dst_clear = np.zeros((height, width), dtype=np.uint8)
-                            dst_cloud = np.zeros((height, width), dtype=np.uint8)
-
-                            # Calculate transform for reprojection
-                            if bbox:
-                                dst_transform = transform_from_bounds(
-                                    bbox[0], bbox[1], bbox[2], bbox[3],
-                                    width, height
-                                )
-
-                                # Reproject clear band
-                                reproject(
-                                    source=clear_band,
-                                    destination=dst_clear,
-                                    src_transform=src.transform,
-                                    src_crs=src.crs,
-                                    dst_transform=dst_transform,
-                                    dst_crs="EPSG:4326",
-                                    resampling=Resampling.nearest
-                                )
-
-                                # Reproject cloud band
-                                reproject(
-                                    source=cloud_band,
-                                    destination=dst_cloud,
-                                    src_transform=src.transform,
-                                    src_crs=src.crs,
-                                    dst_transform=dst_transform,
-                                    dst_crs="EPSG:4326",
-                                    resampling=Resampling.nearest
-                                )
-
-                            # Clear where: clear_band == 1 AND cloud_band == 0
-                            # In UDM2: 1 = condition true, 0 = condition false
-                            item_mask = (dst_clear == 1) & (dst_cloud == 0)
-
-                    finally:
-                        if os.path.exists(tmp_file):
-                            os.unlink(tmp_file)
-
-                except (ActivationTimeoutError, ValueError) as e:
-                    logger.debug(f"UDM2 not available for {item_id}: {e}, assuming all clear")
-                    # No UDM2 available - assume all pixels are clear
-                    item_mask = np.ones((height, width), dtype=bool)
-
-            except Exception as e:
-                logger.warning(f"Error getting cloud mask for {item_id}: {e}")
-                # On error, assume all clear
-                item_mask = np.ones((height, width), dtype=bool)
+        for item in items:
+            item_mask = clear_masks.get(item.get("id"))
+            if item_mask is None:
+                item_mask = self._item_clear_mask(item, grid)
 
             # Combine masks (union of clear pixels across all items)
             if combined_clear_mask is None:
@@ -773,6 +999,9 @@ class PlanetScopeProvider(BaseSatelliteProvider):
             else:
                 combined_clear_mask = combined_clear_mask | item_mask
 
+        # Assets of this run are no longer needed
+        self._close_session()
+
         if combined_clear_mask is None:
             combined_clear_mask = np.ones((height, width), dtype=bool)
 
@@ -782,9 +1011,121 @@ class PlanetScopeProvider(BaseSatelliteProvider):
         cloud_free_pct = float(valid_pixels) / float(total_pixels) if total_pixels > 0 else 0.0
 
         # Apply mask to all bands and time steps
-        masked = data.where(combined_clear_mask)
+        masked = mask_pixels(data, ~combined_clear_mask)
+
+        cloud_mask = Raster(~combined_clear_mask, grid).to_xarray()
+
+        return masked, cloud_free_pct, cloud_mask
+
+    def _item_clear_mask(self, item: dict, grid: GeoBox) -> 'np.ndarray':
+        """
+        Clear mask of one item from its UDM2 asset, on a grid.
+
+        Clear where Band 1 (clear) is 1 and Band 6 (cloud) is 0. Items
+        without a usable UDM2 are treated as all clear. Masks warped from a
+        UDM2 are kept in the store, when enabled, for later runs on the grid.
+
+        Args:
+            item: Item metadata from query()
+            grid: Grid to warp the mask onto
+
+        Returns:
+            Boolean array of grid.shape, True = clear
+        """
+        import numpy as np
+        import rasterio
+
+        item_id = item.get("id")
+
+        try:
+            # Get the UDM2 asset, usually already downloaded during load()
+            try:
+                with self._udm2_file(item) as asset_path:
+                    with self._gdal_env(), rasterio.open(asset_path) as src:
+                        # Read the farm window of Band 1 (clear mask) and Band 6 (cloud mask)
+                        window = read_window(src, grid, indexes=[1, 6])
+
+                        # Reproject both onto the grid in one call
+                        dst_udm = np.zeros((2,) + grid.shape, dtype=np.uint8)
+                        get_warp_engine().reproject(
+                            window.data, window.geobox, grid, "nearest", out=dst_udm
+                        )
+
+                        # Clear where: clear_band == 1 AND cloud_band == 0
+                        # In UDM2: 1 = condition true, 0 = condition false
+                        clear = (dst_udm[0] == 1) & (dst_udm[1] == 0)
+
+                store = get_planet_store()
+                if store is not None:
+                    store.put_raster(item_id, self.CLEAR_MASK, grid, clear)
+                return clear
+
+            except (ActivationTimeoutError, ValueError) as e:
+                logger.debug(f"UDM2 not available for {item_id}: {e}, assuming all clear")
+                # No UDM2 available - assume all pixels are clear
+                return np.ones(grid.shape, dtype=bool)
+
+        except Exception as e:
+            logger.warning(f"Error getting cloud mask for {item_id}: {e}")
+            # On error, assume all clear
+            return np.ones(grid.shape, dtype=bool)
+
+    @contextmanager
+    def _udm2_file(self, item: dict) -> Iterator[str]:
+        """
+        Provide the local UDM2 file of an item.
+
+        Args:
+            item: Item metadata from query()
+
+        Yields:
+            Path to the local UDM2 GeoTIFF
+        """
+        item_id = item.get("id")
+        activation = self._session.activation if self._session is not None else None
+
+        if activation is not None and (item_id, self.UDM2_ASSET) in activation:
+            asset_path = activation.result(item_id, self.UDM2_ASSET)
+            try:
+                yield asset_path
+            finally:
+                activation.release(asset_path)
+            return
+
+        asset = self._active_asset(
+            item_id, item.get("item_type", "PSScene"), self.UDM2_ASSET,
+            self.ACTIVATION_TIMEOUTS[self.UDM2_ASSET],
+        )
+
+        with self._asset_file(
+            asset["location"], item_id, self.UDM2_ASSET, md5=asset.get("md5_digest")
+        ) as asset_path:
+            yield asset_path
+
+    @staticmethod
+    def _gdal_env():
+        """
+        GDAL environment for reading assets, local or over HTTP range requests.
+
+        Returns:
+            rasterio.Env tuned for remote COG reads
+        """
+        import rasterio
+
+        return rasterio.Env(
+            # Signed asset URLs have no directory to list
+            GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR",
+            # Fetch adjacent tiles of the window in one request
+            GDAL_HTTP_MERGE_CONSECUTIVE_RANGES="YES",
+            GDAL_HTTP_MAX_RETRY="3",
+            GDAL_HTTP_RETRY_DELAY="1",
+        )
 
-        return masked, cloud_free_pct
+    def _close_session(self) -> None:
+        """Stop acquiring assets of the last load() and remove its leftover downloads."""
+        session, self._session = self._session, None
+        if session is not None and session.activation is not None:
+            session.activation.close()
 
     def get_metadata(self, item: dict) -> dict:
         """
@@ -0,0 +1,222 @@
+"""
+Persistent store of PlanetScope activation state and warped farm rasters.
+
+Every PlanetScope run used to start cold: a status request per item and
+asset, a fresh activation, and a download of scenes an earlier run or
+another farm had already paid for.
+
+The store keeps two things on local disk, shared by every process using
+the same directory:
+
+- Activation state: the signed download location of each active asset and
+  when it expires. Until then the asset is known to be active, so no status
+  request or activation is needed before downloading it again.
+- Warped farm rasters: the analytic bands and UDM2 clear mask of an item as
+  load() produced them for a farm grid. A later run for the same farm and
+  item reads them back without any Planet request or transfer.
+
+Rasters live in a SceneCache of their own (byte budget, LRU eviction), so a
+paid scene is not transferred again for as long as it is retained there.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import timezone
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from raster import GeoBox
+
+from .scene_cache import SceneCache
+
+logger = logging.getLogger(__name__)
+
+# Default byte budget for warped rasters when PL_STORE_MAX_MB is not set (2 GB)
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+
+class PlanetStore:
+    """
+    On-disk activation state and warped raster cache for PlanetScope items.
+
+    Activation records are small JSON files written atomically; rasters are
+    .npy files in a SceneCache under the same directory.
+    """
+
+    # Assumed validity of a download location without an expiry (seconds)
+    DEFAULT_LOCATION_TTL = 3600
+
+    # Locations closer than this to expiry are treated as expired (seconds)
+    MIN_VALIDITY = 120
+
+    def __init__(self, store_dir: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Initialize the store.
+
+        Args:
+            store_dir: Directory holding the store (created if missing)
+            max_bytes: Byte budget for warped rasters; least recently used
+                ones are evicted beyond it
+        """
+        self.store_dir = Path(store_dir)
+        self.activation_dir = self.store_dir / "activations"
+        self.activation_dir.mkdir(parents=True, exist_ok=True)
+        self.rasters = SceneCache(str(self.store_dir / "rasters"), max_bytes=max_bytes)
+
+    def get_location(self, item_id: str, asset_type: str) -> Optional[dict]:
+        """
+        Look up the download location of an asset known to be active.
+
+        Args:
+            item_id: Planet item ID
+            asset_type: Asset type (e.g., "ortho_analytic_4b")
+
+        Returns:
+            Asset metadata with "status", "location" and "md5_digest", or
+            None if the asset is unknown or its location has expired
+        """
+        path = self._activation_path(item_id, asset_type)
+        try:
+            record = json.loads(path.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if time.time() >= record.get("expires_at", 0) - self.MIN_VALIDITY:
+            return None
+
+        return {
+            "status": "active",
+            "location": record["location"],
+            "md5_digest": record.get("md5_digest"),
+        }
+
+    def put_location(self, item_id: str, asset_type: str, asset: dict) -> None:
+        """
+        Remember the download location of an active asset.
+
+        Args:
+            item_id: Planet item ID
+            asset_type: Asset type
+            asset: Asset metadata from the Data API with status "active"
+        """
+        location = asset.get("location")
+        if asset.get("status") != "active" or not location:
+            return
+
+        record = {
+            "location": location,
+            "md5_digest": asset.get("md5_digest"),
+            "expires_at": self._expiry(asset),
+        }
+
+        path = self._activation_path(item_id, asset_type)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps(record))
+        os.replace(tmp_path, path)
+
+    def forget_location(self, item_id: str, asset_type: str) -> None:
+        """Drop the activation record of an asset (e.g. after its location was rejected)."""
+        try:
+            self._activation_path(item_id, asset_type).unlink()
+        except FileNotFoundError:
+            pass
+
+    def get_raster(self, item_id: str, name: str, grid: GeoBox) -> Optional[np.ndarray]:
+        """
+        Read back an array stored for an item on a grid.
+
+        Args:
+            item_id: Planet item ID
+            name: What the array holds (e.g. "ortho_analytic_4b.dn", "clear_mask")
+            grid: Grid the array was warped onto
+
+        Returns:
+            The stored array, or None on a miss
+        """
+        path = self.rasters.get(item_id, self._raster_key(name, grid), suffix=".npy")
+        if path is None:
+            return None
+        try:
+            return np.load(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unreadable stored raster for {item_id}/{name}: {e}")
+            return None
+
+    def put_raster(self, item_id: str, name: str, grid: GeoBox, data: np.ndarray) -> None:
+        """
+        Store an array produced for an item on a grid.
+
+        Args:
+            item_id: Planet item ID
+            name: What the array holds
+            grid: Grid the array was warped onto
+            data: Array to store
+        """
+        def write(dest: str) -> None:
+            with open(dest, "wb") as f:
+                np.save(f, data)
+
+        self.rasters.fetch(item_id, self._raster_key(name, grid), write, suffix=".npy")
+
+    def _activation_path(self, item_id: str, asset_type: str) -> Path:
+        digest = hashlib.sha256(f"{item_id}/{asset_type}".encode()).hexdigest()
+        return self.activation_dir / f"{digest}.json"
+
+    @staticmethod
+    def _raster_key(name: str, grid: GeoBox) -> str:
+        """Cache key of an array on a grid; any change of CRS, origin, resolution or shape is a new key."""
+        t = grid.transform
+        spec = f"{grid.crs}|{grid.shape}|" + ",".join(f"{v:.6f}" for v in (t.a, t.b, t.c, t.d, t.e, t.f))
+        return f"{name}@{hashlib.sha256(spec.encode()).hexdigest()[:16]}"
+
+    def _expiry(self, asset: dict) -> float:
+        """Unix time the download location of an asset expires."""
+        expires_at = asset.get("expires_at")
+        if expires_at:
+            from dateutil import parser as dateparser
+
+            try:
+                expiry = dateparser.parse(expires_at)
+                if expiry.tzinfo is None:
+                    expiry = expiry.replace(tzinfo=timezone.utc)
+                return expiry.timestamp()
+            except (ValueError, OverflowError):
+                pass
+        return time.time() + self.DEFAULT_LOCATION_TTL
+
+
+_planet_store: Optional[PlanetStore] = None
+_planet_store_lock = threading.Lock()
+
+
+def get_planet_store() -> Optional[PlanetStore]:
+    """
+    Get the process-wide PlanetScope store.
+
+    The store is enabled by setting PL_STORE_DIR. PL_STORE_MAX_MB sets the
+    byte budget for warped rasters (default 2 GB).
+
+    Returns:
+        PlanetStore instance, or None if the store is disabled
+    """
+    global _planet_store
+
+    store_dir = os.getenv("PL_STORE_DIR")
+    if not store_dir:
+        return None
+
+    with _planet_store_lock:
+        if _planet_store is None:
+            max_mb = os.getenv("PL_STORE_MAX_MB")
+            try:
+                max_bytes = int(max_mb) * 1024 * 1024 if max_mb else DEFAULT_MAX_BYTES
+            except ValueError:
+                max_bytes = DEFAULT_MAX_BYTES
+            _planet_store = PlanetStore(store_dir, max_bytes=max_bytes)
+            logger.info(f"PlanetScope store enabled at {store_dir} ({max_bytes / 1e9:.1f} GB for rasters)")
+        return _planet_store
@@ -0,0 +1,258 @@
+"""
+Client-side rate limiting for the Planet APIs.
+
+Planet limits request rates per API key and endpoint class, and answers
+anything over the limit with 429. Every farm, item and asset poll used to
+send its requests as fast as it could, so a busy run tripped the limit and
+the first 429 failed the call with QuotaExceededError, dropping PlanetScope
+for the farm.
+
+The RateLimiter keeps one token bucket per endpoint class for the whole
+process, so requests from every item, orchestrator thread and farm queue
+for the same budget and are spread out to stay under it. When Planet
+still answers 429, the bucket of that class is paused for the Retry-After
+period (or an exponential backoff without one) and the request is sent
+again. A request only fails once it has been refused for longer than
+PL_RATE_LIMIT_MAX_WAIT in total.
+"""
+import logging
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional, TypedDict, Union
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitStats(TypedDict):
+    """Counters for the rate limiter."""
+    requests: int
+    throttled: int
+    throttled_seconds: float
+    rate_limited: int
+
+
+class TokenBucket:
+    """
+    Token bucket handing out at most `rate` requests per second.
+
+    Up to one second worth of tokens accumulates while idle, so short
+    bursts go out at once. Waiters take tokens one at a time, roughly in
+    arrival order.
+    """
+
+    def __init__(self, rate: float):
+        """
+        Initialize the bucket, full.
+
+        Args:
+            rate: Requests per second
+        """
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._queue = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Take a token, waiting for one if the bucket is empty or paused.
+
+        Returns:
+            Seconds spent waiting
+        """
+        started = time.monotonic()
+        with self._queue:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return now - started
+                    wait = max(self._updated - now, 0.0) + (1 - self._tokens) / self.rate
+                time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for the next `seconds`, then start again from empty."""
+        with self._lock:
+            resume = time.monotonic() + seconds
+            if resume > self._updated:
+                self._tokens = 0.0
+                self._updated = resume
+
+    def _refill(self, now: float) -> None:
+        # _updated lies in the future while paused
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+
+class RateLimiter:
+    """
+    Process-wide request scheduler for the Planet APIs.
+
+    Thread-safe; one instance is shared by every PlanetScopeProvider.
+    """
+
+    # Requests per second per endpoint class. Planet's published per-key
+    # limits; lower them with PL_RATE_LIMITS for plans with tighter ones.
+    DEFAULT_RATES = {
+        "search": 5.0,
+        "activation": 5.0,
+        "orders": 5.0,
+        "other": 10.0,
+    }
+
+    # Total time a request may spend refused with 429 before it fails (seconds)
+    DEFAULT_MAX_WAIT = 300.0
+
+    # Backoff after a 429 without Retry-After: first delay, and upper bound (seconds)
+    BACKOFF_INITIAL = 1.0
+    BACKOFF_MAX = 30.0
+
+    def __init__(self, rates: Optional[dict[str, float]] = None, max_wait: Optional[float] = None):
+        """
+        Initialize the limiter.
+
+        Args:
+            rates: Requests per second by endpoint class, over the defaults
+                (defaults to PL_RATE_LIMITS env var, e.g.
+                "search=2,activation=5", then DEFAULT_RATES)
+            max_wait: Seconds a request may spend refused with 429 before
+                the 429 is returned (defaults to PL_RATE_LIMIT_MAX_WAIT env
+                var, then 300)
+        """
+        configured = dict(self.DEFAULT_RATES)
+        configured.update(rates or self._parse_rates(os.getenv("PL_RATE_LIMITS", "")))
+        self.rates = configured
+        self.max_wait = max_wait or float(os.getenv("PL_RATE_LIMIT_MAX_WAIT") or self.DEFAULT_MAX_WAIT)
+
+        self._buckets = {kind: TokenBucket(rate) for kind, rate in configured.items()}
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "throttled": 0, "throttled_seconds": 0.0, "rate_limited": 0}
+
+    def request(
+        self,
+        kind: str,
+        method: str,
+        url: str,
+        headers: Union[dict, Callable[[], dict], None] = None,
+        **kwargs,
+    ):
+        """
+        Send a request within the budget of its endpoint class.
+
+        Blocks until the class has budget left. A 429 pauses the whole class
+        for the Retry-After period and the request is sent again; it is
+        returned as is only once max_wait has been spent on 429s.
+
+        Args:
+            kind: Endpoint class, a key of rates ("search", "activation",
+                "orders" or "other"); unknown classes share "other"
+            method: HTTP method
+            url: Request URL
+            headers: Request headers, or a callable producing them for each
+                attempt (so credentials stay fresh across long waits)
+            **kwargs: Passed on to requests.request()
+
+        Returns:
+            requests.Response; status 429 only when max_wait was exceeded
+        """
+        import requests
+
+        bucket = self._buckets.get(kind) or self._buckets["other"]
+        refused = 0.0
+        backoff = self.BACKOFF_INITIAL
+
+        while True:
+            waited = bucket.acquire()
+            self._record(waited)
+
+            response = requests.request(
+                method, url, headers=headers() if callable(headers) else headers, **kwargs
+            )
+            if response.status_code != 429:
+                return response
+
+            delay = self._retry_after(response.headers.get("Retry-After"))
+            if delay is None:
+                delay, backoff = backoff, min(backoff * 2, self.BACKOFF_MAX)
+
+            with self._lock:
+                self._stats["rate_limited"] += 1
+
+            if refused + delay > self.max_wait:
+                logger.warning(f"Planet {kind} requests still rate limited after {refused:.0f}s, giving up")
+                return response
+
+            logger.info(f"Planet {kind} requests rate limited, pausing {delay:.1f}s")
+            refused += delay
+            bucket.pause(delay)
+
+    def stats(self) -> RateLimitStats:
+        """Counters since the limiter was created."""
+        with self._lock:
+            return RateLimitStats(
+                requests=self._stats["requests"],
+                throttled=self._stats["throttled"],
+                throttled_seconds=self._stats["throttled_seconds"],
+                rate_limited=self._stats["rate_limited"],
+            )
+
+    def _record(self, waited: float) -> None:
+        with self._lock:
+            self._stats["requests"] += 1
+            if waited > 0.001:
+                self._stats["throttled"] += 1
+                self._stats["throttled_seconds"] += waited
+
+    @staticmethod
+    def _retry_after(value: Optional[str]) -> Optional[float]:
+        """Seconds to wait from a Retry-After header (delay in seconds or an HTTP date)."""
+        if not value:
+            return None
+        value = value.strip()
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _parse_rates(spec: str) -> dict[str, float]:
+        """Parse "kind=rate,kind=rate", ignoring malformed entries."""
+        rates = {}
+        for entry in spec.split(","):
+            kind, _, rate = entry.partition("=")
+            try:
+                if float(rate) > 0:
+                    rates[kind.strip()] = float(rate)
+            except ValueError:
+                if entry.strip():
+                    logger.warning(f"Ignoring malformed PL_RATE_LIMITS entry: {entry!r}")
+        return rates
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    Get the process-wide Planet rate limiter.
+
+    Returns:
+        RateLimiter instance
+    """
+    global _rate_limiter
+
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter()
+        return _rate_limiter
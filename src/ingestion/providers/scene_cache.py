@@ -0,0 +1,342 @@
+"""
+Persistent on-disk cache for downloaded scene assets.
+
+Providers download whole products/assets (Copernicus SAFE zips, PlanetScope
+GeoTIFFs) that are reused across farms, overlapping backfill windows and
+retries. The cache keeps those files on local disk, keyed by product/item ID
+and asset name, and evicts the least recently used entries once a byte budget
+is exceeded.
+
+Writes are atomic (download to a temp file, then rename into place) and a
+per-entry lock serializes concurrent fetches of the same asset, both across
+threads and across processes sharing the cache directory.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional, TypedDict
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Default byte budget when SCENE_CACHE_MAX_MB is not set (10 GB)
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024 * 1024
+
+
+class SceneCacheStats(TypedDict):
+    """Counters for sizing the cache."""
+    hits: int
+    misses: int
+    evictions: int
+    evicted_bytes: int
+    entries: int
+    size_bytes: int
+    max_bytes: int
+
+
+class SceneCache:
+    """
+    Content-keyed scene cache with a byte budget and LRU eviction.
+
+    Entries are plain files under cache_dir. Recency is tracked through the
+    file modification time, which is bumped on every hit, so the LRU order
+    survives process restarts.
+    """
+
+    LOCK_SUFFIX = ".lock"
+    TMP_SUFFIX = ".tmp"
+
+    # Entries used more recently than this are never evicted, so a path
+    # fetch() has just returned stays until its caller has opened it (seconds)
+    EVICT_MIN_AGE = 60.0
+
+    # In-process locks for entries, shared by keys hashing to the same one so
+    # their number stays fixed however many entries pass through the cache
+    LOCK_STRIPES = 64
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir: Directory holding cached files (created if missing)
+            max_bytes: Byte budget; least recently used entries are evicted beyond it
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._key_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._evicted_bytes = 0
+
+    def path_for(self, product_id: str, asset: str, suffix: str = "") -> Path:
+        """
+        Get the cache path for a product asset.
+
+        Args:
+            product_id: Product or item ID
+            asset: Asset name within the product (e.g. "product.zip", "ortho_udm2")
+            suffix: File suffix to keep drivers happy (e.g. ".zip", ".tif")
+
+        Returns:
+            Path where the asset is (or would be) stored
+        """
+        digest = hashlib.sha256(f"{product_id}/{asset}".encode()).hexdigest()
+        return self.cache_dir / digest[:2] / f"{digest}{suffix}"
+
+    def get(self, product_id: str, asset: str, suffix: str = "") -> Optional[str]:
+        """
+        Look up a cached asset.
+
+        Args:
+            product_id: Product or item ID
+            asset: Asset name within the product
+            suffix: File suffix used when the asset was stored
+
+        Returns:
+            Path to the cached file, or None on a miss
+        """
+        path = self.path_for(product_id, asset, suffix)
+        if not path.exists():
+            return None
+
+        # Bump recency for LRU ordering
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return str(path)
+
+    def fetch(
+        self,
+        product_id: str,
+        asset: str,
+        download: Callable[[str], None],
+        suffix: str = "",
+    ) -> str:
+        """
+        Return a cached asset, downloading it on a miss.
+
+        Concurrent callers asking for the same asset wait for the first
+        download instead of fetching it again.
+
+        Args:
+            product_id: Product or item ID
+            asset: Asset name within the product
+            download: Function that writes the asset to the path it is given
+            suffix: File suffix for the cached file
+
+        Returns:
+            Path to the cached file
+        """
+        path = self.path_for(product_id, asset, suffix)
+        key = path.name
+
+        with self._entry_lock(key, path):
+            cached = self.get(product_id, asset, suffix)
+            if cached is not None:
+                with self._lock:
+                    self._hits += 1
+                logger.info(f"Scene cache hit: {product_id}/{asset}")
+                return cached
+
+            with self._lock:
+                self._misses += 1
+            logger.info(f"Scene cache miss: {product_id}/{asset}")
+
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(
+                f"{path.name}.{os.getpid()}.{threading.get_ident()}{self.TMP_SUFFIX}"
+            )
+            try:
+                download(str(tmp_path))
+                # Atomic publish: readers either see the full file or nothing
+                os.replace(tmp_path, path)
+            finally:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+                if not path.exists():
+                    # Failed download: no entry for the lock file to guard
+                    self._lock_path(path).unlink(missing_ok=True)
+
+        self.evict(keep=path)
+        return str(path)
+
+    def evict(self, keep: Optional[Path] = None) -> int:
+        """
+        Evict least recently used entries until the cache fits its budget.
+
+        Each entry is removed, together with its lock file, under its entry
+        lock; entries being fetched right now or used within EVICT_MIN_AGE
+        are skipped.
+
+        Args:
+            keep: Entry that must not be evicted (e.g. the one just stored)
+
+        Returns:
+            Number of entries evicted
+        """
+        entries = []
+        total = 0
+        for path, size, mtime in self._entries():
+            entries.append((mtime, path, size))
+            total += size
+
+        if total <= self.max_bytes:
+            return 0
+
+        evicted = 0
+        now = time.time()
+        for mtime, path, size in sorted(entries):
+            if total <= self.max_bytes or now - mtime < self.EVICT_MIN_AGE:
+                break
+            if keep is not None and path == keep:
+                continue
+            with self._entry_lock(path.name, path, blocking=False) as locked:
+                if not locked:
+                    continue
+                try:
+                    if path.stat().st_mtime != mtime:
+                        # Used again since it was listed
+                        continue
+                    path.unlink()
+                except FileNotFoundError:
+                    continue
+                finally:
+                    if not path.exists():
+                        self._lock_path(path).unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+            with self._lock:
+                self._evictions += 1
+                self._evicted_bytes += size
+            logger.info(f"Scene cache evicted {path.name} ({size / 1e6:.1f} MB)")
+
+        return evicted
+
+    def stats(self) -> SceneCacheStats:
+        """
+        Get hit/miss/eviction counters and current usage.
+
+        Returns:
+            SceneCacheStats dictionary
+        """
+        entries = list(self._entries())
+        with self._lock:
+            return SceneCacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                evicted_bytes=self._evicted_bytes,
+                entries=len(entries),
+                size_bytes=sum(size for _, size, _ in entries),
+                max_bytes=self.max_bytes,
+            )
+
+    def _entries(self) -> Iterator[tuple[Path, int, float]]:
+        """Yield (path, size, mtime) for every published cache entry."""
+        for path in self.cache_dir.glob("*/*"):
+            if path.name.endswith((self.LOCK_SUFFIX, self.TMP_SUFFIX)):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            yield path, st.st_size, st.st_mtime
+
+    def _lock_path(self, path: Path) -> Path:
+        """Lock file guarding a cache entry."""
+        return path.with_name(path.name + self.LOCK_SUFFIX)
+
+    @contextmanager
+    def _entry_lock(self, key: str, path: Path, blocking: bool = True) -> Iterator[bool]:
+        """
+        Serialize work on one entry across threads and processes.
+
+        Yields whether the lock was taken, which is only False when not
+        blocking and another fetch or eviction holds it (or holds the
+        in-process lock of an entry on the same stripe).
+        """
+        thread_lock = self._key_locks[hash(key) % self.LOCK_STRIPES]
+        if not thread_lock.acquire(blocking):
+            yield False
+            return
+        try:
+            if fcntl is None:
+                yield True
+                return
+
+            path.parent.mkdir(parents=True, exist_ok=True)
+            lock_path = self._lock_path(path)
+            while True:
+                lock_file = open(lock_path, "a")
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    lock_file.close()
+                    lock_file = None
+                    break
+                # evict() may have removed the lock file while we waited on it;
+                # a lock on the unlinked file guards nothing
+                try:
+                    if os.stat(lock_path).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                        break
+                except FileNotFoundError:
+                    pass
+                lock_file.close()
+
+            if lock_file is None:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+        finally:
+            thread_lock.release()
+
+
+_scene_cache: Optional[SceneCache] = None
+_scene_cache_lock = threading.Lock()
+
+
+def get_scene_cache() -> Optional[SceneCache]:
+    """
+    Get the process-wide scene cache shared by all providers.
+
+    The cache is enabled by setting SCENE_CACHE_DIR. SCENE_CACHE_MAX_MB sets
+    the byte budget (default 10 GB).
+
+    Returns:
+        SceneCache instance, or None if caching is disabled
+    """
+    global _scene_cache
+
+    cache_dir = os.getenv("SCENE_CACHE_DIR")
+    if not cache_dir:
+        return None
+
+    with _scene_cache_lock:
+        if _scene_cache is None:
+            max_mb = os.getenv("SCENE_CACHE_MAX_MB")
+            try:
+                max_bytes = int(max_mb) * 1024 * 1024 if max_mb else DEFAULT_MAX_BYTES
+            except ValueError:
+                max_bytes = DEFAULT_MAX_BYTES
+            _scene_cache = SceneCache(cache_dir, max_bytes=max_bytes)
+            logger.info(f"Scene cache enabled at {cache_dir} ({max_bytes / 1e9:.1f} GB budget)")
+        return _scene_cache
@@ -3,13 +3,21 @@ Sentinel-2 satellite data provider implementation.
 
 Provides access to Sentinel-2 L2A data from Microsoft Planetary Computer.
 """
-from typing import TYPE_CHECKING
+import logging
+import os
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, ContextManager
+
+from raster import GeoBox, compact_attrs, compact_mode_enabled, mask_pixels
 
 from . import BaseSatelliteProvider, BandNames
+from .stac import get_sas_token_cache, get_stac_client
 
 if TYPE_CHECKING:
     import xarray as xr
 
+logger = logging.getLogger(__name__)
+
 
 class Sentinel2Provider(BaseSatelliteProvider):
     """
@@ -20,6 +28,76 @@ class Sentinel2Provider(BaseSatelliteProvider):
     Authentication: Requires Planetary Computer signed URLs (handled automatically)
     """
 
+    # Default number of threads reading COG tiles
+    DEFAULT_MAX_WORKERS = 4
+
+    # Default dask chunk edge (pixels) in lazy load mode
+    DEFAULT_CHUNK_SIZE = 2048
+
+    # SCL classes masked as cloudy/invalid: no data, cloud shadow,
+    # cloud medium/high probability, thin cirrus
+    CLOUD_CLASSES = (0, 3, 8, 9, 10)
+
+    def __init__(
+        self,
+        load_mode: str | None = None,
+        max_workers: int | None = None,
+        chunk_size: int | None = None,
+        compact: bool | None = None,
+    ):
+        """
+        Initialize the Sentinel-2 provider.
+
+        Args:
+            load_mode: "lazy" to return dask-chunked arrays that are read chunk
+                by chunk when downstream code computes them, "eager" to read
+                the whole window during load() (defaults to SENTINEL2_LOAD_MODE
+                env var, then "lazy"; falls back to "eager" without dask)
+            max_workers: Threads reading COG tiles (defaults to
+                SENTINEL2_MAX_WORKERS env var, then 4). In lazy mode this is
+                the worker count of dask's threaded scheduler within
+                compute_context().
+            chunk_size: Chunk edge in pixels for lazy loads (defaults to
+                SENTINEL2_CHUNK_SIZE env var, then 2048)
+            compact: Keep bands as uint16 DN with nodata 0 instead of float32
+                reflectance (defaults to COMPACT_DTYPE env var, then False)
+        """
+        self.load_mode = (load_mode or os.getenv("SENTINEL2_LOAD_MODE") or "lazy").lower()
+        if self.load_mode not in ("lazy", "eager"):
+            raise ValueError(f"Unknown Sentinel-2 load mode: {self.load_mode}")
+
+        self.max_workers = max_workers or int(
+            os.getenv("SENTINEL2_MAX_WORKERS") or self.DEFAULT_MAX_WORKERS
+        )
+        self.chunk_size = chunk_size or int(
+            os.getenv("SENTINEL2_CHUNK_SIZE") or self.DEFAULT_CHUNK_SIZE
+        )
+        self.compact = compact_mode_enabled() if compact is None else compact
+
+        if self.load_mode == "lazy":
+            try:
+                import dask
+            except ImportError:
+                logger.warning("dask not installed, Sentinel-2 loads fall back to eager mode")
+                self.load_mode = "eager"
+
+    def compute_context(self) -> ContextManager:
+        """
+        Run dask computations of lazy loads on max_workers threads.
+
+        The setting only holds inside the context, so other dask users in
+        the process keep their own scheduler configuration.
+
+        Returns:
+            Context manager
+        """
+        if self.load_mode != "lazy":
+            return nullcontext()
+
+        import dask
+
+        return dask.config.set(scheduler="threads", num_workers=self.max_workers)
+
     @property
     def resolution_meters(self) -> int:
         """Sentinel-2 native resolution for NIR/Red bands."""
@@ -31,13 +109,14 @@ class Sentinel2Provider(BaseSatelliteProvider):
         Sentinel-2 band mappings.
 
         Uses B04 (Red), B08 (NIR), B11 (SWIR), B02 (Blue) at native resolutions.
-        SCL band is used for cloud masking.
+        SCL band is loaded with them and used for cloud masking.
         """
         return BandNames(
             nir="B08",   # Near-infrared, 10m
             red="B04",   # Red, 10m
             swir="B11",  # Short-wave infrared, 20m (will be resampled)
             blue="B02",  # Blue, 10m
+            scl="SCL",   # Scene Classification Layer, 20m (nearest-resampled)
         )
 
     @property
@@ -60,6 +139,10 @@ class Sentinel2Provider(BaseSatelliteProvider):
         """
         Query Microsoft Planetary Computer STAC API for Sentinel-2 imagery.
 
+        Uses the process-wide catalog client, so the catalog root and HTTP
+        connections are shared across queries and results are signed from
+        the cached SAS tokens.
+
         Args:
             bbox: Bounding box [west, south, east, north]
             start_date: Start date YYYY-MM-DD
@@ -69,13 +152,7 @@ class Sentinel2Provider(BaseSatelliteProvider):
         Returns:
             List of STAC items matching criteria
         """
-        from pystac_client import Client
-        import planetary_computer
-
-        catalog = Client.open(
-            "https://planetarycomputer.microsoft.com/api/stac/v1",
-            modifier=planetary_computer.sign_inplace,
-        )
+        catalog = get_stac_client()
 
         search = catalog.search(
             collections=["sentinel-2-l2a"],
@@ -98,46 +175,85 @@ class Sentinel2Provider(BaseSatelliteProvider):
         """
         Load specified bands from Sentinel-2 items.
 
+        Items are grouped by solar day, so granules of the same overpass are
+        fused into one time slice instead of appearing as near-duplicate
+        acquisitions. In lazy mode nothing is read here: the result is a
+        dask-chunked array and each chunk of the bbox window is fetched when
+        downstream code computes it, so peak memory tracks the chunk size
+        rather than the window size.
+
+        SCL is read in the same pass onto the 10m grid with nearest
+        resampling, so cloud_mask() needs no second read of the scenes.
+
         Args:
             items: STAC items from query()
-            bands: Semantic band names to load ["nir", "red", "swir", "blue"]
+            bands: Semantic band names to load ["nir", "red", "swir", "blue", "scl"]
             bbox: Bounding box [west, south, east, north]
 
         Returns:
-            xarray DataArray with loaded band data
+            xarray DataArray with dims (time, band, y, x), dask-backed in lazy
+            mode; float32 reflectance, or uint16 DN in compact mode
         """
         from odc.stac import load
 
         # Convert semantic band names to Sentinel-2 band IDs
         band_ids = [self.band_names[b] for b in bands]
 
+        # Renew signatures that may have gone stale since query()
+        signer = get_sas_token_cache()
+        for item in items:
+            signer.sign_inplace(item)
+
+        if self.load_mode == "lazy":
+            read_options = {"chunks": {"x": self.chunk_size, "y": self.chunk_size}}
+        else:
+            read_options = {"pool": self.max_workers}
+        if self.compact:
+            # Stored integers, whatever the item metadata declares
+            read_options["dtype"] = "uint16"
+
         data = load(
             items,
             bands=band_ids,
             bbox=bbox,
             resolution=self.resolution_meters,
+            groupby="solar_day",
+            resampling={"SCL": "nearest"},
+            **read_options,
         )
 
-        # Convert from DN (0-10000) to reflectance (0-1)
-        for band_id in band_ids:
-            if band_id in data:
-                data[band_id] = data[band_id].astype("float32") / 10000
+        logger.info(
+            f"Loaded {len(items)} items as {data.sizes.get('time', 1)} solar days "
+            f"({self.load_mode}, grid {data.odc.geobox.shape})"
+        )
+
+        # odc-stac already knows the output grid; carry it along instead of
+        # letting downstream code rebuild it from coordinates
+        gbox = data.odc.geobox
+        grid = GeoBox(str(gbox.crs), gbox.affine, gbox.shape)
+
+        # Convert from DN (0-10000) to reflectance (0-1); DN 0 is nodata.
+        # SCL is a classification and keeps its class values. Compact mode
+        # keeps the DN as loaded (SCL fits the uint16 stack unchanged).
+        if not self.compact:
+            for band_id in band_ids:
+                if band_id in data and band_id != "SCL":
+                    dn = data[band_id]
+                    data[band_id] = dn.where(dn != 0).astype("float32") / 10000
 
         # Rename back to semantic names for consistency
-        renamed = data.rename({
-            self.band_names["nir"]: "nir",
-            self.band_names["red"]: "red",
-            self.band_names["swir"]: "swir",
-            self.band_names["blue"]: "blue",
-        })
-
-        # Ensure data is a DataArray with band dimension
-        # odc-stac may return a Dataset
-        if hasattr(renamed, 'to_array'):
-            # Convert Dataset to DataArray with band dimension
-            renamed = renamed.to_array(dim="band")
-            # Rename array values to semantic names
-            renamed = renamed.assign_coords(band=["nir", "red", "swir", "blue"][:len(renamed.coords["band"])])
+        semantic = {band_id: name for name, band_id in self.band_names.items() if band_id in data}
+        renamed = data[list(semantic)].rename(semantic).to_array(dim="band")
+
+        if "time" in renamed.dims:
+            renamed = renamed.transpose("time", "band", "y", "x")
+            if renamed.chunks is not None:
+                # Temporal reductions need every date of a pixel in one chunk
+                renamed = renamed.chunk({"time": -1})
+
+        renamed.attrs.update(grid.to_attrs())
+        if self.compact:
+            renamed.attrs.update(compact_attrs())
 
         return renamed
 
@@ -146,77 +262,84 @@ class Sentinel2Provider(BaseSatelliteProvider):
         data: 'xr.DataArray',
         items: list,
         bbox: list[float] | None = None
-    ) -> tuple['xr.DataArray', float]:
+    ) -> tuple['xr.DataArray', float, 'xr.DataArray']:
         """
         Apply cloud mask using Sentinel-2 SCL (Scene Classification) band.
 
-        The SCL band classifies each pixel into categories. We include only
-        pixels classified as:
-        - 4: Vegetation
-        - 5: Bare soil
-        - 7: Unclassified
+        The SCL band is expected in the data, loaded by load() alongside the
+        spectral bands. Pixels classified as no data (0), cloud shadow (3),
+        cloud medium/high probability (8, 9) or thin cirrus (10) are masked.
+        In lazy mode only the SCL chunks are computed here; the spectral
+        bands stay lazy.
 
         Args:
-            data: xarray DataArray with band data
+            data: xarray DataArray with band data including 'scl' band,
+                dims (band, y, x) or (time, band, y, x)
             items: STAC items used to load the data
             bbox: Optional bounding box [west, south, east, north]
 
         Returns:
-            Tuple of (masked_data, cloud_free_percentage)
+            Tuple of (masked_data, cloud_free_percentage, cloud_mask)
+            - masked_data: DataArray with cloudy pixels set to NaN (nodata
+              when compact)
+            - cloud_free_percentage: Fraction of clear pixels (0.0-1.0)
+            - cloud_mask: Boolean DataArray where True = cloudy/invalid pixel,
+              with a time dimension if the data has one
         """
         import numpy as np
         import xarray as xr
 
-        # Get average cloud cover from items
-        cloud_covers = []
-        for item in items:
-            # Handle both STAC Item objects and dicts
-            if hasattr(item, 'properties'):
-                cc = item.properties.get("eo:cloud_cover")
-            elif isinstance(item, dict):
-                cc = item.get("properties", {}).get("eo:cloud_cover")
+        band_names = [str(b) for b in data.coords["band"].values] if "band" in data.coords else []
+        if "scl" not in band_names:
+            logger.warning("SCL band not found in data, falling back to metadata cloud cover")
+            cloud_covers = []
+            for item in items:
+                # Handle both STAC Item objects and dicts
+                if hasattr(item, 'properties'):
+                    cc = item.properties.get("eo:cloud_cover")
+                elif isinstance(item, dict):
+                    cc = item.get("properties", {}).get("eo:cloud_cover")
+                else:
+                    cc = None
+                if cc is not None:
+                    cloud_covers.append(cc)
+
+            if cloud_covers:
+                avg_cloud_cover = sum(cloud_covers) / len(cloud_covers)
+                cloud_free_pct = 1.0 - (avg_cloud_cover / 100.0)
             else:
-                cc = None
-            if cc is not None:
-                cloud_covers.append(cc)
-
-        if cloud_covers:
-            avg_cloud_cover = sum(cloud_covers) / len(cloud_covers)
-            cloud_free_pct = 1.0 - (avg_cloud_cover / 100.0)
-        else:
-            # No cloud info available, assume mostly clear
-            cloud_free_pct = 0.7
-
-        # Create a simple mask - assume all pixels are valid
-        # In production, we'd use SCL with proper resampling
-        if hasattr(data, 'dims'):
-            mask = xr.ones_like(data, dtype=bool)
-        else:
-            mask = np.ones(data.shape, dtype=bool)
-
-        # Apply mask (which does nothing since all are valid)
-        masked = data.where(mask)
-
-        return masked, cloud_free_pct
-
-    def get_scl_band(self, items: list, bbox: list[float]) -> 'xr.DataArray':
-        """
-        Load just the SCL band for cloud masking.
+                cloud_free_pct = 0.7
+
+            # Create empty cloud mask (all False = no clouds masked)
+            first_band = data.isel(band=0)
+            cloud_mask_arr = xr.DataArray(
+                np.zeros(first_band.shape, dtype=bool),
+                dims=first_band.dims,
+                coords={k: v for k, v in first_band.coords.items() if k != 'band'},
+                attrs=dict(data.attrs),  # Preserve the grid (CRS, transform) for zonal stats
+            )
+            return data, cloud_free_pct, cloud_mask_arr
+
+        # Materialise SCL only (uint8 class values, small next to the spectral bands)
+        scl = data.sel(band='scl')
+        scl_values = np.asarray(scl.values)
+
+        # Create cloud mask: True = cloudy/invalid pixel
+        cloud_mask_arr = xr.DataArray(
+            np.isin(scl_values, self.CLOUD_CLASSES),
+            dims=scl.dims,
+            coords={k: v for k, v in scl.coords.items() if k != 'band'},
+            attrs=dict(data.attrs),  # Preserve the grid (CRS, transform) for zonal stats
+        )
 
-        Args:
-            items: STAC items from query()
-            bbox: Bounding box [west, south, east, north]
+        total_pixels = cloud_mask_arr.size
+        clear_pixels = int((~cloud_mask_arr).sum().values)
+        cloud_free_pct = float(clear_pixels) / total_pixels if total_pixels > 0 else 0.0
 
-        Returns:
-            xarray DataArray with SCL classification data
-        """
-        from odc.stac import load
+        logger.info(f"SCL-based cloud masking: {clear_pixels}/{total_pixels} clear pixels ({cloud_free_pct:.1%})")
 
-        scl = load(
-            items,
-            bands=["SCL"],
-            bbox=bbox,
-            resolution=20,  # SCL is natively 20m
-        )
+        # Apply mask to all bands except SCL (set cloudy pixels to NaN)
+        spectral_bands = [b for b in band_names if b != 'scl']
+        masked_data = mask_pixels(data.sel(band=spectral_bands), cloud_mask_arr)
 
-        return scl.SCL
+        return masked_data, cloud_free_pct, cloud_mask_arr
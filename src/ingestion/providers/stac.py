@@ -0,0 +1,247 @@
+"""
+Process-wide Planetary Computer STAC client and SAS token cache.
+
+Opening a pystac_client Client fetches the catalog root and builds a new HTTP
+session, and every result page is signed through the planetary_computer
+modifier. Doing that per query means a root fetch, fresh connections and
+token requests for every farm.
+
+Instead, one Client per catalog URL is opened lazily and shared by every
+Sentinel2Provider and query_sentinel2() call in the process. Asset hrefs are
+signed from a thread-safe SAS token cache keyed by storage account and
+container, so a token is fetched once and reused until shortly before it
+expires. Items can be re-signed right before loading, which replaces
+signatures that went stale during a long run.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Optional
+from urllib.parse import urlparse, urlunparse
+
+logger = logging.getLogger(__name__)
+
+PLANETARY_COMPUTER_STAC_URL = "https://planetarycomputer.microsoft.com/api/stac/v1"
+PLANETARY_COMPUTER_SAS_URL = "https://planetarycomputer.microsoft.com/api/sas/v1/token"
+
+BLOB_STORAGE_DOMAIN = ".blob.core.windows.net"
+
+# Public thumbnails live in a storage account that must not be signed
+UNSIGNED_ACCOUNTS = {"ai4edatasetspublicassets"}
+
+
+class _SasToken:
+    """SAS token for one storage container."""
+
+    __slots__ = ("token", "expires_at")
+
+    def __init__(self, token: str, expires_at: float):
+        self.token = token
+        self.expires_at = expires_at
+
+
+class SasTokenCache:
+    """
+    Thread-safe Planetary Computer SAS token cache.
+
+    Tokens are keyed by (storage account, container) and fetched through one
+    shared HTTP session. A token is reused until MIN_VALIDITY seconds before
+    it expires; concurrent callers needing the same token wait for a single
+    request.
+    """
+
+    # Tokens closer than this to expiry are refreshed (seconds)
+    MIN_VALIDITY = 300
+
+    # Locks serializing token requests, shared by containers hashing to the same one
+    LOCK_STRIPES = 16
+
+    def __init__(self, sas_url: str = PLANETARY_COMPUTER_SAS_URL, subscription_key: Optional[str] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            sas_url: Token endpoint, tokens are requested from {sas_url}/{account}/{container}
+            subscription_key: Optional Planetary Computer subscription key
+                (defaults to PC_SDK_SUBSCRIPTION_KEY env var)
+        """
+        self.sas_url = sas_url.rstrip("/")
+        self.subscription_key = subscription_key or os.getenv("PC_SDK_SUBSCRIPTION_KEY")
+
+        self._lock = threading.Lock()
+        self._key_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._tokens: dict[tuple[str, str], _SasToken] = {}
+        self._session = None
+        self._requests = 0
+
+    def get_token(self, account: str, container: str) -> str:
+        """
+        Get a valid SAS token for a storage container.
+
+        Args:
+            account: Azure storage account name
+            container: Blob container name
+
+        Returns:
+            SAS token query string (without the leading "?")
+        """
+        key = (account, container)
+        with self._key_locks[hash(key) % self.LOCK_STRIPES]:
+            cached = self._tokens.get(key)
+            if cached is not None and time.time() < cached.expires_at - self.MIN_VALIDITY:
+                return cached.token
+
+            cached = self._fetch(account, container)
+            self._tokens[key] = cached
+            return cached.token
+
+    def sign_href(self, href: str) -> str:
+        """
+        Sign a blob storage URL with the current token for its container.
+
+        Any existing query string is replaced, so stale signatures are renewed.
+        URLs outside Azure blob storage are returned unchanged.
+
+        Args:
+            href: Asset URL
+
+        Returns:
+            Signed URL
+        """
+        parsed = urlparse(href)
+        if not parsed.netloc.endswith(BLOB_STORAGE_DOMAIN):
+            return href
+
+        account = parsed.netloc.split(".", 1)[0]
+        container = parsed.path.lstrip("/").split("/", 1)[0]
+        if account in UNSIGNED_ACCOUNTS or not container:
+            return href
+
+        token = self.get_token(account, container)
+        return urlunparse(parsed._replace(query=token))
+
+    def sign_inplace(self, obj: Any) -> Any:
+        """
+        Sign every asset of a pystac Item, ItemCollection or item dict in place.
+
+        Usable as a pystac_client modifier.
+
+        Args:
+            obj: Item-like object
+
+        Returns:
+            The same object
+        """
+        import pystac
+
+        if isinstance(obj, pystac.ItemCollection):
+            for item in obj:
+                self.sign_inplace(item)
+            return obj
+        if isinstance(obj, dict) and obj.get("type") == "FeatureCollection":
+            for item in obj.get("features", []):
+                self.sign_inplace(item)
+            return obj
+
+        assets = obj.get("assets", {}) if isinstance(obj, dict) else getattr(obj, "assets", None)
+        if not assets:
+            return obj
+
+        for asset in assets.values():
+            if isinstance(asset, dict):
+                if asset.get("href"):
+                    asset["href"] = self.sign_href(asset["href"])
+            elif getattr(asset, "href", None):
+                asset.href = self.sign_href(asset.href)
+        return obj
+
+    @property
+    def request_count(self) -> int:
+        """Number of token requests sent by this cache."""
+        with self._lock:
+            return self._requests
+
+    def _fetch(self, account: str, container: str) -> _SasToken:
+        """Request a new token. Caller must hold the key lock."""
+        from dateutil import parser as dateparser
+
+        url = f"{self.sas_url}/{account}/{container}"
+        headers = {"Ocp-Apim-Subscription-Key": self.subscription_key} if self.subscription_key else None
+
+        response = self._get_session().get(url, headers=headers, timeout=30)
+        with self._lock:
+            self._requests += 1
+        response.raise_for_status()
+
+        body = response.json()
+        expiry = dateparser.parse(body["msft:expiry"])
+        if expiry.tzinfo is None:
+            expiry = expiry.replace(tzinfo=timezone.utc)
+
+        logger.info(
+            f"Got SAS token for {account}/{container}, "
+            f"expires in {(expiry - datetime.now(timezone.utc)).total_seconds():.0f}s"
+        )
+        return _SasToken(body["token"], expiry.timestamp())
+
+    def _get_session(self):
+        """Shared HTTP session with retries for token requests."""
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                session = requests.Session()
+                retry = Retry(total=5, backoff_factor=0.8, status_forcelist=[429, 500, 502, 503, 504])
+                session.mount("https://", HTTPAdapter(max_retries=retry))
+                session.mount("http://", HTTPAdapter(max_retries=retry))
+                self._session = session
+            return self._session
+
+
+_sas_token_cache: Optional[SasTokenCache] = None
+_stac_clients: dict[str, Any] = {}
+_stac_lock = threading.Lock()
+
+
+def get_sas_token_cache() -> SasTokenCache:
+    """
+    Get the process-wide SAS token cache.
+
+    Returns:
+        SasTokenCache instance
+    """
+    global _sas_token_cache
+
+    with _stac_lock:
+        if _sas_token_cache is None:
+            _sas_token_cache = SasTokenCache()
+        return _sas_token_cache
+
+
+def get_stac_client(url: str = PLANETARY_COMPUTER_STAC_URL):
+    """
+    Get the process-wide STAC client for a catalog, opening it on first use.
+
+    Search results are signed from the shared SAS token cache.
+
+    Args:
+        url: STAC API root URL
+
+    Returns:
+        pystac_client.Client instance
+    """
+    signer = get_sas_token_cache()
+
+    with _stac_lock:
+        client = _stac_clients.get(url)
+        if client is None:
+            from pystac_client import Client
+
+            logger.info(f"Opening STAC catalog {url}")
+            client = Client.open(url, modifier=signer.sign_inplace)
+            _stac_clients[url] = client
+        return client
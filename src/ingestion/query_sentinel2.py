@@ -1,8 +1,7 @@
 """
 Query Microsoft Planetary Computer for Sentinel-2 imagery over farm AOI.
 """
-from pystac_client import Client
-import planetary_computer
+from providers.stac import get_stac_client
 
 def query_sentinel2(aoi_bbox, start_date, end_date, max_cloud_cover=50):
     """
@@ -17,10 +16,8 @@ def query_sentinel2(aoi_bbox, start_date, end_date, max_cloud_cover=50):
     Returns:
         List of STAC items matching criteria
     """
-    catalog = Client.open(
-        "https://planetarycomputer.microsoft.com/api/stac/v1",
-        modifier=planetary_computer.sign_inplace,
-    )
+    # Shared per-process client: no catalog root refetch, SAS tokens reused until expiry
+    catalog = get_stac_client()
 
     search = catalog.search(
         collections=["sentinel-2-l2a"],
@@ -0,0 +1,611 @@
+"""
+Lightweight raster containers for the processing hot path.
+
+A GeoBox describes a pixel grid (CRS, affine transform and shape) and a
+Raster pairs a numpy array with its GeoBox. Both use __slots__ and carry
+no coordinate arrays: bounds, pixel centres, windows and alignment checks
+are computed from the transform in O(1), so the pipeline never has to
+recover a grid from coordinate differences or guess a CRS.
+
+Providers still return xarray DataArrays at the interface boundary. The
+grid travels with them in attrs["crs"] and attrs["transform"], which
+GeoBox.from_xarray() reads back without touching the coordinates.
+
+In compact mode (COMPACT_DTYPE=true) providers keep band values as the
+stored integer DN (uint16, SCL as uint8 per product) instead of float32
+reflectance. Such arrays carry attrs["nodata"] and attrs["scale_factor"]
+the same way; masking and compositing write nodata instead of NaN, and
+to_reflectance() applies the scale only where indices are computed.
+"""
+import math
+import os
+from typing import TYPE_CHECKING, Optional, Sequence
+
+import numpy as np
+from affine import Affine
+
+if TYPE_CHECKING:
+    import xarray as xr
+
+
+class GeoBox:
+    """
+    Pixel grid: CRS, affine transform and (height, width).
+
+    Pixel (row, col) covers transform * (col, row) to transform * (col + 1, row + 1).
+    """
+
+    __slots__ = ("crs", "transform", "shape")
+
+    def __init__(self, crs: str, transform: Affine, shape: tuple[int, int]):
+        """
+        Initialize the grid.
+
+        Args:
+            crs: CRS as a string rasterio understands (e.g. "EPSG:32616")
+            transform: Affine transform of the top-left pixel corner
+            shape: Grid shape (height, width)
+        """
+        self.crs = str(crs)
+        self.transform = transform
+        self.shape = (int(shape[0]), int(shape[1]))
+
+    @property
+    def height(self) -> int:
+        """Number of rows."""
+        return self.shape[0]
+
+    @property
+    def width(self) -> int:
+        """Number of columns."""
+        return self.shape[1]
+
+    @property
+    def resolution(self) -> float:
+        """Pixel size in CRS units (square pixels assumed)."""
+        return abs(self.transform.a)
+
+    @property
+    def bounds(self) -> tuple[float, float, float, float]:
+        """Outer pixel-edge bounds (west, south, east, north) in the grid CRS."""
+        t = self.transform
+        west, north = t.c, t.f
+        east = west + t.a * self.width
+        south = north + t.e * self.height
+        return (min(west, east), min(south, north), max(west, east), max(south, north))
+
+    @property
+    def is_geographic(self) -> bool:
+        """Whether the grid CRS is in degrees."""
+        from rasterio.crs import CRS
+
+        return CRS.from_user_input(self.crs).is_geographic
+
+    def xs(self) -> np.ndarray:
+        """Pixel-centre x coordinates."""
+        t = self.transform
+        return t.c + (np.arange(self.width) + 0.5) * t.a
+
+    def ys(self) -> np.ndarray:
+        """Pixel-centre y coordinates."""
+        t = self.transform
+        return t.f + (np.arange(self.height) + 0.5) * t.e
+
+    def wgs84_bounds(self) -> tuple[float, float, float, float]:
+        """Grid bounds reprojected to WGS84 (west, south, east, north)."""
+        from rasterio.warp import transform_bounds
+
+        if self.crs == "EPSG:4326":
+            return self.bounds
+        return tuple(transform_bounds(self.crs, "EPSG:4326", *self.bounds))
+
+    def at_resolution(self, resolution: float) -> 'GeoBox':
+        """
+        Same extent and CRS at another pixel size.
+
+        Args:
+            resolution: New pixel size in CRS units
+
+        Returns:
+            GeoBox covering the same bounds (snapped outward)
+        """
+        west, south, east, north = self.bounds
+        width = max(1, math.ceil((east - west) / resolution - 1e-9))
+        height = max(1, math.ceil((north - south) / resolution - 1e-9))
+        return GeoBox(self.crs, Affine(resolution, 0, west, 0, -resolution, north), (height, width))
+
+    def window(self, bounds: Sequence[float]) -> tuple[slice, slice]:
+        """
+        Row/column slices of the pixels intersecting some bounds.
+
+        Args:
+            bounds: (west, south, east, north) in the grid CRS
+
+        Returns:
+            Tuple of (row_slice, col_slice), clipped to the grid (may be empty)
+        """
+        inv = ~self.transform
+        west, south, east, north = bounds
+        c0, r0 = inv * (west, north)
+        c1, r1 = inv * (east, south)
+        row_start, row_stop = sorted((r0, r1))
+        col_start, col_stop = sorted((c0, c1))
+
+        rows = slice(
+            min(max(int(math.floor(row_start)), 0), self.height),
+            min(max(int(math.ceil(row_stop)), 0), self.height),
+        )
+        cols = slice(
+            min(max(int(math.floor(col_start)), 0), self.width),
+            min(max(int(math.ceil(col_stop)), 0), self.width),
+        )
+        return rows, cols
+
+    def slices_of(self, inner: 'GeoBox') -> tuple[slice, slice]:
+        """
+        Row/column slices at which a pixel-aligned sub-grid sits in this grid.
+
+        Args:
+            inner: Grid with the same CRS and resolution lying inside this one
+
+        Returns:
+            Tuple of (row_slice, col_slice) selecting exactly inner.shape
+
+        Raises:
+            ValueError: If inner is not a pixel-aligned sub-grid of this grid
+        """
+        if inner.crs != self.crs or not math.isclose(inner.resolution, self.resolution):
+            raise ValueError(f"{inner} is not on the same CRS and resolution as {self}")
+
+        col = (inner.transform.c - self.transform.c) / self.transform.a
+        row = (inner.transform.f - self.transform.f) / self.transform.e
+        col0, row0 = int(round(col)), int(round(row))
+        if abs(col - col0) > 1e-6 or abs(row - row0) > 1e-6:
+            raise ValueError(f"{inner} is not pixel-aligned with {self}")
+        if row0 < 0 or col0 < 0 or row0 + inner.height > self.height or col0 + inner.width > self.width:
+            raise ValueError(f"{inner} does not lie inside {self}")
+
+        return slice(row0, row0 + inner.height), slice(col0, col0 + inner.width)
+
+    def geometry_mask(
+        self,
+        geometry,
+        all_touched: bool = True,
+    ) -> tuple[slice, slice, np.ndarray]:
+        """
+        Rasterize a geometry over just the window it covers.
+
+        Args:
+            geometry: Shapely geometry in the grid CRS
+            all_touched: Include every pixel the geometry touches
+
+        Returns:
+            Tuple of (row_slice, col_slice, inside) where inside is a boolean
+            array over the window, True for pixels inside the geometry
+        """
+        from rasterio.features import geometry_mask
+
+        rows, cols = self.window(geometry.bounds)
+        height = rows.stop - rows.start
+        width = cols.stop - cols.start
+        if height <= 0 or width <= 0:
+            return rows, cols, np.zeros((0, 0), dtype=bool)
+
+        window_transform = self.transform * Affine.translation(cols.start, rows.start)
+        inside = geometry_mask(
+            [geometry],
+            out_shape=(height, width),
+            transform=window_transform,
+            all_touched=all_touched,
+            invert=True,
+        )
+        return rows, cols, inside
+
+    @classmethod
+    def from_bbox(
+        cls,
+        bbox: Sequence[float],
+        resolution: float,
+        crs: Optional[str] = None,
+        align: Optional[float] = None,
+    ) -> 'GeoBox':
+        """
+        Grid covering a WGS84 bbox.
+
+        Args:
+            bbox: Bounding box [west, south, east, north] in WGS84
+            resolution: Pixel size in CRS units
+            crs: Grid CRS (defaults to the UTM zone of the bbox centre)
+            align: Snap edges outward to multiples of this (defaults to resolution)
+
+        Returns:
+            GeoBox covering the bbox
+        """
+        from rasterio.warp import transform_bounds
+
+        west, south, east, north = bbox
+        if crs is None:
+            zone = int(((west + east) / 2 + 180) // 6) + 1
+            crs = f"EPSG:{(32600 if (south + north) / 2 >= 0 else 32700) + zone}"
+
+        left, bottom, right, top = transform_bounds("EPSG:4326", crs, *bbox)
+
+        step = align or resolution
+        left = math.floor(left / step) * step
+        bottom = math.floor(bottom / step) * step
+        right = math.ceil(right / step) * step
+        top = math.ceil(top / step) * step
+
+        shape = (int(round((top - bottom) / resolution)), int(round((right - left) / resolution)))
+        return cls(crs, Affine(resolution, 0, left, 0, -resolution, top), shape)
+
+    @classmethod
+    def union(cls, grids: Sequence['GeoBox']) -> 'GeoBox':
+        """
+        Smallest grid covering several grids on the same CRS and resolution.
+
+        Args:
+            grids: North-up grids sharing CRS and pixel size
+
+        Returns:
+            GeoBox on the same pixel lattice as the first grid
+        """
+        first = grids[0]
+        if any(g.crs != first.crs or not math.isclose(g.resolution, first.resolution) for g in grids):
+            raise ValueError("Cannot union grids with different CRS or resolution")
+
+        res = first.resolution
+        west = min(g.bounds[0] for g in grids)
+        south = min(g.bounds[1] for g in grids)
+        east = max(g.bounds[2] for g in grids)
+        north = max(g.bounds[3] for g in grids)
+        shape = (int(round((north - south) / res)), int(round((east - west) / res)))
+        return cls(first.crs, Affine(res, 0, west, 0, -res, north), shape)
+
+    @classmethod
+    def from_xarray(cls, data: 'xr.DataArray') -> 'GeoBox':
+        """
+        Grid of a DataArray.
+
+        Uses attrs["transform"] when present (O(1)). Otherwise the transform
+        is derived once from the first two x/y coordinates.
+
+        Args:
+            data: DataArray with y/x dimensions and attrs["crs"]
+
+        Returns:
+            GeoBox of the data
+
+        Raises:
+            ValueError: If the data carries no CRS or has no usable grid
+        """
+        crs = data.attrs.get("crs")
+        if not crs:
+            raise ValueError("DataArray has no 'crs' attribute")
+
+        shape = (data.sizes["y"], data.sizes["x"])
+
+        transform = data.attrs.get("transform")
+        if transform is not None:
+            return cls(crs, Affine(*tuple(transform)[:6]), shape)
+
+        xs = data.coords["x"].values
+        ys = data.coords["y"].values
+        if len(xs) < 2 or len(ys) < 2:
+            raise ValueError("Cannot derive a grid from fewer than two x/y coordinates")
+
+        dx = float(xs[1] - xs[0])
+        dy = float(ys[1] - ys[0])
+        transform = Affine(dx, 0, float(xs[0]) - dx / 2, 0, dy, float(ys[0]) - dy / 2)
+        return cls(crs, transform, shape)
+
+    def to_attrs(self) -> dict:
+        """Attrs that let from_xarray() recover this grid."""
+        return {"crs": self.crs, "transform": tuple(self.transform)[:6]}
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, GeoBox):
+            return NotImplemented
+        return (
+            self.shape == other.shape
+            and self.crs == other.crs
+            and self.transform.almost_equals(other.transform)
+        )
+
+    def __hash__(self) -> int:
+        return hash((self.crs, self.shape, tuple(round(v, 6) for v in tuple(self.transform)[:6])))
+
+    def __repr__(self) -> str:
+        return f"GeoBox({self.crs}, {self.width}x{self.height} @ {self.resolution:g}, origin=({self.transform.c:g}, {self.transform.f:g}))"
+
+
+class Raster:
+    """
+    Array plus the grid it sits on.
+
+    data has shape (..., y, x): (y, x), (band, y, x) or (time, band, y, x).
+    """
+
+    __slots__ = ("data", "geobox", "bands", "times")
+
+    def __init__(
+        self,
+        data: np.ndarray,
+        geobox: GeoBox,
+        bands: Optional[Sequence[str]] = None,
+        times: Optional[Sequence] = None,
+    ):
+        """
+        Initialize the raster.
+
+        Args:
+            data: Array with the grid as its last two dimensions
+            geobox: Grid of the array
+            bands: Band names for the band dimension, if any
+            times: Time values for the time dimension, if any
+        """
+        if data.shape[-2:] != geobox.shape:
+            raise ValueError(f"Array shape {data.shape} does not match grid {geobox.shape}")
+        self.data = data
+        self.geobox = geobox
+        self.bands = list(bands) if bands is not None else None
+        self.times = list(times) if times is not None else None
+
+    def band(self, name: str) -> np.ndarray:
+        """Array for one band (keeps any time dimension)."""
+        if self.bands is None:
+            raise ValueError("Raster has no band dimension")
+        return self.data[..., self.bands.index(name), :, :]
+
+    def reproject(
+        self,
+        dst: GeoBox,
+        resampling: str = "bilinear",
+        nodata: Optional[int] = None,
+    ) -> 'Raster':
+        """
+        Warp the raster onto another grid in a single call for all bands.
+
+        Goes through the shared warp engine (see warp.py).
+
+        Returns self unchanged when the grids already match.
+
+        Args:
+            dst: Target grid
+            resampling: rasterio resampling method name
+            nodata: Nodata value of integer (compact) data; the output then
+                keeps the source dtype. Other data is warped as float32.
+
+        Returns:
+            Raster on the target grid (NaN, or nodata for integer data, where
+            there is no source data)
+        """
+        from warp import get_warp_engine
+
+        if dst == self.geobox:
+            return self
+
+        lead = self.data.shape[:-2]
+        src = self.data.reshape((-1,) + self.geobox.shape)
+        if src.dtype == bool:
+            src = src.astype(np.uint8)
+            resampling = "nearest"
+            nodata = None
+
+        if nodata is not None and np.issubdtype(src.dtype, np.integer):
+            # Compact data stays integer, nodata marks the gaps
+            fill = nodata
+        else:
+            src = src.astype(np.float32, copy=False)
+            fill = np.nan
+
+        out = get_warp_engine().reproject(
+            src, self.geobox, dst, resampling, src_nodata=fill, dst_nodata=fill
+        )
+
+        return Raster(out.reshape(lead + dst.shape), dst, self.bands, self.times)
+
+    @classmethod
+    def from_xarray(cls, data: 'xr.DataArray') -> 'Raster':
+        """
+        Wrap a DataArray without copying its values.
+
+        Args:
+            data: DataArray with y/x dimensions (optionally time and band)
+
+        Returns:
+            Raster with dimensions ordered (time, band, y, x)
+        """
+        order = [d for d in ("time", "band", "y", "x") if d in data.dims]
+        data = data.transpose(*order)
+        bands = [str(b) for b in data.coords["band"].values] if "band" in data.dims else None
+        times = None
+        if "time" in data.dims:
+            times = list(data.coords["time"].values) if "time" in data.coords else list(range(data.sizes["time"]))
+        return cls(np.asarray(data.values), GeoBox.from_xarray(data), bands, times)
+
+    def to_xarray(self, attrs: Optional[dict] = None) -> 'xr.DataArray':
+        """
+        Convert to a DataArray for the xarray-facing interfaces.
+
+        Args:
+            attrs: Extra attributes to carry over (the grid attrs always win)
+
+        Returns:
+            DataArray with pixel-centre coordinates and the grid in attrs
+        """
+        import xarray as xr
+
+        dims = ["y", "x"]
+        coords = {"y": self.geobox.ys(), "x": self.geobox.xs()}
+        if self.bands is not None:
+            dims.insert(0, "band")
+            coords["band"] = self.bands
+        if self.times is not None:
+            dims.insert(0, "time")
+            coords["time"] = self.times
+
+        return xr.DataArray(
+            self.data,
+            dims=dims,
+            coords=coords,
+            attrs={**(attrs or {}), **self.geobox.to_attrs()},
+        )
+
+
+def acquisition_time(value: Optional[str]) -> np.datetime64:
+    """
+    Parse an acquisition timestamp into a time coordinate value.
+
+    Args:
+        value: ISO 8601 timestamp from item metadata, with or without a zone
+
+    Returns:
+        Naive UTC datetime64[ns], or NaT if the value is missing or unparseable
+    """
+    from datetime import timezone
+
+    from dateutil import parser as dateparser
+
+    try:
+        dt = dateparser.parse(value)
+    except (ValueError, TypeError, OverflowError):
+        return np.datetime64("NaT", "ns")
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(dt, "ns")
+
+
+# Compact mode: reflectance stored as DN = reflectance / REFLECTANCE_SCALE
+REFLECTANCE_SCALE = 1e-4
+DN_NODATA = 0
+
+
+def compact_mode_enabled() -> bool:
+    """Whether providers should load compact integer data (COMPACT_DTYPE env var)."""
+    return os.getenv("COMPACT_DTYPE", "false").lower() in ("true", "1", "yes")
+
+
+def compact_attrs(nodata: int = DN_NODATA, scale_factor: float = REFLECTANCE_SCALE) -> dict:
+    """Attrs marking a DataArray as compact integer data."""
+    return {"nodata": nodata, "scale_factor": scale_factor}
+
+
+def compact_nodata(data: 'xr.DataArray') -> Optional[int]:
+    """
+    Nodata value of compact integer data.
+
+    Args:
+        data: DataArray from a provider, composite or merge
+
+    Returns:
+        attrs["nodata"] for integer data that carries it, None for float data
+    """
+    nodata = data.attrs.get("nodata")
+    if nodata is None or not np.issubdtype(data.dtype, np.integer):
+        return None
+    return int(nodata)
+
+
+def valid_pixels(data: 'xr.DataArray') -> 'xr.DataArray':
+    """Boolean DataArray, True where data holds a value (not nodata/NaN)."""
+    nodata = compact_nodata(data)
+    if nodata is None:
+        return ~data.isnull()
+    return data != nodata
+
+
+def mask_pixels(data: 'xr.DataArray', mask: 'xr.DataArray | np.ndarray') -> 'xr.DataArray':
+    """
+    Blank out masked pixels, keeping compact data in its integer dtype.
+
+    In-memory data is masked block by block on the shared block engine
+    (see blocks.py), into one preallocated output; lazy (dask) data and
+    masks not laid out along the data's dimensions go through where().
+
+    Args:
+        data: DataArray to mask
+        mask: Boolean mask broadcastable to data, True = pixel to drop
+
+    Returns:
+        DataArray with masked pixels set to nodata (compact) or NaN
+    """
+    nodata = compact_nodata(data)
+    fill = data.dtype.type(nodata) if nodata is not None else np.nan
+
+    mask_values = _mask_like(data, mask)
+    if mask_values is None or data.chunks is not None or (nodata is None and data.dtype.kind != "f"):
+        if nodata is None:
+            return data.where(~mask)
+        return data.where(~mask, fill)
+
+    from blocks import get_block_engine
+
+    def apply(out: np.ndarray, values: np.ndarray, drop: np.ndarray) -> None:
+        np.copyto(out, values)
+        np.copyto(out, fill, where=drop)
+
+    out = np.empty(data.shape, dtype=data.dtype)
+    get_block_engine().run(apply, (out, data.values, mask_values))
+    return data.copy(data=out)
+
+
+def _mask_like(data: 'xr.DataArray', mask: 'xr.DataArray | np.ndarray') -> Optional[np.ndarray]:
+    """Mask as an array broadcast to the data's shape, or None if it is not laid out along its dimensions."""
+    import xarray as xr
+
+    if isinstance(mask, xr.DataArray):
+        if mask.chunks is not None or not set(mask.dims) <= set(data.dims):
+            return None
+        if any(mask.sizes[d] != data.sizes[d] for d in mask.dims):
+            return None
+        values = mask.transpose(*[d for d in data.dims if d in mask.dims]).values
+        values = values.reshape([data.sizes[d] if d in mask.dims else 1 for d in data.dims])
+    else:
+        values = np.asarray(mask)
+
+    try:
+        return np.broadcast_to(values.astype(bool, copy=False), data.shape)
+    except ValueError:
+        return None
+
+
+def scale_dn(values: np.ndarray, nodata: int, scale_factor: float) -> np.ndarray:
+    """
+    Convert compact DN values to float32 reflectance, nodata to NaN.
+
+    Args:
+        values: Integer array
+        nodata: Nodata value
+        scale_factor: Reflectance per DN
+
+    Returns:
+        float32 array of the same shape
+    """
+    out = values.astype(np.float32) * np.float32(scale_factor)
+    out[values == nodata] = np.nan
+    return out
+
+
+def to_reflectance(data: 'xr.DataArray') -> 'xr.DataArray':
+    """
+    Float reflectance view of a DataArray.
+
+    Compact data is scaled and its nodata turned into NaN; float data is
+    returned unchanged. Meant for index and display computations, so call
+    it on the bands needed rather than on whole time stacks.
+
+    Args:
+        data: DataArray, compact or float
+
+    Returns:
+        float DataArray with NaN for missing pixels, without the compact attrs
+    """
+    nodata = compact_nodata(data)
+    if nodata is None:
+        return data
+
+    scale = np.float32(data.attrs.get("scale_factor", REFLECTANCE_SCALE))
+    attrs = {k: v for k, v in data.attrs.items() if k not in ("nodata", "scale_factor")}
+    out = (data.astype(np.float32) * scale).where(data != nodata)
+    return out.assign_attrs(attrs)
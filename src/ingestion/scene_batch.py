@@ -0,0 +1,453 @@
+"""
+Batch planning for farms that share Sentinel-2 tiles.
+
+Farms cluster geographically, so a scheduler run typically has several jobs
+whose farms fall in the same MGRS tile and therefore resolve to the same
+Sentinel-2 products. Run independently, every farm queries, downloads and
+decodes those products again.
+
+plan_scene_batches() queries the catalog once per farm up front, groups farms
+by MGRS tile (and UTM grid), and merges the farm grids of each group into one
+union window. When a farm's pipeline later loads a product, the provider asks
+the plan first: the product is decoded once over the union window and every
+farm in the batch gets an exact crop of its own grid out of that array. Each
+decoded product is dropped as soon as the last farm that needs it has loaded
+it, and decoded products held across the plan stay under a byte ceiling:
+a decode that would exceed it serves the farm that asked for it and is not
+kept, so later farms decode the product again.
+"""
+import logging
+import os
+import re
+import threading
+from typing import TYPE_CHECKING, Callable, Optional, Sequence, TypedDict
+
+from raster import GeoBox
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Tile ID in Sentinel-2 product names, e.g. S2B_MSIL2A_20240501T..._R088_T56HLH_2024...
+TILE_ID_PATTERN = re.compile(r"_T(\d{2}[A-Z]{3})_")
+
+# Largest union window decoded for one batch (pixels per band, ~2000 x 2000 at 10 m)
+DEFAULT_MAX_PIXELS = 4_000_000
+
+# Decoded products held at once across all batches of a plan (MB)
+DEFAULT_MAX_MB = 1024
+
+ProductLoader = Callable[[dict, list[str], GeoBox], dict[str, 'np.ndarray']]
+
+
+class SceneBatchStats(TypedDict):
+    """Counters for judging how much the batching saved."""
+    batches: int
+    farms: int
+    shared_products: int
+    product_decodes: int
+    crops: int
+
+
+def mgrs_tile_id(item: dict) -> Optional[str]:
+    """
+    Get the MGRS tile of a Sentinel-2 catalog item.
+
+    Args:
+        item: Item from a provider query()
+
+    Returns:
+        Tile ID such as "56HLH", or None if the product name has none
+    """
+    tile = item.get("properties", {}).get("s2:mgrs_tile")
+    if tile:
+        return str(tile)
+    match = TILE_ID_PATTERN.search(item.get("name") or item.get("id") or "")
+    return match.group(1) if match else None
+
+
+def _bbox_key(bbox: Sequence[float]) -> tuple[float, ...]:
+    """Hashable key for a farm bbox."""
+    return tuple(round(float(v), 9) for v in bbox)
+
+
+class DecodeBudget:
+    """Byte ceiling for decoded products, shared by the batches of a plan."""
+
+    def __init__(self, max_bytes: int):
+        """
+        Initialize the budget.
+
+        Args:
+            max_bytes: Bytes of decoded products that may be held at once
+        """
+        self.max_bytes = max_bytes
+        self.held_bytes = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes: int) -> bool:
+        """Claim nbytes if they fit under the ceiling."""
+        with self._lock:
+            if self.held_bytes + nbytes > self.max_bytes:
+                return False
+            self.held_bytes += nbytes
+            return True
+
+    def free(self, nbytes: int) -> None:
+        """Return bytes claimed with reserve()."""
+        with self._lock:
+            self.held_bytes -= nbytes
+
+
+class SceneBatch:
+    """
+    Farms on one MGRS tile and UTM grid whose products are decoded once.
+
+    Decoded products are kept per product ID over the union grid of the
+    farms, with the set of farms still waiting to load each product.
+    """
+
+    def __init__(
+        self,
+        tile_id: str,
+        grid: GeoBox,
+        farm_grids: dict[tuple, GeoBox],
+        budget: Optional[DecodeBudget] = None,
+    ):
+        """
+        Initialize the batch.
+
+        Args:
+            tile_id: MGRS tile shared by the farms
+            grid: Union grid covering every farm grid
+            farm_grids: Farm grid per farm bbox key
+            budget: Byte ceiling for decoded products held (unbounded if None)
+        """
+        self.tile_id = tile_id
+        self.grid = grid
+        self.farm_grids = farm_grids
+        self.budget = budget
+
+        self._lock = threading.Lock()
+        self._product_locks: dict[str, threading.Lock] = {}
+        self._decoded: dict[str, tuple[frozenset, dict[str, 'np.ndarray']]] = {}
+        self._waiting: dict[str, set[tuple]] = {}
+        self._planned: dict[str, int] = {}
+
+        self.decodes = 0
+        self.crops = 0
+
+    def add_product(self, product_id: str, farm_key: tuple) -> None:
+        """Record that a farm in this batch will load a product."""
+        self._waiting.setdefault(product_id, set()).add(farm_key)
+        self._planned[product_id] = len(self._waiting[product_id])
+
+    def shares(self, product_id: str, farm_key: tuple) -> bool:
+        """Whether a farm's load of a product should come from this batch."""
+        with self._lock:
+            waiting = self._waiting.get(product_id, ())
+            # A product only one farm needs is cheaper to read over that farm's own window
+            return farm_key in waiting and (len(waiting) > 1 or product_id in self._decoded)
+
+    @property
+    def shared_products(self) -> int:
+        """Number of products needed by more than one farm."""
+        return sum(1 for count in self._planned.values() if count > 1)
+
+    def load(
+        self,
+        item: dict,
+        band_ids: list[str],
+        farm_key: tuple,
+        loader: ProductLoader,
+    ) -> dict[str, 'np.ndarray']:
+        """
+        Crop one farm's window out of a product decoded over the union grid.
+
+        Args:
+            item: Product metadata from query()
+            band_ids: Band IDs to load
+            farm_key: Bbox key of the farm loading the product
+            loader: Provider function reading bands of a product onto a grid
+
+        Returns:
+            Dict mapping band ID to an array on the farm grid
+        """
+        product_id = item["id"]
+        wanted = frozenset(band_ids)
+
+        with self._lock:
+            product_lock = self._product_locks.setdefault(product_id, threading.Lock())
+
+        with product_lock:
+            decoded = self._decoded.get(product_id)
+            if decoded is None or not wanted <= decoded[0]:
+                logger.info(
+                    f"Decoding {item.get('name', product_id)} once for tile {self.tile_id} "
+                    f"({len(self._waiting.get(product_id, ()))} farms, grid: {self.grid})"
+                )
+                decoded = (wanted, loader(item, band_ids, self.grid))
+                self.decodes += 1
+                self._keep(product_id, decoded)
+
+            rows, cols = self.grid.slices_of(self.farm_grids[farm_key])
+            arrays = {
+                band_id: array[rows, cols].copy()
+                for band_id, array in decoded[1].items()
+                if band_id in wanted
+            }
+            self.crops += 1
+
+        self.release(product_id, farm_key)
+        return arrays
+
+    def _keep(self, product_id: str, decoded: tuple[frozenset, dict[str, 'np.ndarray']]) -> None:
+        """Hold a decoded product for the other farms if it fits the budget."""
+        self._drop(product_id)
+        with self._lock:
+            if len(self._waiting.get(product_id, ())) <= 1:
+                # No other farm left to use it
+                return
+        nbytes = sum(array.nbytes for array in decoded[1].values())
+        if self.budget is not None and not self.budget.reserve(nbytes):
+            logger.info(
+                f"Not keeping {product_id} for other farms: {nbytes / 1e6:.0f} MB would exceed "
+                f"the scene batch ceiling ({self.budget.max_bytes / 1e6:.0f} MB)"
+            )
+            return
+        with self._lock:
+            self._decoded[product_id] = decoded
+
+    def _drop(self, product_id: str) -> None:
+        """Free a decoded product and return its bytes to the budget."""
+        with self._lock:
+            decoded = self._decoded.pop(product_id, None)
+        if decoded is not None and self.budget is not None:
+            self.budget.free(sum(array.nbytes for array in decoded[1].values()))
+
+    def release(self, product_id: str, farm_key: tuple) -> None:
+        """Drop a farm's claim on a product, freeing it once no farm waits for it."""
+        with self._lock:
+            waiting = self._waiting.get(product_id)
+            if waiting is None:
+                return
+            waiting.discard(farm_key)
+            done = not waiting
+        if done:
+            self._drop(product_id)
+
+    def release_farm(self, farm_key: tuple) -> None:
+        """Drop every claim a farm still holds, e.g. when its job is skipped."""
+        for product_id in list(self._waiting):
+            self.release(product_id, farm_key)
+
+    def clear(self) -> None:
+        """Free all decoded products."""
+        for product_id in list(self._decoded):
+            self._drop(product_id)
+
+
+class SceneBatchPlan:
+    """
+    Per-run plan of which farms share which products.
+
+    Attach it to a provider (CopernicusProvider.scene_plan) so that query()
+    reuses the catalog results gathered while planning and load() routes
+    shared products through their batch.
+    """
+
+    def __init__(self, query_args: tuple, max_bytes: Optional[int] = None):
+        """
+        Initialize an empty plan.
+
+        Args:
+            query_args: (start_date, end_date, max_cloud_cover) the plan was queried with
+            max_bytes: Bytes of decoded products held at once across batches
+                (unbounded if None)
+        """
+        self.query_args = query_args
+        self.budget = DecodeBudget(max_bytes) if max_bytes is not None else None
+        self.batches: list[SceneBatch] = []
+        self._queries: dict[tuple, list] = {}
+        self._farm_batches: dict[tuple, list[SceneBatch]] = {}
+        self._farm_order: list[str] = []
+
+    def cached_query(
+        self,
+        bbox: Sequence[float],
+        start_date: str,
+        end_date: str,
+        max_cloud_cover: float,
+    ) -> Optional[list]:
+        """
+        Catalog results gathered while planning.
+
+        Returns:
+            Items for the farm, or None if the plan did not query these arguments
+        """
+        if (start_date, end_date, max_cloud_cover) != self.query_args:
+            return None
+        items = self._queries.get(_bbox_key(bbox))
+        return list(items) if items is not None else None
+
+    def load_product(
+        self,
+        item: dict,
+        band_ids: list[str],
+        grid: GeoBox,
+        bbox: Sequence[float],
+        loader: ProductLoader,
+    ) -> dict[str, 'np.ndarray']:
+        """
+        Load a product for a farm, through its batch when the product is shared.
+
+        Args:
+            item: Product metadata from query()
+            band_ids: Band IDs to load
+            grid: Farm grid the provider wants the bands on
+            bbox: Farm bbox
+            loader: Provider function reading bands of a product onto a grid
+
+        Returns:
+            Dict mapping band ID to an array on the farm grid
+        """
+        key = _bbox_key(bbox)
+        for batch in self._farm_batches.get(key, ()):
+            if batch.farm_grids[key] == grid and batch.shares(item["id"], key):
+                return batch.load(item, band_ids, key, loader)
+        return loader(item, band_ids, grid)
+
+    def order(self, farm_ids: Sequence[str]) -> list[str]:
+        """
+        Order farms so that farms sharing a batch run back to back.
+
+        Args:
+            farm_ids: Farm IDs in their original order
+
+        Returns:
+            Same IDs, batched farms first in batch order, then the rest
+        """
+        planned = [f for f in self._farm_order if f in farm_ids]
+        return planned + [f for f in farm_ids if f not in planned]
+
+    def release_farm(self, bbox: Sequence[float]) -> None:
+        """Release everything a farm holds, e.g. when its job is skipped or fails."""
+        for batch in self._farm_batches.get(_bbox_key(bbox), ()):
+            batch.release_farm(_bbox_key(bbox))
+
+    def close(self) -> None:
+        """Free every decoded product still held."""
+        for batch in self.batches:
+            batch.clear()
+
+    def stats(self) -> SceneBatchStats:
+        """Counters for logging."""
+        return SceneBatchStats(
+            batches=len(self.batches),
+            farms=sum(len(b.farm_grids) for b in self.batches),
+            shared_products=sum(b.shared_products for b in self.batches),
+            product_decodes=sum(b.decodes for b in self.batches),
+            crops=sum(b.crops for b in self.batches),
+        )
+
+
+def plan_scene_batches(
+    provider,
+    farms: dict[str, list[float]],
+    start_date: str,
+    end_date: str,
+    max_cloud_cover: float,
+    max_pixels: Optional[int] = None,
+    max_mb: Optional[int] = None,
+) -> SceneBatchPlan:
+    """
+    Group farms by MGRS tile so shared products are fetched and decoded once.
+
+    Farms are grouped by tile and by the CRS of their grid, then packed
+    greedily into batches whose union window stays under max_pixels. Only
+    batches with more than one farm are kept; a farm on its own loads exactly
+    as it would without a plan.
+
+    Args:
+        provider: Sentinel-2 provider with query(), resolution_meters and GRID_ALIGNMENT
+        farms: Farm bbox [west, south, east, north] per farm ID
+        start_date: Start date (YYYY-MM-DD) the pipeline will query
+        end_date: End date (YYYY-MM-DD) the pipeline will query
+        max_cloud_cover: Maximum cloud cover the pipeline will query
+        max_pixels: Largest union window per batch (default SCENE_BATCH_MAX_PIXELS)
+        max_mb: Decoded products held at once across batches, in MB (default
+            SCENE_BATCH_MAX_MB, then 1024)
+
+    Returns:
+        SceneBatchPlan to attach to the provider
+    """
+    if max_pixels is None:
+        max_pixels = int(os.getenv("SCENE_BATCH_MAX_PIXELS", str(DEFAULT_MAX_PIXELS)))
+    if max_mb is None:
+        max_mb = int(os.getenv("SCENE_BATCH_MAX_MB", str(DEFAULT_MAX_MB)))
+
+    plan = SceneBatchPlan((start_date, end_date, max_cloud_cover), max_bytes=max_mb * 1024 * 1024)
+    align = getattr(provider, "GRID_ALIGNMENT", None)
+
+    # Farm grids and products per (tile, CRS)
+    groups: dict[tuple[str, str], dict[tuple, tuple[str, GeoBox, list[str]]]] = {}
+    for farm_id, bbox in farms.items():
+        key = _bbox_key(bbox)
+        try:
+            items = provider.query(
+                bbox=list(bbox),
+                start_date=start_date,
+                end_date=end_date,
+                max_cloud_cover=max_cloud_cover,
+            )
+        except Exception as e:
+            logger.warning(f"Scene batch query failed for farm {farm_id}: {e}")
+            continue
+        plan._queries[key] = items
+
+        grid = GeoBox.from_bbox(bbox, provider.resolution_meters, align=align)
+        for item in items:
+            tile_id = mgrs_tile_id(item)
+            if tile_id is None:
+                continue
+            farm_entry = groups.setdefault((tile_id, grid.crs), {}).setdefault(key, (farm_id, grid, []))
+            farm_entry[2].append(item["id"])
+
+    for (tile_id, _), group in groups.items():
+        if len(group) < 2:
+            continue
+
+        # Greedy west-to-east packing under the pixel budget
+        clusters: list[list[tuple]] = []
+        for key in sorted(group, key=lambda k: group[k][1].bounds[0]):
+            grid = group[key][1]
+            for cluster in clusters:
+                union = GeoBox.union([group[k][1] for k in cluster] + [grid])
+                if union.height * union.width <= max_pixels:
+                    cluster.append(key)
+                    break
+            else:
+                clusters.append([key])
+
+        for cluster in clusters:
+            if len(cluster) < 2:
+                continue
+
+            farm_grids = {key: group[key][1] for key in cluster}
+            batch = SceneBatch(tile_id, GeoBox.union(list(farm_grids.values())), farm_grids, plan.budget)
+            for key in cluster:
+                for product_id in group[key][2]:
+                    batch.add_product(product_id, key)
+                plan._farm_batches.setdefault(key, []).append(batch)
+                farm_id = group[key][0]
+                if farm_id not in plan._farm_order:
+                    plan._farm_order.append(farm_id)
+            plan.batches.append(batch)
+
+    stats = plan.stats()
+    logger.info(
+        f"Scene batches: {stats['batches']} batches covering {stats['farms']} farm windows, "
+        f"{stats['shared_products']} products shared across farms"
+    )
+    return plan
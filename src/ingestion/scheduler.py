@@ -21,7 +21,7 @@ import os
 import sys
 import time
 from datetime import datetime
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 # Load environment variables from .env.local if available
 try:
@@ -30,9 +30,15 @@ try:
 except ImportError:
     pass
 
-from config import FarmConfig, create_farm_config_from_convex, load_env_config
-from pipeline import run_pipeline_for_farm
+from config import FarmConfig, create_farm_config_from_convex, get_farm_bbox, load_env_config
+from pipeline import get_date_range, run_pipeline_for_farm
 from imagery_checker import check_new_imagery_available
+from providers.download import get_downloader
+from providers.rate_limit import get_rate_limiter
+from providers.scene_cache import get_scene_cache
+
+if TYPE_CHECKING:
+    from providers import SatelliteProvider
 
 logging.basicConfig(
     level=logging.INFO,
@@ -285,33 +291,152 @@ class Scheduler:
         """
         processed = 0
 
-        for job in jobs:
-            # Check if we've exceeded max processing time
-            elapsed = time.time() - start_time
-            if elapsed >= max_time:
-                logger.warning(f"Reached max processing time ({elapsed:.0f}s), stopping job processing")
-                logger.info(f"Remaining jobs: {len(jobs) - processed}")
-                break
+        # Farms on the same MGRS tile share one fetch and decode per product
+        sentinel2_provider, farm_bboxes = self._plan_scene_batches(jobs)
+        scene_plan = sentinel2_provider.scene_plan if sentinel2_provider is not None else None
+        if scene_plan is not None:
+            order = scene_plan.order(list(farm_bboxes))
+            jobs = sorted(
+                jobs,
+                key=lambda j: order.index(j['farmExternalId']) if j['farmExternalId'] in order else len(order),
+            )
 
-            job_id = job['_id']
+        try:
+            for job in jobs:
+                # Check if we've exceeded max processing time
+                elapsed = time.time() - start_time
+                if elapsed >= max_time:
+                    logger.warning(f"Reached max processing time ({elapsed:.0f}s), stopping job processing")
+                    logger.info(f"Remaining jobs: {len(jobs) - processed}")
+                    break
+
+                job_id = job['_id']
+
+                # Claim the job
+                claimed = self.convex.claim_job(job_id)
+                if claimed and self._process_single_job(claimed, sentinel2_provider=sentinel2_provider):
+                    processed += 1
+                elif not claimed:
+                    logger.warning(f"Job {job_id} already claimed, skipping")
+
+                # Whatever happened, this farm no longer holds shared products in memory
+                bbox = farm_bboxes.get(job['farmExternalId'])
+                if scene_plan is not None and bbox is not None:
+                    scene_plan.release_farm(bbox)
+        finally:
+            if scene_plan is not None:
+                stats = scene_plan.stats()
+                logger.info(
+                    f"Scene batches: {stats['product_decodes']} shared decodes served "
+                    f"{stats['crops']} farm windows across {stats['batches']} batches"
+                )
+                scene_plan.close()
 
-            # Claim the job
-            claimed = self.convex.claim_job(job_id)
-            if not claimed:
-                logger.warning(f"Job {job_id} already claimed, skipping")
-                continue
+        self._log_scene_cache_stats()
+        self._log_download_stats()
+        self._log_rate_limit_stats()
+        return processed
 
-            if self._process_single_job(claimed):
-                processed += 1
+    def _plan_scene_batches(self, jobs: list[dict]) -> tuple[Optional['SatelliteProvider'], dict[str, list[float]]]:
+        """
+        Plan shared Sentinel-2 product loads for farms on the same MGRS tile.
 
-        return processed
+        Disabled with SCENE_BATCHING=false, and only used with the Copernicus
+        provider since it is the one that downloads and decodes whole products.
+
+        Args:
+            jobs: Pending job documents
+
+        Returns:
+            Tuple of (Sentinel-2 provider carrying the plan or None, farm bbox per farm ID)
+        """
+        farm_ids = list(dict.fromkeys(job['farmExternalId'] for job in jobs))
+        if len(farm_ids) < 2 or os.getenv("SCENE_BATCHING", "true").lower() == "false":
+            return None, {}
+        if not (os.getenv("COPERNICUS_CLIENT_ID") and os.getenv("COPERNICUS_CLIENT_SECRET")):
+            return None, {}
+
+        from providers.copernicus import CopernicusProvider
+        from scene_batch import plan_scene_batches
+
+        farm_bboxes: dict[str, list[float]] = {}
+        for farm_id in farm_ids:
+            try:
+                farm_data = self.convex.get_farm(farm_id)
+                if farm_data:
+                    farm_bboxes[farm_id] = get_farm_bbox(create_farm_config_from_convex(farm_data))
+            except Exception as e:
+                logger.warning(f"Could not plan scene batches for farm {farm_id}: {e}")
+
+        if len(farm_bboxes) < 2:
+            return None, {}
+
+        provider = CopernicusProvider()
+        start_date, end_date = get_date_range(self.pipeline_config.composite_window_days)
+        try:
+            plan = plan_scene_batches(
+                provider,
+                farm_bboxes,
+                start_date=start_date,
+                end_date=end_date,
+                max_cloud_cover=self.pipeline_config.max_cloud_cover,
+            )
+        except Exception as e:
+            # Planning is an optimization; jobs still run one farm at a time without it
+            logger.warning(f"Scene batch planning failed: {e}")
+            return None, {}
+        if not plan.batches:
+            return None, {}
+
+        provider.scene_plan = plan
+        return provider, farm_bboxes
+
+    def _log_scene_cache_stats(self):
+        """Log scene cache counters so the cache budget can be sized."""
+        cache = get_scene_cache()
+        if cache is None:
+            return
+
+        stats = cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        hit_rate = stats['hits'] / lookups if lookups else 0.0
+        logger.info(
+            f"Scene cache: {stats['hits']} hits, {stats['misses']} misses ({hit_rate:.0%} hit rate), "
+            f"{stats['evictions']} evictions ({stats['evicted_bytes'] / 1e9:.2f} GB), "
+            f"{stats['entries']} entries using {stats['size_bytes'] / 1e9:.2f}/{stats['max_bytes'] / 1e9:.2f} GB"
+        )
+
+    def _log_download_stats(self):
+        """Log download totals so timeouts and worker counts can be sized."""
+        totals = get_downloader().totals()
+        if not totals['downloads'] and not totals['failures']:
+            return
+
+        mb_per_second = totals['bytes'] / 1e6 / totals['seconds'] if totals['seconds'] else 0.0
+        logger.info(
+            f"Downloads: {totals['downloads']} completed, {totals['bytes'] / 1e9:.2f} GB at "
+            f"{mb_per_second:.1f} MB/s, {totals['resumes']} resumes, {totals['retries']} retries, "
+            f"{totals['failures']} failures ({totals['checksum_failures']} checksum mismatches)"
+        )
+
+    def _log_rate_limit_stats(self):
+        """Log Planet request throttling so PL_RATE_LIMITS can be sized."""
+        stats = get_rate_limiter().stats()
+        if not stats['requests']:
+            return
+
+        logger.info(
+            f"Planet requests: {stats['requests']} sent, {stats['throttled']} throttled for "
+            f"{stats['throttled_seconds']:.1f}s in total, {stats['rate_limited']} refused with 429"
+        )
 
-    def _process_single_job(self, job: dict) -> bool:
+    def _process_single_job(self, job: dict, sentinel2_provider: Optional['SatelliteProvider'] = None) -> bool:
         """
         Process a single claimed job.
 
         Args:
             job: Claimed job document
+            sentinel2_provider: Optional Sentinel-2 provider shared across the run's jobs
 
         Returns:
             True if successful
@@ -352,6 +477,7 @@ class Scheduler:
             result = run_pipeline_for_farm(
                 farm_config=farm_config,
                 pipeline_config=self.pipeline_config,
+                sentinel2_provider=sentinel2_provider,
             )
 
             # Complete the job - success only if we got valid observations
@@ -0,0 +1,345 @@
+"""
+Shared warp engine for every reprojection path.
+
+Providers warp scenes onto the farm grid, the merge code warps every
+provider onto the finest grid, and masks are warped again for compositing
+and zonal statistics. Each call site used to set up its own rasterio
+reproject() with default settings: one GDAL thread, the default warp
+memory, and a fresh coordinate transformation per band or per call.
+
+The WarpEngine warps whole (..., y, x) stacks in one call with GDAL's
+multi-threaded warper and a shared warp memory limit. For nearest
+neighbour warps, which dominate (masks, classifications), it caches the
+source pixel each destination pixel maps to per (source grid, destination
+grid) pair, once a pair has been warped a second time. Later warps between
+the same grids are then a numpy gather with no GDAL call or coordinate
+transformation. Maps cost about 16 bytes per destination pixel, so the
+cache is bounded in bytes. Warps between identical grids are plain copies.
+
+read_window() reads only the part of a scene that covers a grid, so the
+warper never sees more source pixels than it needs.
+"""
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence, TypedDict
+
+import numpy as np
+
+from raster import GeoBox, Raster
+
+logger = logging.getLogger(__name__)
+
+
+class WarpStats(TypedDict):
+    """Counters for the warp engine."""
+    gdal_warps: int
+    cached_warps: int
+    copies: int
+    cached_maps: int
+    cached_bytes: int
+
+
+class WarpEngine:
+    """
+    Multi-threaded warper with a per grid pair cache of nearest-neighbour maps.
+
+    Thread-safe; one instance is shared by the whole process.
+    """
+
+    # Default GDAL warp memory (MB)
+    DEFAULT_MEMORY_LIMIT_MB = 256
+
+    # Default byte budget for cached nearest-neighbour maps (MB)
+    DEFAULT_MAP_CACHE_MB = 256
+
+    # Grid pairs remembered as warped once, so a second warp builds their map
+    MAX_SEEN_PAIRS = 1024
+
+    def __init__(
+        self,
+        num_threads: Optional[int] = None,
+        memory_limit_mb: Optional[int] = None,
+        map_cache_mb: Optional[int] = None,
+    ):
+        """
+        Initialize the engine.
+
+        Args:
+            num_threads: GDAL warper threads per warp (defaults to
+                WARP_THREADS env var, then the CPU count)
+            memory_limit_mb: GDAL warp memory in MB (defaults to
+                WARP_MEMORY_MB env var, then 256)
+            map_cache_mb: Byte budget for nearest-neighbour maps in MB
+                (defaults to WARP_MAP_CACHE_MB env var, then 256)
+        """
+        self.num_threads = num_threads or int(os.getenv("WARP_THREADS") or os.cpu_count() or 1)
+        self.memory_limit_mb = memory_limit_mb or int(
+            os.getenv("WARP_MEMORY_MB") or self.DEFAULT_MEMORY_LIMIT_MB
+        )
+        self.map_cache_bytes = (map_cache_mb or int(
+            os.getenv("WARP_MAP_CACHE_MB") or self.DEFAULT_MAP_CACHE_MB
+        )) * 1024 * 1024
+
+        self._lock = threading.Lock()
+        self._maps: OrderedDict[tuple[GeoBox, GeoBox], tuple[np.ndarray, np.ndarray]] = OrderedDict()
+        self._map_bytes = 0
+        self._seen: OrderedDict[tuple[GeoBox, GeoBox], None] = OrderedDict()
+        self._stats = {"gdal_warps": 0, "cached_warps": 0, "copies": 0}
+
+    def reproject(
+        self,
+        source: np.ndarray,
+        src: GeoBox,
+        dst: GeoBox,
+        resampling: str = "bilinear",
+        src_nodata: Optional[float] = None,
+        dst_nodata: Optional[float] = None,
+        out: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        Warp an array of shape (..., y, x) onto another grid in one call.
+
+        Destination pixels without source data are set to dst_nodata, or
+        to 0 when there is none (as GDAL does).
+
+        Args:
+            source: Array with the source grid as its last two dimensions
+            src: Source grid
+            dst: Destination grid
+            resampling: rasterio resampling method name
+            src_nodata: Source value that marks missing data (NaN allowed)
+            dst_nodata: Value written where there is no source data (default 0)
+            out: Destination array of shape (..., dst.height, dst.width);
+                allocated with source.dtype when not given
+
+        Returns:
+            Warped array (out, when given)
+        """
+        lead = source.shape[:-2]
+        flat = source.reshape((-1,) + src.shape)
+
+        if out is None:
+            fill = dst_nodata if dst_nodata is not None else 0
+            out = np.full(lead + dst.shape, fill, dtype=source.dtype)
+        dest = out.reshape((-1,) + dst.shape)
+
+        if dst == src:
+            np.copyto(dest, flat, casting="unsafe")
+            self._count("copies")
+        else:
+            mapping = self._nearest_map(src, dst) if resampling == "nearest" else None
+            if mapping is not None:
+                self._gather(flat, dest, mapping, src_nodata, dst_nodata)
+                self._count("cached_warps")
+            else:
+                self._gdal(flat, dest, src, dst, resampling, src_nodata, dst_nodata)
+
+        if not np.may_share_memory(dest, out):
+            # out was not contiguous, reshape had to copy
+            out[...] = dest.reshape(out.shape)
+        return out
+
+    def stats(self) -> WarpStats:
+        """Counters since the engine was created."""
+        with self._lock:
+            return WarpStats(
+                gdal_warps=self._stats["gdal_warps"],
+                cached_warps=self._stats["cached_warps"],
+                copies=self._stats["copies"],
+                cached_maps=len(self._maps),
+                cached_bytes=self._map_bytes,
+            )
+
+    def _gdal(
+        self,
+        source: np.ndarray,
+        dest: np.ndarray,
+        src: GeoBox,
+        dst: GeoBox,
+        resampling: str,
+        src_nodata: Optional[float],
+        dst_nodata: Optional[float],
+    ) -> None:
+        """Warp every band with one multi-threaded GDAL call."""
+        from rasterio.warp import Resampling, reproject
+
+        nodata = {}
+        if src_nodata is not None:
+            nodata["src_nodata"] = src_nodata
+        if dst_nodata is not None:
+            nodata["dst_nodata"] = dst_nodata
+
+        reproject(
+            source=source,
+            destination=dest,
+            src_transform=src.transform,
+            src_crs=src.crs,
+            dst_transform=dst.transform,
+            dst_crs=dst.crs,
+            resampling=Resampling[resampling],
+            num_threads=self.num_threads,
+            warp_mem_limit=self.memory_limit_mb,
+            **nodata,
+        )
+        self._count("gdal_warps")
+
+    def _nearest_map(self, src: GeoBox, dst: GeoBox) -> Optional[tuple[np.ndarray, np.ndarray]]:
+        """
+        Flat indices of the destination pixels inside the source, and of the
+        source pixel each of them takes its value from.
+
+        Built by warping the source pixel indices with GDAL's nearest
+        neighbour, so it selects exactly the pixels a direct warp would.
+        Building costs a warp of its own, so a map is only built the second
+        time a grid pair is warped; until then None is returned and the
+        caller warps directly.
+        """
+        key = (src, dst)
+        with self._lock:
+            cached = self._maps.get(key)
+            if cached is not None:
+                self._maps.move_to_end(key)
+                return cached
+
+            if key not in self._seen:
+                self._seen[key] = None
+                while len(self._seen) > self.MAX_SEEN_PAIRS:
+                    self._seen.popitem(last=False)
+                return None
+
+        dtype = np.int32 if src.height * src.width < np.iinfo(np.int32).max else np.float64
+        indices = np.arange(src.height * src.width, dtype=dtype).reshape((1,) + src.shape)
+        mapping = np.full((1,) + dst.shape, -1, dtype=dtype)
+        self._gdal(indices, mapping, src, dst, "nearest", -1, -1)
+        mapping = mapping.ravel()
+        dst_index = np.flatnonzero(mapping >= 0)
+        src_index = mapping[dst_index].astype(np.intp)
+        mapping = (dst_index, src_index)
+
+        size = dst_index.nbytes + src_index.nbytes
+        if size > self.map_cache_bytes:
+            # Too large to keep; use it this once
+            return mapping
+
+        with self._lock:
+            if key not in self._maps:
+                self._maps[key] = mapping
+                self._map_bytes += size
+            self._maps.move_to_end(key)
+            while self._map_bytes > self.map_cache_bytes:
+                _, (old_dst, old_src) = self._maps.popitem(last=False)
+                self._map_bytes -= old_dst.nbytes + old_src.nbytes
+        return mapping
+
+    @staticmethod
+    def _gather(
+        source: np.ndarray,
+        dest: np.ndarray,
+        mapping: tuple[np.ndarray, np.ndarray],
+        src_nodata: Optional[float],
+        dst_nodata: Optional[float],
+    ) -> None:
+        """Fill dest from source through a nearest-neighbour map, honouring nodata."""
+        dst_index, src_index = mapping
+        values = np.take(source.reshape(source.shape[0], -1), src_index, axis=1)
+
+        fill = dst_nodata if dst_nodata is not None else 0
+        if src_nodata is not None:
+            invalid = np.isnan(values) if np.isnan(src_nodata) else values == src_nodata
+            values[invalid] = fill
+
+        flat = dest.reshape(dest.shape[0], -1)
+        flat[...] = fill
+        flat[:, dst_index] = values
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._stats[counter] += 1
+
+
+def read_window(
+    src,
+    dst: GeoBox,
+    indexes: Optional[Sequence[int]] = None,
+    resampling: str = "nearest",
+) -> Raster:
+    """
+    Read the part of an open dataset that covers a grid.
+
+    Only the source window under the grid footprint (plus a pixel of margin
+    for interpolating resamplers) is read, so for a COG - local or behind
+    /vsicurl/ - only its intersecting internal tiles are decoded or
+    transferred. When the grid is at least twice as coarse as the source,
+    the window is read decimated so GDAL can serve it from overviews.
+
+    Args:
+        src: Open rasterio dataset
+        dst: Grid the data will be warped onto
+        indexes: Band indexes to read (defaults to all bands)
+        resampling: rasterio resampling method name for decimated reads
+
+    Returns:
+        Raster of shape (bands, rows, cols) on the window's own grid, 0 where
+        the window runs past the dataset
+    """
+    from affine import Affine
+    from rasterio.enums import Resampling
+    from rasterio.warp import transform_bounds
+    from rasterio.windows import Window, from_bounds
+
+    indexes = list(indexes or src.indexes)
+
+    bounds = transform_bounds(dst.crs, src.crs, *dst.bounds)
+    window = from_bounds(*bounds, src.transform).round_offsets().round_lengths()
+    window = Window(window.col_off - 1, window.row_off - 1, window.width + 2, window.height + 2)
+
+    inside = (
+        window.col_off >= 0 and window.row_off >= 0
+        and window.col_off + window.width <= src.width
+        and window.row_off + window.height <= src.height
+    )
+
+    # Decimate only by whole factors, so source pixels stay finer than the grid
+    factor = max(1, int(dst.resolution // abs(src.transform.a)))
+    out_shape = (
+        len(indexes),
+        max(1, math.ceil(window.height / factor)),
+        max(1, math.ceil(window.width / factor)),
+    )
+
+    data = src.read(
+        indexes,
+        window=window,
+        out_shape=out_shape,
+        resampling=Resampling[resampling],
+        boundless=not inside,
+        fill_value=0,
+    )
+
+    transform = src.window_transform(window)
+    if factor > 1:
+        transform = transform * Affine.scale(window.width / out_shape[2], window.height / out_shape[1])
+
+    return Raster(data, GeoBox(src.crs.to_string(), transform, out_shape[1:]))
+
+
+_warp_engine: Optional[WarpEngine] = None
+_warp_engine_lock = threading.Lock()
+
+
+def get_warp_engine() -> WarpEngine:
+    """
+    Get the process-wide warp engine.
+
+    Returns:
+        WarpEngine instance
+    """
+    global _warp_engine
+
+    with _warp_engine_lock:
+        if _warp_engine is None:
+            _warp_engine = WarpEngine()
+        return _warp_engine
@@ -4,6 +4,7 @@ Zonal statistics computation for paddock-level analysis.
 Aggregates raster data (NDVI, EVI, NDWI) within polygon boundaries
 (paddocks) to produce per-paddock statistics.
 """
+import logging
 from typing import TYPE_CHECKING, TypedDict
 
 import numpy as np
@@ -11,9 +12,13 @@ import xarray as xr
 import geopandas as gpd
 from shapely.geometry import Polygon
 
+from raster import REFLECTANCE_SCALE, GeoBox, Raster, compact_nodata, scale_dn
+
 if TYPE_CHECKING:
     from typing import Optional
 
+logger = logging.getLogger(__name__)
+
 
 class ZonalStatsResult(TypedDict):
     """Result of zonal statistics computation."""
@@ -35,23 +40,15 @@ MIN_CLOUD_FREE_PCT = 0.5  # 50% minimum clear pixels
 
 def get_bbox_from_data(data: xr.DataArray) -> tuple[float, float, float, float]:
     """
-    Get bounding box from xarray DataArray coordinates.
+    Get bounding box of a DataArray's grid.
 
     Args:
-        data: DataArray with y and x coordinates
+        data: DataArray carrying its grid (see GeoBox.from_xarray)
 
     Returns:
-        Tuple (west, south, east, north)
+        Tuple (west, south, east, north) of the outer pixel edges, in the data CRS
     """
-    y_coords = data.coords["y"].values
-    x_coords = data.coords["x"].values
-
-    west = float(x_coords.min())
-    east = float(x_coords.max())
-    south = float(y_coords.min())
-    north = float(y_coords.max())
-
-    return (west, south, east, north)
+    return GeoBox.from_xarray(data).bounds
 
 
 def pixel_centers_to_gdf(data: xr.DataArray) -> gpd.GeoDataFrame:
@@ -59,30 +56,21 @@ def pixel_centers_to_gdf(data: xr.DataArray) -> gpd.GeoDataFrame:
     Create a GeoDataFrame of pixel centroids from raster data.
 
     Args:
-        data: DataArray with y and x dimensions
+        data: DataArray with y and x dimensions, carrying its grid
 
     Returns:
-        GeoDataFrame with point geometries for each pixel
+        GeoDataFrame with point geometries for each pixel, in the data CRS
     """
-    y_coords = data.coords["y"].values
-    x_coords = data.coords["x"].values
-
-    points = []
-    values = []
-
-    for y_idx, y in enumerate(y_coords):
-        for x_idx, x in enumerate(x_coords):
-            points.append((x, y))
-            values.append((y_idx, x_idx))
-
-    from shapely.geometry import Point
+    grid = GeoBox.from_xarray(data)
 
-    geometries = [Point(p) for p in points]
+    # Row-major pixel centres, vectorised from the transform
+    xx, yy = np.meshgrid(grid.xs(), grid.ys())
+    rows, cols = np.indices(grid.shape)
 
     gdf = gpd.GeoDataFrame(
-        {"pixel_idx": values},
-        geometry=geometries,
-        crs="EPSG:4326"
+        {"pixel_idx": list(zip(rows.ravel(), cols.ravel()))},
+        geometry=gpd.points_from_xy(xx.ravel(), yy.ravel()),
+        crs=grid.crs,
     )
 
     return gdf
@@ -115,38 +103,35 @@ def compute_zonal_stats(
     Returns:
         List of ZonalStatsResult dictionaries
     """
-    import rioxarray  # Enables .rio accessor
-
-    # Get raster CRS - try multiple sources
-    raster_crs = None
-
-    # Try rioxarray accessor first
-    if hasattr(data, 'rio') and hasattr(data.rio, 'crs') and data.rio.crs is not None:
-        raster_crs = data.rio.crs
-        print(f"DEBUG: Found raster CRS from rio: {raster_crs}")
-
-    # Try attrs
-    if raster_crs is None and "crs" in data.attrs:
-        crs_str = data.attrs["crs"]
-        print(f"DEBUG: Found raster CRS from attrs: {crs_str}")
-        data = data.rio.write_crs(crs_str)
-        raster_crs = data.rio.crs
-
-    # Fallback to EPSG:4326
-    if raster_crs is None:
-        raster_crs = "EPSG:4326"
-        data = data.rio.write_crs(raster_crs)
-        print(f"DEBUG: Set raster CRS to: {raster_crs}")
-
-    print(f"DEBUG: Data shape: {data.shape}")
-    print(f"DEBUG: Data dims: {data.dims}")
-
-    # Check data bounds
-    if 'x' in data.coords and 'y' in data.coords:
-        x_coords = data.coords['x'].values
-        y_coords = data.coords['y'].values
-        print(f"DEBUG: X range: {x_coords.min():.4f} to {x_coords.max():.4f}")
-        print(f"DEBUG: Y range: {y_coords.min():.4f} to {y_coords.max():.4f}")
+    # Raster grid (CRS + transform) travels with the data
+    grid = GeoBox.from_xarray(data)
+    raster_crs = grid.crs
+
+    logger.debug(f"Raster grid: {grid}")
+    logger.debug(f"Data shape: {data.shape}")
+    logger.debug(f"Data dims: {data.dims}")
+
+    # Compact data stays integer here; each paddock's pixels are scaled to
+    # reflectance when its indices are computed
+    nodata = compact_nodata(data)
+    scale_factor = data.attrs.get("scale_factor", REFLECTANCE_SCALE)
+
+    # Band-first array for windowed access, computed once for all paddocks
+    if "band" in data.dims:
+        band_names = [str(b) for b in data.coords["band"].values]
+        values = np.asarray(data.transpose("band", "y", "x").values)
+    else:
+        band_names = None
+        values = np.asarray(data.transpose("y", "x").values)
+
+    cloudy = None
+    if cloud_mask is not None:
+        try:
+            cloudy = Raster.from_xarray(cloud_mask).reproject(grid, "nearest").data
+            cloudy = np.nan_to_num(cloudy, nan=0.0).astype(bool) if cloudy.dtype != bool else cloudy
+        except Exception as e:
+            logger.warning(f"Error aligning cloud mask to raster grid, paddocks count as clear: {e}")
+            cloudy = None
 
     # Create GeoDataFrame from paddocks
     geometries = []
@@ -160,7 +145,7 @@ def compute_zonal_stats(
         elif hasattr(geom, "geom_type"):
             geometry = geom
         else:
-            print(f"WARNING: Invalid geometry for paddock {paddock.get('externalId') or paddock.get('id')}")
+            logger.warning(f"Invalid geometry for paddock {paddock.get('externalId') or paddock.get('id')}")
             continue
 
         geometries.append(geometry)
@@ -169,7 +154,7 @@ def compute_zonal_stats(
         paddock_ids.append(str(paddock_id))
 
     if not geometries:
-        print("DEBUG: No valid geometries found")
+        logger.debug("No valid geometries found")
         return [create_invalid_result(p.get("id", "unknown")) for p in paddocks]
 
     gdf = gpd.GeoDataFrame(
@@ -178,26 +163,26 @@ def compute_zonal_stats(
         crs="EPSG:4326"
     )
 
-    print(f"DEBUG: Paddock GeoDataFrame CRS: {gdf.crs}")
+    logger.debug(f"Paddock GeoDataFrame CRS: {gdf.crs}")
 
     # Check paddock bounds
     for idx, row in gdf.iterrows():
         geom = row["geometry"]
-        print(f"DEBUG: Row {idx}: geometry type = {type(geom)}")
+        logger.debug(f"Row {idx}: geometry type = {type(geom)}")
         if hasattr(geom, 'bounds'):
             bounds = geom.bounds
-            print(f"DEBUG: Paddock {row['paddock_id']} bounds: {bounds}")
+            logger.debug(f"Paddock {row['paddock_id']} bounds: {bounds}")
         else:
-            print(f"DEBUG: Geometry has no bounds attribute")
+            logger.debug("Geometry has no bounds attribute")
 
     # If raster and polygons are in different CRS, transform polygons to raster CRS
     if gdf.crs != raster_crs:
-        print(f"DEBUG: Transforming polygons from {gdf.crs} to {raster_crs}")
+        logger.debug(f"Transforming polygons from {gdf.crs} to {raster_crs}")
         gdf = gdf.to_crs(raster_crs)
         # Re-check bounds after transformation
         for idx, row in gdf.iterrows():
             bounds = row.geometry.bounds
-            print(f"DEBUG: Transformed paddock {row['paddock_id']} bounds: {bounds}")
+            logger.debug(f"Transformed paddock {row['paddock_id']} bounds: {bounds}")
 
     # Clip data to each paddock and compute statistics
     results = []
@@ -207,35 +192,30 @@ def compute_zonal_stats(
         polygon = row["geometry"]
 
         try:
-            # Get polygon bounds for quick check
-            poly_bounds = polygon.bounds
-            data_x = data.coords['x'].values
-            data_y = data.coords['y'].values
-
-            # Quick bounds check - does polygon overlap with data?
-            if (poly_bounds[2] < data_x.min() or poly_bounds[0] > data_x.max() or
-                poly_bounds[3] < data_y.min() or poly_bounds[1] > data_y.max()):
-                print(f"DEBUG: Paddock {paddock_id} does not overlap with raster bounds, skipping")
+            # Rasterize the paddock over just the window it covers
+            rows, cols, inside = grid.geometry_mask(polygon, all_touched=True)
+
+            if not inside.any():
+                logger.debug(f"Paddock {paddock_id} does not overlap with raster bounds, skipping")
                 results.append(create_invalid_result(paddock_id))
                 continue
 
-            # Clip raster to polygon - use all_touched to include boundary pixels
-            clipped = data.rio.clip([polygon], all_touched=True)
+            logger.debug(f"Paddock window for {paddock_id}: {inside.shape}")
 
-            print(f"DEBUG: Clipped data shape for {paddock_id}: {clipped.shape}")
+            # Pixel values inside the polygon: (band, n) or (n,)
+            clipped = values[..., rows, cols][..., inside]
+            if nodata is not None:
+                clipped = scale_dn(clipped, nodata, scale_factor)
 
             # Check if we got valid data
-            if clipped.isnull().all():
-                print(f"DEBUG: All NaN values for {paddock_id}, skipping")
+            if np.isnan(clipped).all():
+                logger.debug(f"All NaN values for {paddock_id}, skipping")
                 results.append(create_invalid_result(paddock_id))
                 continue
 
-            # Get pixel values as numpy array
             # Handle both banded and single-band data
-            if "band" in clipped.dims:
-                # Multi-band data - extract each band
-                band_names = list(clipped.coords.get("band", range(clipped.sizes["band"])))
-                print(f"DEBUG: Band names: {band_names}")
+            if band_names is not None:
+                logger.debug(f"Band names: {band_names}")
 
                 # For NDVI, we need nir and red bands
                 ndvi_data = compute_ndvi_from_bands(clipped, band_names)
@@ -243,7 +223,7 @@ def compute_zonal_stats(
                 ndwi_data = compute_ndwi_from_bands(clipped, band_names)
             else:
                 # Single-band (already computed NDVI)
-                ndvi_data = clipped.values.flatten()
+                ndvi_data = clipped
                 evi_data = None
                 ndwi_data = None
 
@@ -252,7 +232,7 @@ def compute_zonal_stats(
 
             if len(valid_ndvi) == 0:
                 # No valid pixels in this paddock
-                print(f"DEBUG: No valid NDVI pixels for {paddock_id}")
+                logger.debug(f"No valid NDVI pixels for {paddock_id}")
                 results.append(create_invalid_result(paddock_id))
                 continue
 
@@ -280,23 +260,13 @@ def compute_zonal_stats(
 
             # Compute per-paddock cloud-free percentage
             paddock_cloud_free_pct = 1.0  # Default to fully clear if no cloud mask
-            if cloud_mask is not None:
-                try:
-                    # Ensure cloud mask has CRS for rioxarray clipping
-                    mask_with_crs = cloud_mask
-                    if not hasattr(cloud_mask, 'rio') or cloud_mask.rio.crs is None:
-                        mask_crs = cloud_mask.attrs.get('crs', raster_crs)
-                        mask_with_crs = cloud_mask.rio.write_crs(mask_crs)
-                    # Clip cloud mask to paddock geometry
-                    clipped_mask = mask_with_crs.rio.clip([polygon], all_touched=True)
-                    total_mask_pixels = clipped_mask.size
-                    cloudy_pixels = int(clipped_mask.sum().values)
-                    clear_pixels = total_mask_pixels - cloudy_pixels
-                    paddock_cloud_free_pct = float(clear_pixels) / total_mask_pixels if total_mask_pixels > 0 else 0.0
-                    print(f"DEBUG: {paddock_id}: cloud_free_pct={paddock_cloud_free_pct:.1%} ({clear_pixels}/{total_mask_pixels} clear)")
-                except Exception as e:
-                    print(f"DEBUG: Error computing cloud-free for {paddock_id}: {e}")
-                    paddock_cloud_free_pct = 1.0  # Assume clear on error
+            if cloudy is not None:
+                paddock_cloudy = cloudy[rows, cols][inside]
+                total_mask_pixels = paddock_cloudy.size
+                cloudy_pixels = int(paddock_cloudy.sum())
+                clear_pixels = total_mask_pixels - cloudy_pixels
+                paddock_cloud_free_pct = float(clear_pixels) / total_mask_pixels if total_mask_pixels > 0 else 0.0
+                logger.debug(f"{paddock_id}: cloud_free_pct={paddock_cloud_free_pct:.1%} ({clear_pixels}/{total_mask_pixels} clear)")
 
             # Determine validity based on pixel count AND cloud coverage
             # For a ~15ha paddock at 10m resolution, we expect ~1500 pixels
@@ -308,7 +278,7 @@ def compute_zonal_stats(
                 paddock_cloud_free_pct >= MIN_CLOUD_FREE_PCT
             )
 
-            print(f"DEBUG: {paddock_id}: ndvi_mean={ndvi_mean:.3f}, pixels={pixel_count}, cloud_free={paddock_cloud_free_pct:.1%}, valid={is_valid}")
+            logger.debug(f"{paddock_id}: ndvi_mean={ndvi_mean:.3f}, pixels={pixel_count}, cloud_free={paddock_cloud_free_pct:.1%}, valid={is_valid}")
 
             results.append(ZonalStatsResult(
                 paddock_id=paddock_id,
@@ -324,16 +294,15 @@ def compute_zonal_stats(
             ))
 
         except Exception as e:
-            import traceback
-            print(f"DEBUG: Error computing stats for paddock {paddock_id}: {e}")
-            traceback.print_exc()
+            logger.warning(f"Error computing stats for paddock {paddock_id}: {e}", exc_info=True)
             results.append(create_invalid_result(paddock_id))
 
     return results
 
 
-def compute_ndvi_from_bands(data: xr.DataArray, band_names: list) -> np.ndarray:
-    """Compute NDVI array from band data."""
+def compute_ndvi_from_bands(data: 'xr.DataArray | np.ndarray', band_names: list) -> np.ndarray:
+    """Compute NDVI array from band-first data (DataArray or array)."""
+    data = np.asarray(data)
     try:
         nir_idx = band_names.index("nir")
         red_idx = band_names.index("red")
@@ -343,28 +312,29 @@ def compute_ndvi_from_bands(data: xr.DataArray, band_names: list) -> np.ndarray:
             nir_idx = band_names.index("B08")
             red_idx = band_names.index("B04")
         except ValueError:
-            return np.full(data.values.shape[1:], np.nan)
+            return np.full(data.shape[1:], np.nan)
 
-    nir = data.isel(band=nir_idx).values
-    red = data.isel(band=red_idx).values
+    nir = data[nir_idx]
+    red = data[red_idx]
 
     with np.errstate(divide="ignore", invalid="ignore"):
         ndvi = (nir - red) / (nir + red)
         return np.where(np.isfinite(ndvi), ndvi, np.nan)
 
 
-def compute_evi_from_bands(data: xr.DataArray, band_names: list) -> np.ndarray:
-    """Compute EVI array from band data."""
+def compute_evi_from_bands(data: 'xr.DataArray | np.ndarray', band_names: list) -> np.ndarray:
+    """Compute EVI array from band-first data (DataArray or array)."""
+    data = np.asarray(data)
     try:
         nir_idx = band_names.index("nir")
         red_idx = band_names.index("red")
         blue_idx = band_names.index("blue")
     except ValueError:
-        return np.full(data.values.shape[1:], np.nan)
+        return np.full(data.shape[1:], np.nan)
 
-    nir = data.isel(band=nir_idx).values.astype(float)
-    red = data.isel(band=red_idx).values.astype(float)
-    blue = data.isel(band=blue_idx).values.astype(float)
+    nir = data[nir_idx].astype(float)
+    red = data[red_idx].astype(float)
+    blue = data[blue_idx].astype(float)
 
     g, c1, c2, l = 2.5, 6.0, 7.5, 1.0
 
@@ -373,8 +343,9 @@ def compute_evi_from_bands(data: xr.DataArray, band_names: list) -> np.ndarray:
         return np.where(np.isfinite(evi), evi, np.nan)
 
 
-def compute_ndwi_from_bands(data: xr.DataArray, band_names: list) -> np.ndarray:
-    """Compute NDWI array from band data."""
+def compute_ndwi_from_bands(data: 'xr.DataArray | np.ndarray', band_names: list) -> np.ndarray:
+    """Compute NDWI array from band-first data (DataArray or array)."""
+    data = np.asarray(data)
     try:
         nir_idx = band_names.index("nir")
         swir_idx = band_names.index("swir")
@@ -384,10 +355,10 @@ def compute_ndwi_from_bands(data: xr.DataArray, band_names: list) -> np.ndarray:
             nir_idx = band_names.index("B08")
             swir_idx = band_names.index("B11")
         except ValueError:
-            return np.full(data.values.shape[1:], np.nan)
+            return np.full(data.shape[1:], np.nan)
 
-    nir = data.isel(band=nir_idx).values.astype(float)
-    swir = data.isel(band=swir_idx).values.astype(float)
+    nir = data[nir_idx].astype(float)
+    swir = data[swir_idx].astype(float)
 
     with np.errstate(divide="ignore", invalid="ignore"):
         ndwi = (nir - swir) / (nir + swir)
@@ -426,15 +397,14 @@ def compute_cloud_free_percentage_for_paddock(
     Returns:
         Percentage of cloud-free pixels as 0.0-1.0
     """
-    import rioxarray
-
     try:
-        # Clip mask to polygon
-        clipped = cloud_free_mask.rio.clip([polygon], from_disk=True)
+        grid = GeoBox.from_xarray(cloud_free_mask)
+        rows, cols, inside = grid.geometry_mask(polygon, all_touched=False)
 
-        # Get valid and total pixels
-        valid_count = np.sum(~np.isnan(clipped.values))
-        total_count = clipped.values.size
+        # Get valid and total pixels inside the polygon
+        clipped = np.asarray(cloud_free_mask.values, dtype=float)[rows, cols][inside]
+        valid_count = np.sum(~np.isnan(clipped) & (clipped != 0))
+        total_count = clipped.size
 
         return float(valid_count) / float(total_count) if total_count > 0 else 0.0
 